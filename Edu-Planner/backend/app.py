@@ -1,11 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import HTTPConnection
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+from functools import lru_cache
+import asyncio
+import gzip
+import hashlib
 import sys
 from pathlib import Path
 import os
 import json
+import threading
+
+try:
+    import brotli  # optional; gzip is used when it is not installed
+except ImportError:
+    brotli = None
 
 # Ensure src is importable when running backend directly
 repo_root = Path(__file__).resolve().parents[1]
@@ -13,14 +27,75 @@ src_path = str(repo_root / 'src')
 if src_path not in sys.path:
     sys.path.insert(0, src_path)
 
-from agents.evaluator import EvaluatorAgent
-from agents.optimizer import OptimizerAgent
-from agents.analyst_v2 import AnalystAgent
-from utils.io import load_questions, save_generated_questions, save_user_iteration, get_user_best_plan
-from utils.prompts import get_question_generation_prompt
-from llm import call_llm
-
-app = FastAPI(title="Edu-Planner Backend")
+from utils.io import (load_questions, save_user_iteration, get_user_best_plan,
+                      get_user_version, load_user_history_page, diff_user_plans)
+# aliased: the POST /api/user/{user_id}/generate_questions endpoint below is named
+# generate_questions (the ratelimit.endpoints key) and would shadow the helper
+from utils.question_gen import GeneratedQuestionStore, generate_questions as generate_question_set
+from llm import count_llm_tokens, llm_session, get_session, get_router
+from utils.config import get_setting
+from utils.warmup import ModelWarmer
+from utils.tracing import trace_session
+from utils.scheduler import get_scheduler
+from utils.ratelimit import get_rate_limiter
+from utils.quiz_prefetch import get_prefetcher, plan_hash, prefetch_enabled, save_best_plan
+from utils.scheduler import llm_priority
+from utils.cascade import cascade_stats
+from utils.structured import structured_stats
+from utils.plan_library import DIMENSIONS, get_plan_library, profile_of, warm_start_plan
+from core.session import DEFAULT_CONFIG, default_plan, run_session
+from utils.opt_memory import get_memory
+from utils.write_behind import get_store
+
+warmer = ModelWarmer()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the configured models while the pod is still reporting not-ready,
+    # so the first student request doesn't pay Ollama's model load time.
+    if get_setting('llm.warmup.enabled', True):
+        warmer.start()
+    yield
+    warmer.stop()
+    # put buffered history / best-plan writes on disk before the process exits
+    get_store().close()
+
+
+async def rate_limit(request: HTTPConnection):
+    """Per-user token buckets (utils.ratelimit); 429 with Retry-After when empty."""
+    if not get_setting('ratelimit.enabled', True) or request.scope['type'] == 'websocket':
+        # WebSocket sessions are limited per run (session_ws)
+        return
+    endpoint = getattr(request.scope.get('route'), 'name', '')
+    if endpoint in (get_setting('ratelimit.exempt', None) or []):
+        return
+    user = request.path_params.get('user_id')
+    if not user and request.method == 'POST':
+        try:
+            body = await request.json()
+            user = body.get('user_id') if isinstance(body, dict) else None
+        except Exception:
+            user = None
+    user = str(user) if user else f"ip:{request.client.host if request.client else 'unknown'}"
+
+    limiter = get_rate_limiter()
+    req_limit, llm_limit = limiter.check(user, endpoint)
+    headers = req_limit.headers()
+    if llm_limit is not None:
+        headers.update(llm_limit.headers("X-LLM-Tokens"))
+        # the middleware charges the tokens this request's LLM calls used
+        request.state.ratelimit_user = user
+    request.state.ratelimit_headers = headers
+    if not req_limit.allowed:
+        raise HTTPException(status_code=429, detail=f"Too many {endpoint} requests; retry in {req_limit.retry_after}s",
+                            headers=headers)
+    if llm_limit is not None and not llm_limit.allowed:
+        raise HTTPException(status_code=429, detail=f"LLM token quota used up; retry in {llm_limit.retry_after}s",
+                            headers=headers)
+
+
+app = FastAPI(title="Edu-Planner Backend", lifespan=lifespan, dependencies=[Depends(rate_limit)])
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,9 +103,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset",
+                    "X-LLM-Tokens-Limit", "X-LLM-Tokens-Remaining", "X-LLM-Tokens-Reset"],
 )
 
 
+@app.middleware("http")
+async def rate_limit_headers(request: Request, call_next):
+    with count_llm_tokens() as used:
+        response = await call_next(request)
+    headers = dict(getattr(request.state, 'ratelimit_headers', None) or {})
+    user = getattr(request.state, 'ratelimit_user', None)
+    if user and used["calls"]:
+        charged = get_rate_limiter().charge_llm(user, used["prompt_eval_count"] + used["eval_count"])
+        headers.update(charged.headers("X-LLM-Tokens"))
+    for name, value in headers.items():
+        response.headers.setdefault(name, value)
+    return response
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # a sampled request gets its own trace file (tracing.sample_rate)
+    with trace_session(f"http:{request.method}:{request.url.path}"):
+        return await call_next(request)
+
+
 class QuestionRequest(BaseModel):
     level: Optional[str] = "easy"
     n: Optional[int] = 10
@@ -40,6 +138,7 @@ class EvaluateRequest(BaseModel):
     user_id: str
     plan: str
     sample_questions: Optional[List[dict]] = None
+    level: str = "easy"  # of the quiz prefetched when this plan becomes the user's best
 
 
 class OptimizeRequest(BaseModel):
@@ -47,6 +146,11 @@ class OptimizeRequest(BaseModel):
     plan: str
     feedback: Optional[str] = ""
     scores: Optional[dict] = None
+    level: str = "easy"
+
+
+class InitialPlanRequest(BaseModel):
+    skills: Optional[Dict[str, int]] = None
 
 
 class GenerateRequest(BaseModel):
@@ -55,9 +159,72 @@ class GenerateRequest(BaseModel):
     n: int = 10
 
 
-evaluator = EvaluatorAgent()
-optimizer = OptimizerAgent()
-analyst = AnalystAgent()
+class SessionStart(BaseModel):
+    user_id: str
+    level: str = "easy"
+    answers: Optional[List[dict]] = None
+    skills: Optional[Dict[str, int]] = None
+    iterations: Optional[int] = None
+    # None -> the user's best plan, the plan library's or lessonplan.txt
+    plan: Optional[str] = None
+
+
+# Agents are constructed on first use rather than at import time so that a
+# fresh worker can bind its port (and answer /api/questions) immediately.
+@lru_cache(maxsize=None)
+def get_evaluator():
+    from agents.evaluator import EvaluatorAgent
+    return EvaluatorAgent()
+
+
+@lru_cache(maxsize=None)
+def get_optimizer():
+    from agents.optimizer import OptimizerAgent
+    return OptimizerAgent()
+
+
+@lru_cache(maxsize=None)
+def get_analyst():
+    from agents.analyst_v2 import AnalystAgent
+    return AnalystAgent()
+
+
+@app.get("/api/ready")
+def ready():
+    """Readiness probe: 200 once every configured model is resident in Ollama, else 503."""
+    status = warmer.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/api/llm/endpoints")
+def llm_endpoints():
+    """Routing view of every configured Ollama host: health, load, resident models."""
+    router = get_router()
+    return {"endpoints": router.status(), "stats": router.stats()}
+
+
+@app.get("/api/llm/queue")
+def llm_queue():
+    """LLM scheduler: slots in use and per-class queue length and wait times."""
+    return get_scheduler().stats()
+
+
+@app.get("/api/llm/cascade")
+def llm_cascade():
+    """Small/large model cascade: per-profile hit rate, escalation reasons and latency."""
+    return cascade_stats()
+
+
+@app.get("/api/llm/structured")
+def llm_structured():
+    """Agent responses parsed as is, parsed after local repair (LLM calls saved) and unparseable."""
+    return structured_stats()
+
+
+@app.get("/api/storage/write_behind")
+def storage_write_behind():
+    """Write-behind buffer: files pending, writes coalesced, flush batches and time, errors."""
+    return get_store().stats()
 
 
 @app.get("/api/questions")
@@ -101,37 +268,184 @@ def get_questions(level: str = "easy", n: int = 10):
 
 @app.post("/api/evaluate")
 def evaluate(req: EvaluateRequest):
+    level = _level_name(req.level)  # a bad level is a 400 before anything is saved
     try:
-        scores, feedback = evaluator.evaluate(req.plan, None, sample_questions=req.sample_questions)
+        with llm_session(req.user_id):
+            scores, feedback = get_evaluator().evaluate(req.plan, None, sample_questions=req.sample_questions)
         # persist iteration as a placeholder (score summary)
         entry = {"plan": req.plan, "score": sum(scores.values())/len(scores) if scores else 0, "scores": scores}
         save_user_iteration(req.user_id, entry)
+        save_best_plan(req.user_id, entry, level)
+        memory = get_memory()
+        if memory is not None and scores:
+            # closes the optimizer attempt that produced this plan, if any
+            memory.record_outcome(req.user_id, req.plan, entry["score"], scores)
         return {"scores": scores, "feedback": feedback}
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/optimize")
 def optimize(req: OptimizeRequest):
+    level = _level_name(req.level)
     try:
-        opt = optimizer.optimize(req.plan, req.feedback or "", None)
-        # persist candidate iteration
-        entry = {"plan": opt.get('plan', req.plan), "score": opt.get('score', 0), "scores": req.scores or {}}
+        memory = get_memory()
+        score = sum(req.scores.values()) / len(req.scores) if req.scores else None
+        history = focus = None
+        if memory is not None:
+            if score is not None:
+                memory.record_outcome(req.user_id, req.plan, score, req.scores)
+            history, focus = memory.history(req.user_id), memory.focus_next(req.user_id) or None
+        with llm_session(req.user_id):
+            opt = get_optimizer().optimize(req.plan, req.feedback or "", None, history=history, focus_areas=focus)
+        if memory is not None and opt.get('plan') and opt['plan'] != req.plan:
+            if memory.is_rejected(req.user_id, opt['plan']):
+                # this exact plan already scored worse than its predecessor
+                opt = dict(opt, plan=req.plan, rejected_plan=True)
+            elif score is not None:
+                memory.record_attempt(req.user_id, opt, score, req.scores)
+        # persist candidate iteration; req.scores belong to the plan it was made from
+        entry = {"plan": opt.get('plan', req.plan), "score": opt.get('score', 0), "scores": {}, "candidate": True}
         save_user_iteration(req.user_id, entry)
+        save_best_plan(req.user_id, entry, level)
         return opt
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+HISTORY_MAX_LIMIT = 200
+COMPRESS_MIN_BYTES = 1024
+
+# encoded (and compressed) bodies of recent history pages, keyed by ETag and encoding
+_body_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_body_cache_lock = threading.Lock()
+
+
+def _accepted_encodings(request: Request) -> set:
+    return {part.split(';')[0].strip().lower() for part in request.headers.get('accept-encoding', '').split(',')}
+
+
+def _encoded_json(request: Request, etag: str, payload_fn) -> Response:
+    """Serialise `payload_fn()` as compact JSON, compressed with br or gzip when accepted.
+
+    Bodies are cached per (etag, encoding), so repeated polls skip both the
+    history load and the encoding.
+    """
+    accepted = _accepted_encodings(request)
+    encoding = 'br' if brotli is not None and 'br' in accepted else 'gzip' if 'gzip' in accepted else None
+    key = (etag, encoding)
+    with _body_cache_lock:
+        body = _body_cache.get(key)
+        if body is not None:
+            _body_cache.move_to_end(key)
+    if body is None:
+        body = json.dumps(payload_fn(), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        if encoding and len(body) < COMPRESS_MIN_BYTES:
+            encoding, key = None, (etag, None)
+        elif encoding == 'br':
+            body = brotli.compress(body, quality=5)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        with _body_cache_lock:
+            _body_cache[key] = body
+            while len(_body_cache) > 256:
+                _body_cache.popitem(last=False)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/api/user/{user_id}/history")
-def user_history(user_id: str):
+def user_history(user_id: str, request: Request, cursor: Optional[str] = None, limit: int = 20,
+                 fields: Optional[str] = None):
+    """One page of the user's plan history, oldest first.
+
+    `cursor` is the `next_cursor` of the previous page; `fields` is a comma
+    list of entry keys to return (e.g. `score,scores,iteration` to skip the
+    plan text). Responses carry an ETag from the user's history version, so
+    polling with `If-None-Match` gets a 304 until a new iteration is saved.
+    """
     try:
-        from utils.io import load_user_history
-        return {"history": load_user_history(user_id)}
+        start = int(cursor) if cursor else 0
+        if start < 0:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    field_list = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
+    try:
+        version = get_user_version(user_id)
+        query = hashlib.sha1(f"{start}:{limit}:{','.join(field_list or [])}".encode()).hexdigest()[:12]
+        etag = f'W/"{user_id}-{version}-{query}"'
+        if_none_match = request.headers.get('if-none-match', '')
+        if etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+        def page():
+            items, total = load_user_history_page(user_id, start, limit, field_list)
+            end = start + len(items)
+            return {
+                "history": items,
+                "total": total,
+                "version": version,
+                "next_cursor": str(end) if end < total else None,
+            }
+
+        return _encoded_json(request, etag, page)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/analytics")
+def analytics(top_topics: int = 10):
+    """Cohort-wide CIDDP aggregates (maintained on every saved iteration)."""
+    from utils.analytics import cohort_summary
+    try:
+        return cohort_summary(top_topics=max(0, top_topics))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/user/{user_id}/history/diff")
+def user_history_diff(user_id: str, a: int, b: int):
+    """Chapter-level changes between history entries `a` and `b` (the `index` of each entry)."""
+    diff = diff_user_plans(user_id, a, b)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return diff
+
+
+@app.get("/api/user/{user_id}/quota")
+def user_quota(user_id: str):
+    """Remaining requests per endpoint bucket and LLM tokens for the user."""
+    return get_rate_limiter().usage(user_id)
+
+
+@app.get("/api/user/{user_id}/llm_usage")
+def user_llm_usage(user_id: str):
+    """Prompt-token accounting for the user's LLM session (prefix-cache savings)."""
+    return get_session(user_id).report()
+
+
+@app.get("/api/user/{user_id}/optimizer_memory")
+def user_optimizer_memory(user_id: str):
+    """Recent optimizer edits with their score outcomes, per-area totals, and the prompt history built from them."""
+    memory = get_memory()
+    if memory is None:
+        raise HTTPException(status_code=404, detail="optimizer_memory is disabled")
+    return dict(memory.load(user_id), history=memory.history(user_id), converged=memory.converged(user_id))
+
+
 @app.get("/api/user/{user_id}/best")
 def user_best(user_id: str):
     try:
@@ -141,6 +455,78 @@ def user_best(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/user/{user_id}/initial_plan")
+def initial_plan(user_id: str, req: InitialPlanRequest):
+    """The plan to start the user's loop from: their best plan, else the plan
+    library's plan for the nearest skill profile, else data/lessonplan.txt."""
+    best = get_user_best_plan(user_id)
+    if best and best.get('plan'):
+        return {"plan": best['plan'], "source": "user_best", "score": best.get('score')}
+    skills = req.skills or {}
+    unknown = [d for d in skills if d not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown skill dimensions: {', '.join(unknown)}")
+    entry = warm_start_plan(skills)
+    if entry is not None:
+        return {"plan": entry['plan'], "source": "plan_library", "score": entry.get('score'),
+                "library_profile": dict(zip(DIMENSIONS, entry['profile'])), "distance": entry['distance']}
+    return {"plan": default_plan(), "source": "default", "profile": dict(zip(DIMENSIONS, profile_of(skills)))}
+
+
+@app.get("/api/plan_library")
+def plan_library():
+    """Skill profiles with a precomputed plan (plans themselves are not listed)."""
+    return {"entries": get_plan_library().summary()}
+
+
+def _level_name(level: str) -> str:
+    names = {"1": "easy", "2": "intermediate", "3": "hard"}
+    lvl = names.get(str(level), str(level).lower())
+    if lvl not in names.values():
+        raise HTTPException(status_code=400, detail="Level must be 1,2,3 or 'easy','intermediate','hard'")
+    return lvl
+
+
+def _best_plan_text(user_id: str) -> str:
+    best = get_user_best_plan(user_id)
+    plan_text = best.get('plan') if best else ""
+    if not plan_text:
+        raise HTTPException(status_code=404, detail=f"No saved plan for user {user_id}")
+    return plan_text
+
+
+@app.post("/api/user/{user_id}/quiz/prefetch", status_code=202)
+def prefetch_quiz(user_id: str, level: str = "easy", n: Optional[int] = None):
+    """Start generating the next quiz for the user's best plan in the background."""
+    lvl = _level_name(level)
+    plan_text = _best_plan_text(user_id)
+    queued = prefetch_enabled() and get_prefetcher().schedule(user_id, plan_text, lvl, n)
+    return {"queued": bool(queued), "plan_hash": plan_hash(plan_text), "level": lvl}
+
+
+@app.get("/api/user/{user_id}/quiz")
+def user_quiz(user_id: str, level: str = "easy", n: int = 10):
+    """Next personalised quiz for the user's best plan.
+
+    Served from the prefetch cache when a set for this exact plan is ready
+    (or waits for the one being generated); otherwise generated now.
+    """
+    lvl = _level_name(level)
+    plan_text = _best_plan_text(user_id)
+    questions = get_prefetcher().get(user_id, plan_text, lvl, n) if prefetch_enabled() else None
+    if questions and len(questions) >= n:
+        return {"questions": questions, "source": "prefetched", "plan_hash": plan_hash(plan_text)}
+    try:
+        # the student is waiting: interactive, not the background class question generation defaults to
+        with llm_priority("interactive"), llm_session(user_id):
+            gen = generate_question_set(plan_text, lvl, n, store=GeneratedQuestionStore(lvl, append_to_bank=False))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    if not gen['questions']:
+        raise HTTPException(status_code=502, detail="No valid questions in LLM response")
+    return {"questions": gen['questions'], "source": "generated", "plan_hash": plan_hash(plan_text)}
+
+
 @app.post("/api/user/{user_id}/generate_questions")
 def generate_questions(user_id: str, req: GenerateRequest):
     try:
@@ -167,22 +553,147 @@ def generate_questions(user_id: str, req: GenerateRequest):
         if not plan_text:
             plan_text = req.user_id  # minimal fallback
 
-        prompt = get_question_generation_prompt(plan_text, lvl, req.n)
-        resp = call_llm(prompt)
-        # extract JSON array
-        start = resp.find('[')
-        end = resp.rfind(']')
-        if start == -1 or end == -1:
-            raise ValueError("No JSON array in LLM response")
-        arr_text = resp[start:end+1]
-        questions = json.loads(arr_text)
+        # sharded and concurrent; the file is rewritten as each shard lands
         filename = f"generated_questions_{req.level}_{user_id}.json"
-        save_generated_questions(filename, questions)
-        return {"filename": filename, "count": len(questions)}
+        store = GeneratedQuestionStore(lvl, filename, append_to_bank=False)
+        # background class (llm.scheduler.profiles); the session makes it share fairly with other users
+        with llm_session(user_id):
+            gen = generate_question_set(plan_text, lvl, req.n, store=store)
+        if not gen['questions']:
+            raise ValueError("No valid questions in LLM response")
+        return {"filename": filename, "count": len(gen['questions']), "shards": gen['shards'],
+                "retries": gen['retries'], "failed_shards": gen['failed_shards']}
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+SESSION_MAX_ITERATIONS = 10
+
+
+def _session_admit(user_id: str) -> Optional[dict]:
+    """None if the user may start another session run, else the message refusing it."""
+    if not get_setting('ratelimit.enabled', True):
+        return None
+    req_limit, llm_limit = get_rate_limiter().check(user_id, "session_ws")
+    for limit in (req_limit, llm_limit):
+        if limit is not None and not limit.allowed:
+            return {"type": "rate_limited", "bucket": limit.name, "retry_after": limit.retry_after}
+    return None
+
+
+@app.websocket("/api/ws/session")
+async def session_ws(websocket: WebSocket):
+    """Run the evaluate -> optimize -> analyze loop server-side and push each stage as it finishes.
+
+    The client sends `{"type": "start", ...SessionStart}`, then optionally
+    `{"type": "continue", "iterations": n, "answers": [...]}` to keep
+    optimising the plan the connection holds, and `{"type": "stop"}` to end
+    a run after its current stage. See backend/README.md for the messages sent.
+    """
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    outbox: asyncio.Queue = asyncio.Queue()
+    state: Optional[dict] = None
+    running: Optional[asyncio.Task] = None
+    stop = threading.Event()
+
+    async def send_all():
+        try:
+            while True:
+                await websocket.send_json(await outbox.get())
+        except (WebSocketDisconnect, RuntimeError):
+            stop.set()  # the client went away
+
+    def push(stage: str, payload: dict):
+        # called from the session's worker thread
+        if stage == "initial_plan" and state["next_iteration"] > 1:
+            return  # a continued run starts from the plan the client already has
+        loop.call_soon_threadsafe(outbox.put_nowait, dict(payload, type=stage))
+
+    def run(config: dict) -> dict:
+        with count_llm_tokens() as used:
+            result = run_session(state["user_id"], state["level"], state["answers"], config, on_stage=push, stop=stop)
+        if used["calls"] and get_setting('ratelimit.enabled', True):
+            get_rate_limiter().charge_llm(state["user_id"], used["prompt_eval_count"] + used["eval_count"])
+        return result
+
+    async def run_and_report(iterations: int):
+        config = {"iterations": iterations, "skills": state["skills"], "initial_plan": state["plan"],
+                  "first_iteration": state["next_iteration"], "session_name": f"ws:{state['user_id']}"}
+        try:
+            result = await asyncio.to_thread(run, config)
+        except Exception as e:
+            await outbox.put({"type": "error", "detail": str(e)})
+            return
+        # the connection keeps the plan to continue from and where the numbering is
+        state["plan"] = result["final_plan"]
+        state["next_iteration"] += len(result["iterations"])
+        if result["best_score"] is not None and (state["best_score"] is None or result["best_score"] >= state["best_score"]):
+            state["best_score"], state["best_plan"] = result["best_score"], result["best_plan"]
+        summary = {k: v for k, v in result.items() if k not in ("final_plan", "best_plan")}
+        await outbox.put({"type": "done", "summary": summary, "session_best_score": state["best_score"]})
+
+    sender = asyncio.create_task(send_all())
+    try:
+        while True:
+            try:
+                msg = await websocket.receive_json()
+            except (ValueError, KeyError):
+                await outbox.put({"type": "error", "detail": "messages must be JSON objects"})
+                continue
+            kind = msg.get("type") if isinstance(msg, dict) else None
+            if kind == "stop":
+                stop.set()
+                continue
+            if kind not in ("start", "continue"):
+                await outbox.put({"type": "error", "detail": f"unknown message type {kind!r}"})
+                continue
+            if running is not None and not running.done():
+                await outbox.put({"type": "error", "detail": "a run is in progress; send stop first"})
+                continue
+            if kind == "start":
+                try:
+                    req = SessionStart(**{k: v for k, v in msg.items() if k != "type"})
+                    level = _level_name(req.level)
+                except Exception as e:
+                    await outbox.put({"type": "error", "detail": f"invalid start message: {e}"})
+                    continue
+                unknown = [d for d in (req.skills or {}) if d not in DIMENSIONS]
+                if unknown:
+                    await outbox.put({"type": "error", "detail": f"Unknown skill dimensions: {', '.join(unknown)}"})
+                    continue
+                state = {"user_id": req.user_id, "level": level, "answers": req.answers or [],
+                         "skills": req.skills or DEFAULT_CONFIG["skills"], "plan": req.plan,
+                         "next_iteration": 1, "best_score": None, "best_plan": None}
+                iterations = req.iterations
+            else:
+                if state is None:
+                    await outbox.put({"type": "error", "detail": "send start first"})
+                    continue
+                if msg.get("answers") is not None:
+                    state["answers"] = msg["answers"]
+                iterations = msg.get("iterations")
+            try:
+                iterations = int(iterations or DEFAULT_CONFIG["iterations"])
+            except (TypeError, ValueError):
+                await outbox.put({"type": "error", "detail": "iterations must be a number"})
+                continue
+            refused = _session_admit(state["user_id"])
+            if refused is not None:
+                await outbox.put(refused)
+                continue
+            stop.clear()
+            running = asyncio.create_task(run_and_report(max(1, min(iterations, SESSION_MAX_ITERATIONS))))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # a run in progress ends after its current stage; what it evaluated is saved
+        stop.set()
+        sender.cancel()
+
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
@@ -0,0 +1,347 @@
+"""Micro-benchmarks for the Python hot paths, on synthetic data at several scales.
+
+Covers question-bank loading and appending, saving to and reading from large
+plan histories (buffered, flushed and write-through), the evaluator's JSON
+and legacy bracket parsing, the optimizer's response parsing (well formed
+and truncated), evaluator/optimizer prompt construction and
+`compute_ciddp_score`.
+
+Each benchmark is timed like `timeit`: calls are batched until a batch takes
+at least --min-time seconds, and the median per-call time over --repeat
+batches is reported, together with the fastest batch, which --compare uses
+as it is the least disturbed by other load on the machine. Everything runs
+against a temporary directory standing in for data/ and cache/, so nothing
+in the repository is modified. Writes are not fsynced: that measures the
+disk, not the code.
+
+Scales (questions in the bank / history entries / plan chapters):
+    small   500 / 50 / 8
+    medium  5000 / 500 / 24
+    large   50000 / 2000 / 60
+
+Examples:
+    python scripts/bench_hot_paths.py                          # small and medium
+    python scripts/bench_hot_paths.py --scale large --only parse
+    python scripts/bench_hot_paths.py --save cache/bench_baseline.json
+    python scripts/bench_hot_paths.py --compare cache/bench_baseline.json --max-regression 0.25
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io as _stdio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from core.ciddp import compute_ciddp_score
+from core.records import CIDDP_DIMENSIONS
+from utils import analytics, codec, io, write_behind
+from utils.prompts import get_evaluator_prompt, get_optimizer_prompt
+from utils.write_behind import WriteBehindStore
+
+SCALES: Dict[str, Dict[str, int]] = {
+    "small": {"questions": 500, "entries": 50, "chapters": 8},
+    "medium": {"questions": 5000, "entries": 500, "chapters": 24},
+    "large": {"questions": 50000, "entries": 2000, "chapters": 60},
+}
+TOPICS = ["Processes", "Threads", "Scheduling", "Paging", "Virtual Memory", "File Systems", "Deadlocks", "I/O"]
+SKILLS = "Processes_and_Threads: Level 2; Memory_Management: Level 3; Scheduling: Level 1"
+
+
+# --- synthetic data -------------------------------------------------------
+
+def synthetic_questions(n: int, level: str = "easy", seed: int = 0, prefix: str = "q") -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        topic = rng.choice(TOPICS)
+        options = [f"{topic} option {j} for {prefix}{i}" for j in range(4)]
+        out.append({
+            "id": f"{prefix}{i}",
+            "topic": topic,
+            "level": level,
+            "question": f"Which statement about {topic.lower()} holds in case {prefix}{i}?",
+            "options": options,
+            "answer": rng.choice(options),
+            "explanation": "The operating system " + "schedules and maps " * rng.randint(2, 8),
+        })
+    return out
+
+
+def synthetic_plan(chapters: int, version: int = 0, seed: int = 0) -> str:
+    """A lesson plan of `chapters` chapters; consecutive versions differ in a few lines."""
+    rng = random.Random(seed)
+    lines = []
+    for c in range(1, chapters + 1):
+        topic = TOPICS[c % len(TOPICS)]
+        lines += [f"Chapter {c}: {topic}", "", f"Objective: understand {topic.lower()} in depth."]
+        lines += [f"- Key point {k} on {topic.lower()}: " + "details " * rng.randint(3, 9) for k in range(4)]
+        lines.append("")
+    # each version rewrites a few lines, like an optimizer pass
+    edit = random.Random(seed * 7919 + version)
+    for _ in range(min(version, 3)):
+        i = edit.randrange(len(lines))
+        lines[i] = f"- Revised in version {version}: " + "example " * edit.randint(2, 6)
+    return "\n".join(lines)
+
+
+def synthetic_entry(chapters: int, version: int, seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed * 31 + version)
+    scores = {d: rng.randint(1, 5) for d in CIDDP_DIMENSIONS}
+    return {
+        "plan": synthetic_plan(chapters, version, seed),
+        "score": round(sum(scores.values()) / len(scores), 2),
+        "scores": scores,
+        "iteration": version % 10 + 1,
+        "weak_topics": rng.sample(TOPICS, 2),
+    }
+
+
+def evaluator_json_response() -> str:
+    return json.dumps({
+        "scores": {d: 4 for d in CIDDP_DIMENSIONS},
+        "comments": {d: f"{d} is adequate; add more worked examples." for d in CIDDP_DIMENSIONS},
+        "summary": "A solid plan that needs more practice material.",
+    })
+
+
+def evaluator_bracket_response() -> str:
+    return "\n".join([
+        "Here is my evaluation of the lesson plan.",
+        "[C]:4; Clear chapter structure",
+        "[I]:3; Some gaps between memory chapters",
+        "[D]:4; Good depth on scheduling",
+        "[P]:5; Uses real shell examples",
+        "[P]:4; Matches beginner level",
+        "Overall the plan is appropriate.",
+    ])
+
+
+def optimizer_response(chapters: int, truncated: bool = False) -> str:
+    text = json.dumps({
+        "plan": synthetic_plan(chapters, 1),
+        "improvements": [{"text": f"Added examples to chapter {i}", "area": TOPICS[i % len(TOPICS)], "priority": 2}
+                         for i in range(1, 6)],
+        "focus_next": ["Paging", "Deadlocks"],
+        "exercise": {"title": "Trace a page fault", "steps": ["step 1", "step 2", "step 3"]},
+    })
+    # cut inside the improvements list: the repair pass has to close it
+    return text[:text.find('"focus_next"') - 30] if truncated else text
+
+
+# --- timing ---------------------------------------------------------------
+
+def time_call(fn: Callable[[], Any], repeat: int, min_time: float,
+              setup: Optional[Callable[[], Any]] = None) -> Tuple[float, float]:
+    """(median, min) seconds per call of `fn`; `setup` runs untimed before every call."""
+    def batch(number: int) -> float:
+        elapsed = 0.0
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            fn()
+            elapsed += time.perf_counter() - started
+        return elapsed
+
+    number = 1
+    while True:
+        elapsed = batch(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    per_call = [batch(number) / number for _ in range(max(1, repeat))]
+    return statistics.median(per_call), min(per_call)
+
+
+def fmt_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:8.2f} s "
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:8.2f} ms"
+    return f"{seconds * 1e6:8.1f} us"
+
+
+# --- benchmarks -----------------------------------------------------------
+
+def use_store(store: WriteBehindStore) -> WriteBehindStore:
+    # utils.io writes through the process-wide store
+    write_behind._store = store
+    return store
+
+
+def benchmarks(root: Path, scale: Dict[str, int],
+               stores: List[WriteBehindStore]) -> List[Tuple[str, Callable[[], Any], Optional[Callable[[], Any]]]]:
+    """(name, fn, per-call setup) for one scale, with its data written under `root`;
+    the write-behind stores it uses are added to `stores`."""
+    data = root / 'data'
+    data.mkdir(parents=True, exist_ok=True)
+    chapters = scale["chapters"]
+
+    bank = data / 'os_questions_easy.json'
+    codec.write_json(bank, synthetic_questions(scale["questions"]))
+    bank_bytes = bank.read_bytes()
+    new_questions = synthetic_questions(20, prefix="new")
+
+    def restore_bank():
+        bank.write_bytes(bank_bytes)
+
+    # one long history per scale, built through the normal save path and flushed
+    store = use_store(WriteBehindStore(flush_interval=3600, max_pending=10 ** 6, fsync=False))
+    for v in range(scale["entries"]):
+        io.save_user_iteration("bench", synthetic_entry(chapters, v))
+    store.flush()
+    history_file = data / 'user_plans' / 'bench.json'
+    history_bytes = history_file.read_bytes()
+    version = [scale["entries"]]
+
+    def next_entry():
+        version[0] += 1
+        return synthetic_entry(chapters, version[0])
+
+    def restore_history():
+        history_file.write_bytes(history_bytes)
+
+    buffered = WriteBehindStore(flush_interval=3600, max_pending=10 ** 6, fsync=False)
+    through = WriteBehindStore(enabled=False, fsync=False)
+    stores += [store, buffered, through]
+
+    def save_buffered():
+        io.save_user_iteration("bench", next_entry())
+
+    def save_and_flush():
+        io.save_user_iteration("bench", next_entry())
+        buffered.flush()
+
+    def prepare(s: WriteBehindStore) -> Callable[[], None]:
+        def setup():
+            use_store(s)
+            if s is buffered and s.stats()["deferred"] > 64:
+                s.flush()  # keep the deferred analytics updates bounded
+        return setup
+
+    def prepare_read():
+        use_store(through)
+
+    json_resp, bracket_resp = evaluator_json_response(), evaluator_bracket_response()
+    opt_resp, opt_truncated = optimizer_response(chapters), optimizer_response(chapters, truncated=True)
+    from agents.evaluator import EvaluatorAgent
+    from agents.optimizer import OptimizerAgent
+    optimizer = OptimizerAgent()
+    plan = synthetic_plan(chapters)
+    sample = synthetic_questions(10, seed=1)
+    history = [{"text": f"Added examples to chapter {i}", "outcome": "improved (3.40 -> 3.60)"} for i in range(8)]
+    feedback = "Clarity is good; depth on paging and deadlocks is thin. " * 4
+    scores = {d: 4 for d in CIDDP_DIMENSIONS}
+
+    def ciddp():
+        with contextlib.redirect_stdout(_stdio.StringIO()):
+            compute_ciddp_score(scores)
+
+    return [
+        ("load_questions", lambda: io.load_questions(bank, n=10), None),
+        ("append_questions_to_level", lambda: io.append_questions_to_level("easy", new_questions), restore_bank),
+        ("save_user_iteration buffered", save_buffered, prepare(buffered)),
+        ("save_user_iteration + flush", save_and_flush, prepare(buffered)),
+        ("save_user_iteration write-through", lambda: io.save_user_iteration("bench", next_entry()),
+         lambda: (prepare(through)(), restore_history())),
+        ("get_user_best_plan", lambda: io.get_user_best_plan("bench"), prepare_read),
+        ("load_user_history_page scores", lambda: io.load_user_history_page("bench", 0, 50, ["score", "scores"]),
+         prepare_read),
+        ("parse evaluator json", lambda: EvaluatorAgent._parse_scores(json_resp, record=False), None),
+        ("parse evaluator brackets", lambda: EvaluatorAgent._parse_scores(bracket_resp, record=False), None),
+        ("parse optimizer json", lambda: optimizer._parse_response(opt_resp, record=False), None),
+        ("parse optimizer truncated", lambda: optimizer._parse_response(opt_truncated, record=False), None),
+        ("prompt evaluator", lambda: get_evaluator_prompt(plan, SKILLS, sample_questions=sample), None),
+        ("prompt optimizer", lambda: get_optimizer_prompt(plan, SKILLS, feedback, ["Paging", "Deadlocks"], history),
+         None),
+        ("compute_ciddp_score", ciddp, None),
+    ]
+
+
+def run(scales: List[str], only: Optional[str], repeat: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    previous = write_behind._store
+    saved_root, saved_analytics = io._repo_root, analytics._analytics_path
+    try:
+        for name in scales:
+            with tempfile.TemporaryDirectory(prefix="edu-bench-") as tmp:
+                root = Path(tmp)
+                io._repo_root = lambda: root
+                analytics._analytics_path = lambda: root / 'cache' / 'analytics.npz'
+                scale = SCALES[name]
+                print(f"\n{name}: {scale['questions']} questions, {scale['entries']} history entries, "
+                      f"{scale['chapters']} chapters per plan")
+                stores: List[WriteBehindStore] = []
+                for bench, fn, setup in benchmarks(root, scale, stores):
+                    if only and only not in bench:
+                        continue
+                    median, best = time_call(fn, repeat, min_time, setup)
+                    results[f"{name}/{bench}"] = {"median_s": median, "min_s": best}
+                    print(f"  {bench:<36} {fmt_time(median)}  (min {fmt_time(best).strip()})")
+                for store in stores:
+                    store.close()
+    finally:
+        io._repo_root, analytics._analytics_path = saved_root, saved_analytics
+        write_behind._store = previous
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], max_regression: float) -> int:
+    base = baseline.get("results", {})
+    status = 0
+    print("\nvs. baseline" + (f" ({baseline['python']}, {baseline['codec']})" if 'python' in baseline else ""))
+    for key, r in results.items():
+        if key not in base:
+            print(f"  {key:<44}      new")
+            continue
+        # the fastest batch: least affected by other load on the machine
+        old = float(base[key]["min_s"])
+        change = (r["min_s"] - old) / old if old > 0 else 0.0
+        flag = "  REGRESSION" if change > max_regression else ""
+        print(f"  {key:<44} {change:+8.1%}{flag}")
+        if flag:
+            status = 1
+    if status:
+        print(f"FAIL: some benchmarks slowed down by more than {max_regression:.0%}")
+    return status
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES), help="repeatable (default: small, medium)")
+    parser.add_argument('--only', help="run the benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="timed batches per benchmark")
+    parser.add_argument('--min-time', type=float, default=0.05, help="seconds per batch, at least")
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="compare against a saved JSON baseline")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="allowed relative slowdown of a benchmark's fastest batch before exiting non-zero")
+    args = parser.parse_args()
+
+    print(f"codec backend: {codec.BACKEND}")
+    results = run(args.scale or ["small", "medium"], args.only, args.repeat, args.min_time)
+
+    status = 0
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps({
+            "python": sys.version.split()[0], "codec": codec.BACKEND, "results": results,
+        }, indent=2), encoding='utf-8')
+        print(f"\nSaved baseline to {args.save}")
+    if args.compare:
+        status = compare(results, json.loads(Path(args.compare).read_text(encoding='utf-8')), args.max_regression)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Cold-start benchmark based on `python -X importtime`.
+
+Imports a module in a fresh interpreter several times, parses the
+`-X importtime` report and prints the median total import time together with
+the slowest top-level imports. Heavy third-party packages that should only be
+loaded on first use (ollama, httpx, numpy, ...) are flagged if they show up.
+
+Examples:
+    python scripts/bench_import_time.py                     # import main
+    python scripts/bench_import_time.py --module app --path backend
+    python scripts/bench_import_time.py --save cache/import_baseline.json
+    python scripts/bench_import_time.py --compare cache/import_baseline.json --max-regression 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+
+# Packages that must not be imported eagerly by the CLI / backend entrypoints.
+HEAVY_MODULES = ("ollama", "httpx", "numpy", "sklearn", "openai", "requests")
+
+
+def measure(module: str, extra_paths: list[str]) -> dict:
+    """Import `module` in a fresh interpreter and return the parsed report."""
+    env = dict(os.environ)
+    paths = [str(repo_root / p) for p in extra_paths] + [str(repo_root / 'src')]
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        env=env, capture_output=True, text=True, cwd=str(repo_root),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    top_level = {}
+    imported = set()
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            _self_us, cumulative_us, name = [part.strip() for part in line.split(':', 1)[1].split('|')]
+            cumulative = int(cumulative_us)
+        except ValueError:
+            continue
+        raw_name = line.split('|')[-1]
+        depth = (len(raw_name) - len(raw_name.lstrip(' ')) - 1) // 2
+        imported.add(name.split('.')[0])
+        if depth == 0:
+            top_level[name] = top_level.get(name, 0) + cumulative
+            total_us += cumulative
+
+    return {
+        "total_ms": total_us / 1000.0,
+        "top_level_ms": {k: v / 1000.0 for k, v in top_level.items()},
+        "heavy": sorted(m for m in HEAVY_MODULES if m in imported),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help="module to import (default: main)")
+    parser.add_argument('--path', action='append', default=[], help="extra repo-relative dir for sys.path (e.g. backend)")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="number of slowest top-level imports to show")
+    parser.add_argument('--save', help="write the result as a JSON baseline")
+    parser.add_argument('--compare', help="compare against a saved JSON baseline")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="allowed relative slowdown vs. baseline before exiting non-zero")
+    parser.add_argument('--budget-ms', type=float, default=None, help="fail if the median exceeds this")
+    args = parser.parse_args()
+
+    runs = [measure(args.module, args.path) for _ in range(max(1, args.runs))]
+    median_ms = statistics.median(r['total_ms'] for r in runs)
+
+    # report the per-module numbers from the run closest to the median
+    representative = min(runs, key=lambda r: abs(r['total_ms'] - median_ms))
+    print(f"import {args.module}: median {median_ms:.1f} ms over {len(runs)} runs "
+          f"(min {min(r['total_ms'] for r in runs):.1f}, max {max(r['total_ms'] for r in runs):.1f})")
+    slowest = sorted(representative['top_level_ms'].items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+    for name, ms in slowest:
+        print(f"  {ms:8.1f} ms  {name}")
+    if representative['heavy']:
+        print(f"WARNING: heavy modules imported at start-up: {', '.join(representative['heavy'])}")
+
+    status = 0
+    result = {"module": args.module, "median_ms": median_ms, "heavy": representative['heavy']}
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(result, indent=2), encoding='utf-8')
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        base_ms = float(baseline.get('median_ms', 0))
+        change = (median_ms - base_ms) / base_ms if base_ms > 0 else 0.0
+        print(f"vs. baseline {base_ms:.1f} ms: {change:+.1%}")
+        if change > args.max_regression:
+            print("FAIL: import time regressed beyond the allowed threshold")
+            status = 1
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"FAIL: median {median_ms:.1f} ms exceeds budget of {args.budget_ms:.1f} ms")
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Load/dump time and memory of question banks and plan histories.
+
+Compares the old path (stdlib `json`, `indent=2`, plain dicts) with the
+current one (utils.codec, compact output, validated slotted records from
+core.records) on synthetic data.
+
+Examples:
+    python scripts/bench_records.py                  # 100k questions, 10k plan entries
+    python scripts/bench_records.py --questions 20000 --entries 2000 --runs 5
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from core.records import PlanEntry, decode_questions
+from utils import codec
+
+
+def synthetic_questions(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    topics = ["Processes", "Threads", "Scheduling", "Paging", "File Systems", "Deadlocks"]
+    out = []
+    for i in range(n):
+        options = [f"Option {j} for question {i}" for j in range(4)]
+        out.append({
+            "id": f"q{i}",
+            "topic": rng.choice(topics),
+            "level": "easy",
+            "question": f"Synthetic question {i} about {rng.choice(topics).lower()}?",
+            "options": options,
+            "answer": rng.choice(options),
+            "explanation": "Because the operating system " + "schedules " * rng.randint(2, 8),
+        })
+    return out
+
+
+def synthetic_entries(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [{
+        "plan": "Chapter 1: Introduction\n" + "Topic line\n" * 20,
+        "score": round(rng.uniform(1, 5), 2),
+        "scores": {d: rng.randint(1, 5) for d in ("Clarity", "Integrity", "Depth", "Practicality", "Pertinence")},
+        "iteration": i % 10 + 1,
+    } for i in range(n)]
+
+
+def timed(fn, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def peak_memory(fn) -> int:
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def bench(name: str, items: list, to_records, runs: int) -> None:
+    old_text = json.dumps(items, indent=2)
+    new_bytes = codec.dumps_bytes(items, pretty=False)
+    records = to_records(items)
+    rows = [
+        ("dump  json indent=2", timed(lambda: json.dumps(items, indent=2), runs)),
+        (f"dump  {codec.BACKEND} compact", timed(lambda: codec.dumps_bytes(items, pretty=False), runs)),
+        (f"dump  {codec.BACKEND} records", timed(lambda: codec.dumps_bytes(records, pretty=False), runs)),
+        ("load  json -> dicts", timed(lambda: json.loads(old_text), runs)),
+        (f"load  {codec.BACKEND} -> dicts", timed(lambda: codec.loads(new_bytes), runs)),
+        (f"load  {codec.BACKEND} -> records", timed(lambda: to_records(codec.loads(new_bytes)), runs)),
+    ]
+    dict_mem = peak_memory(lambda: json.loads(old_text))
+    rec_mem = peak_memory(lambda: to_records(codec.loads(new_bytes)))
+
+    print(f"\n{name}: {len(items)} items")
+    print(f"  size     indent=2 {len(old_text) / 1e6:8.2f} MB   compact {len(new_bytes) / 1e6:8.2f} MB")
+    for label, ms in rows:
+        print(f"  {label:<28} {ms:9.1f} ms")
+    print(f"  memory   dicts {dict_mem / 1e6:8.1f} MB   records {rec_mem / 1e6:8.1f} MB "
+          f"({rec_mem / dict_mem:.0%} of dicts)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=100_000)
+    parser.add_argument('--entries', type=int, default=10_000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"codec backend: {codec.BACKEND}")
+    bench("questions", synthetic_questions(args.questions), lambda items: decode_questions(items)[0], args.runs)
+    bench("plan entries", synthetic_entries(args.entries),
+          lambda items: [PlanEntry.from_dict(e) for e in items], args.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Precompute optimised lesson plans for clusters of skill profiles.
+
+    python scripts/build_plan_library.py [--roster roster.jsonl] [--clusters 8] [--iterations 3]
+
+The profiles come from the roster's `skills` (the format of src/batch.py;
+entries without skills get the batch default), or from a grid over
+--grid-levels when no roster is given. They are clustered with k-means, and
+for each cluster centre the planning loop runs offline from
+data/lessonplan.txt, with nothing saved to any user's history. The
+best-scoring plan is added to the library (`plan_library.path`), and new
+users with a nearby profile start from it (see src/utils/plan_library.py).
+
+Stages are checkpointed under cache/plan_library/, so an interrupted build
+resumes. Centres already in the library are skipped unless --force is given.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
+from pathlib import Path
+import sys
+import time
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from batch import load_roster
+from core.session import DEFAULT_CONFIG, default_plan, run_session
+from llm import set_llm_concurrency
+from utils.config import get_setting
+from utils.plan_library import DIMENSIONS, cluster_profiles, get_plan_library
+
+
+def candidate_profiles(args):
+    if args.roster:
+        return [entry.get("skills") or DEFAULT_CONFIG["skills"] for entry in load_roster(args.roster)]
+    levels = [int(v) for v in args.grid_levels.split(',')]
+    return list(itertools.product(levels, repeat=len(DIMENSIONS)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roster", help="JSONL roster whose skill profiles are clustered")
+    parser.add_argument("--grid-levels", default="1,3,5", help="levels per dimension when no roster is given")
+    parser.add_argument("--clusters", type=int, default=8, help="plans to precompute (k of k-means)")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2, help="centres optimised at the same time")
+    parser.add_argument("--max-llm-calls", type=int, default=int(get_setting('llm.max_concurrent_calls', 0) or 2))
+    parser.add_argument("--force", action="store_true", help="recompute centres already in the library")
+    args = parser.parse_args(argv)
+
+    library = get_plan_library()
+    clusters = cluster_profiles(candidate_profiles(args), args.clusters)
+    stored = {tuple(e['profile']) for e in library.entries}
+    todo = [(c, n) for c, n in clusters if args.force or c not in stored]
+    print(f"{len(clusters)} cluster centres, {len(clusters) - len(todo)} already in {library.path}, "
+          f"{len(todo)} to optimise ({args.iterations} iterations each)")
+
+    set_llm_concurrency(args.max_llm_calls)
+    base_plan = default_plan()
+    config = {"iterations": args.iterations, "checkpoint_dir": str(repo_root / 'cache' / 'plan_library'),
+              "initial_plan": base_plan, "persist": False}
+
+    def optimise(centre):
+        key = "library-" + "".join(str(v) for v in centre)
+        return run_session(key, "easy", [], dict(config, skills=dict(zip(DIMENSIONS, centre))))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(optimise, centre): (centre, members) for centre, members in todo}
+        for fut in as_completed(futures):
+            centre, members = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                print(f"{centre}: failed: {e}")
+                continue
+            if result["best_score"] is None or result["errors"]:
+                print(f"{centre}: incomplete ({'; '.join(result['errors'])}), rerun to resume")
+                continue
+            added = library.add(centre, result["best_plan"], result["best_score"], members=members,
+                                iterations=args.iterations, llm_calls=result["llm_calls"])
+            if added:
+                library.save()
+            print(f"{centre} ({members} profiles): best score {result['best_score']:.2f} in "
+                  f"{result['elapsed_s']:.1f}s{'' if added else ' (library already has a better plan)'}")
+    print(f"done in {time.perf_counter() - started:.1f}s; library has {len(library.entries)} plans")
+
+
+if __name__ == "__main__":
+    main()
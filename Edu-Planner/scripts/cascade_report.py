@@ -0,0 +1,69 @@
+"""Summarise the model cascade log (llm.cascade.log, default cache/cascade.jsonl).
+
+Per profile: how often the small model's answer was accepted, why calls
+escalated, mean latency per call, and the time saved compared with sending
+every call to the large model (estimated from the escalated calls' large-model
+latency).
+
+    python scripts/cascade_report.py [path/to/cascade.jsonl]
+"""
+from collections import Counter, defaultdict
+from pathlib import Path
+import json
+import sys
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from utils.config import get_setting
+
+
+def load(path):
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    return rows
+
+
+def mean(xs):
+    return sum(xs) / len(xs) if xs else None
+
+
+def fmt(x):
+    return "-" if x is None else f"{x:.2f}s"
+
+
+def report(rows):
+    by_profile = defaultdict(list)
+    for r in rows:
+        by_profile[r.get('profile', '?')].append(r)
+    for profile, rs in sorted(by_profile.items()):
+        decisions = Counter(r['decision'] for r in rs)
+        reasons = Counter((r.get('reason') or '').split(':', 1)[0] for r in rs if r['decision'] == 'escalated')
+        large = [r['large_s'] for r in rs if r.get('large_s') is not None]
+        small_ok = [r['small_s'] for r in rs if r['decision'] == 'small_accepted']
+        per_call = mean([r['total_s'] for r in rs])
+        large_mean = mean(large)
+        print(f"{profile}: {len(rs)} calls, small accepted {decisions['small_accepted']} "
+              f"({decisions['small_accepted'] / len(rs):.0%}), escalated {decisions['escalated']}, "
+              f"skipped {decisions['skipped']}")
+        print(f"  mean per call {fmt(per_call)}; small when accepted {fmt(mean(small_ok))}; "
+              f"large {fmt(large_mean)}")
+        if large_mean is not None and per_call is not None:
+            print(f"  est. saving vs large only: {fmt(large_mean - per_call)} per call, "
+                  f"{(large_mean - per_call) * len(rs):.1f}s total")
+        if reasons:
+            print("  escalations: " + ", ".join(f"{k} {v}" for k, v in reasons.most_common()))
+
+
+if __name__ == '__main__':
+    path = Path(sys.argv[1] if len(sys.argv) > 1 else str(get_setting('llm.cascade.log', 'cache/cascade.jsonl')))
+    if not path.is_absolute() and not path.exists():
+        path = repo_root / path
+    if not path.exists():
+        sys.exit(f"no cascade log at {path}")
+    report(load(path))
@@ -0,0 +1,76 @@
+"""Call the backend's question routes end to end against an in-process Ollama stub.
+
+POST /api/user/{id}/generate_questions and GET /api/user/{id}/quiz (with no
+prefetched set, so it generates) must answer 200 with questions. Both once
+failed with a TypeError because the endpoint named `generate_questions`
+shadowed the question_gen helper of the same name.
+
+No real Ollama is needed, and the per-user files (the saved plan the quiz is
+for, the generated question set), the analytics and the cascade log go to a
+temporary directory instead of data/ and cache/.
+"""
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+sys.path.insert(0, str(repo_root / 'scripts'))
+sys.path.insert(0, str(repo_root / 'backend'))
+
+from ollama_stub import StubConfig, start_stub, stop_stub, stub_host
+from utils import analytics, io
+from utils.config import get_setting, load_settings
+from utils.write_behind import flush_pending_writes
+
+USER = "check-routes"
+TOPICS = ["Scheduling", "Paging", "Deadlocks", "File Systems"]
+
+
+def canned_questions(n=12):
+    out = []
+    for i in range(n):
+        topic = TOPICS[i % len(TOPICS)]
+        options = [f"{topic} route-check option {j} ({i})" for j in range(4)]
+        out.append({"id": f"route-check-{i}", "topic": topic, "level": "easy",
+                    "question": f"Route check question {i}: which holds for {topic.lower()}?",
+                    "options": options, "answer": options[1], "explanation": "Canned by the stub."})
+    return json.dumps(out)
+
+
+def main():
+    models = {get_setting('llm.model', 'deepseek-r1:latest'), get_setting('llm.cascade.small_model', '') or None}
+    stub = start_stub(config=StubConfig(models=[m for m in models if m], response=canned_questions()))
+    os.environ['OLLAMA_HOSTS'] = stub_host(stub)
+    import app as backend
+    from fastapi.testclient import TestClient
+
+    tmp = tempfile.TemporaryDirectory(prefix="edu-check-")
+    root = Path(tmp.name)
+    io._repo_root = lambda: root
+    analytics._analytics_path = lambda: root / 'cache' / 'analytics.npz'
+    load_settings()['llm']['cascade']['log'] = str(root / 'cache' / 'cascade.jsonl')
+    io.save_user_iteration(USER, {"plan": "Chapter 1: Scheduling\nRound robin and priorities.", "score": 3.0,
+                                  "scores": {}, "iteration": 1})
+    try:
+        with TestClient(backend.app) as client:
+            r = client.post(f"/api/user/{USER}/generate_questions", json={"user_id": USER, "level": "easy", "n": 4})
+            print(f"generate_questions: {r.status_code} {r.json()}")
+            assert r.status_code == 200 and r.json()["count"] > 0, r.text
+
+            r = client.get(f"/api/user/{USER}/quiz", params={"level": "easy", "n": 4})
+            body = r.json()
+            print(f"quiz: {r.status_code} source={body.get('source')} questions={len(body.get('questions') or [])}")
+            assert r.status_code == 200 and body["questions"], r.text
+        assert (root / 'data' / f"generated_questions_easy_{USER}.json").exists()
+    finally:
+        flush_pending_writes()
+        tmp.cleanup()
+        stop_stub(stub)
+    print("backend routes OK")
+
+
+if __name__ == '__main__':
+    main()
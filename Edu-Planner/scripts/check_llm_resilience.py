@@ -0,0 +1,78 @@
+"""Exercise deadlines, retries and hedging in llm.OllamaRouter against fault-injecting stubs.
+
+No real Ollama is needed; every scenario starts its own stub servers.
+"""
+from pathlib import Path
+import sys
+import time
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+sys.path.insert(0, str(repo_root / 'scripts'))
+
+from llm import CallPolicy, LLMTimeoutError, OllamaRouter
+from ollama_stub import StubConfig, start_stub, stop_stub, stub_host
+
+MODEL = "deepseek-r1:latest"
+
+
+def check_deadline():
+    stub = start_stub(config=StubConfig(hang_rate=1.0, hang_s=5.0))
+    router = OllamaRouter([stub_host(stub)])
+    policy = CallPolicy("deadline", timeout_s=0.5, retries=0)
+    started = time.perf_counter()
+    try:
+        router.generate(MODEL, "ping", policy=policy)
+    except LLMTimeoutError:
+        elapsed = time.perf_counter() - started
+        print(f"deadline: hung request abandoned after {elapsed:.2f}s (deadline 0.5s)")
+        assert elapsed < 1.0
+    else:
+        raise AssertionError("expected LLMTimeoutError")
+    finally:
+        router.stop()
+        stop_stub(stub)
+
+
+def check_retries():
+    stub = start_stub(config=StubConfig(fail_rate=0.3, seed=7))
+    router = OllamaRouter([stub_host(stub)])
+    policy = CallPolicy("retry", timeout_s=10, retries=6, backoff_s=0.01)
+    ok = 0
+    for _ in range(40):
+        try:
+            router.generate(MODEL, "ping", policy=policy)
+            ok += 1
+        except ConnectionError:
+            pass
+    stats = router.stats()
+    print(f"retries: {ok}/40 succeeded with a 30% failure rate ({stats['retries']} retry rounds)")
+    assert ok >= 39
+    router.stop()
+    stop_stub(stub)
+
+
+def check_hedging():
+    # the slow host streams 8 chunks over 2s, so a cancelled request stops within ~0.25s
+    slow = start_stub(config=StubConfig(delay=2.0, response="s" * 128))
+    fast = start_stub(config=StubConfig(delay=0.05, response="fast"))
+    router = OllamaRouter([stub_host(slow), stub_host(fast)])
+    # the slow host is preferred by the router (listed first, nothing outstanding)
+    policy = CallPolicy("hedge", timeout_s=5, retries=0, hedge=True, hedge_after_s=0.1)
+    started = time.perf_counter()
+    result = router.generate(MODEL, "ping", policy=policy)
+    elapsed = time.perf_counter() - started
+    print(f"hedging: answered by '{result['response']}' host in {elapsed:.2f}s; stats {router.stats()}")
+    assert result['response'] == "fast" and elapsed < 1.0
+    time.sleep(0.6)
+    assert router.status()[0]['outstanding'] == 0, "loser should be released after cancellation"
+    router.stop()
+    stop_stub(slow)
+    stop_stub(fast)
+
+
+if __name__ == '__main__':
+    check_deadline()
+    check_retries()
+    check_hedging()
+    print("resilience OK")
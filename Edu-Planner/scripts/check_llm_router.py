@@ -0,0 +1,64 @@
+"""Exercise llm.OllamaRouter against local stub servers (no real Ollama needed).
+
+Starts three stubs, sends concurrent requests, checks that the calls of one
+session stay on one host, then takes one stub down and checks that requests
+fail over to the others.
+"""
+from pathlib import Path
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+sys.path.insert(0, str(repo_root / 'scripts'))
+
+from llm import OllamaRouter
+from ollama_stub import StubConfig, start_stub, stop_stub, stub_host
+
+MODEL = "deepseek-r1:latest"
+
+
+def fire(router, n, workers=8):
+    def one(_):
+        return router.generate(model=MODEL, prompt="ping")
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(one, range(n)))
+
+
+if __name__ == '__main__':
+    stubs = [start_stub(config=StubConfig(delay=0.05, jitter=0.05, seed=i)) for i in range(3)]
+    router = OllamaRouter([stub_host(s) for s in stubs], health_interval_s=0.5)
+
+    started = time.perf_counter()
+    fire(router, 60)
+    served = Counter({stub_host(s): s.RequestHandlerClass.config.requests for s in stubs})
+    print(f"60 requests in {time.perf_counter() - started:.2f}s, per host: {dict(served)}")
+    assert all(served.values()), "every healthy host should receive traffic"
+
+    # sequential calls of one session stick to the host of its first call
+    hosts = {router.generate(model=MODEL, prompt="ping", session_id="s1")['host'] for _ in range(10)}
+    print(f"session s1 served by {hosts}, affinity hits = {router.stats()['session_affinity']}")
+    assert len(hosts) == 1 and router.stats()['session_affinity'] == 9
+
+    # take one host down: calls must keep succeeding through failover
+    down = stubs[0]
+    stop_stub(down)
+    fire(router, 30)
+    status = {ep['host']: ep['healthy'] for ep in router.status()}
+    print(f"after stopping {stub_host(down)}: healthy = {status}")
+    assert status[stub_host(down)] is False
+
+    # everything down -> ConnectionError
+    for s in stubs[1:]:
+        stop_stub(s)
+    try:
+        router.generate(model=MODEL, prompt="ping")
+    except ConnectionError as e:
+        print(f"all hosts down -> ConnectionError: {str(e)[:80]}...")
+    else:
+        raise AssertionError("expected ConnectionError when no host is reachable")
+    router.stop()
+    print("router OK")
@@ -0,0 +1,111 @@
+"""Exercise utils.scheduler.LLMScheduler: priorities, per-class caps, fairness and aging.
+
+Calls are simulated with sleeps; no Ollama is needed.
+"""
+from pathlib import Path
+import sys
+import threading
+import time
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from utils.scheduler import LLMScheduler, QueueTimeoutError
+
+CLASSES = {"interactive": {"weight": 8}, "background": {"weight": 1, "max_concurrent": 2}}
+
+
+def run_calls(sched, calls, work_s=0.05):
+    """Start (priority, user) calls in order; return the order they were admitted."""
+    admitted, lock = [], threading.Lock()
+
+    def call(priority, user, i):
+        with sched.slot(priority, user):
+            with lock:
+                admitted.append((priority, user, i))
+            time.sleep(work_s)
+
+    threads = []
+    for i, (priority, user) in enumerate(calls):
+        t = threading.Thread(target=call, args=(priority, user, i))
+        t.start()
+        threads.append(t)
+        time.sleep(0.002)  # keep submission order deterministic
+    for t in threads:
+        t.join()
+    return admitted
+
+
+def check_interactive_first():
+    sched = LLMScheduler(slots=2, classes=CLASSES)
+    # a 20-call generation job is queued before 4 live evaluations
+    calls = [("background", "gen-user")] * 20 + [("interactive", f"student{i}") for i in range(4)]
+    admitted = run_calls(sched, calls)
+    positions = [n for n, (p, _u, _i) in enumerate(admitted) if p == "interactive"]
+    stats = sched.stats()["classes"]
+    print(f"priority: interactive calls admitted at positions {positions} of {len(admitted)}; "
+          f"wait p95 interactive {stats['interactive']['wait_ms']['p95']} ms, "
+          f"background {stats['background']['wait_ms']['p95']} ms")
+    assert max(positions) < 8, positions
+
+
+def check_class_cap():
+    sched = LLMScheduler(slots=4, classes=CLASSES)
+    peak, lock = [0], threading.Lock()
+
+    def watch():
+        while not done.is_set():
+            with lock:
+                peak[0] = max(peak[0], sched.stats()["classes"]["background"]["in_flight"])
+            time.sleep(0.005)
+
+    done = threading.Event()
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    run_calls(sched, [("background", "gen")] * 8)
+    done.set()
+    watcher.join()
+    print(f"cap: background peaked at {peak[0]} in flight of 4 slots (max_concurrent 2)")
+    assert peak[0] == 2
+
+
+def check_user_fairness():
+    sched = LLMScheduler(slots=1, classes=CLASSES)
+    # user A queues 10 calls, then B queues 3: B is served in turn, not after all of A's
+    calls = [("interactive", "A")] * 10 + [("interactive", "B")] * 3
+    admitted = run_calls(sched, calls, work_s=0.02)
+    b_positions = [n for n, (_p, u, _i) in enumerate(admitted) if u == "B"]
+    print(f"fairness: user B's 3 calls admitted at positions {b_positions} behind A's 10")
+    assert max(b_positions) <= 7, b_positions
+
+
+def check_aging():
+    sched = LLMScheduler(slots=1, classes={"interactive": {"weight": 1000}, "background": {"weight": 1}}, aging_s=0.2)
+    calls = [("background", "gen")] + [("interactive", f"s{i}") for i in range(30)]
+    admitted = run_calls(sched, calls[:1] + calls, work_s=0.02)
+    bg_positions = [n for n, (p, _u, _i) in enumerate(admitted) if p == "background"]
+    print(f"aging: background calls admitted at positions {bg_positions} despite a 1000:1 weight")
+    assert bg_positions[-1] < 20, bg_positions
+
+
+def check_max_wait():
+    sched = LLMScheduler(slots=1, classes=CLASSES, max_wait_s=0.1)
+    hold = threading.Thread(target=run_calls, args=(sched, [("interactive", "a")], 0.5))
+    hold.start()
+    time.sleep(0.05)
+    try:
+        with sched.slot("background", "b"):
+            raise AssertionError("expected QueueTimeoutError")
+    except QueueTimeoutError as e:
+        print(f"max_wait: {e}")
+    hold.join()
+    assert sched.stats()["classes"]["background"]["timeouts"] == 1
+
+
+if __name__ == '__main__':
+    check_interactive_first()
+    check_class_cap()
+    check_user_fairness()
+    check_aging()
+    check_max_wait()
+    print("all scheduler checks passed")
@@ -0,0 +1,21 @@
+"""Rewrite data/user_plans/*.json histories with delta-encoded plan versions.
+
+Histories saved before delta encoding hold the full plan in every entry;
+they are still read correctly, this only reclaims the disk space.
+"""
+from pathlib import Path
+import sys
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from utils.io import compact_user_history
+
+if __name__ == '__main__':
+    total_before = total_after = 0
+    for p in sorted((repo_root / 'data' / 'user_plans').glob('*.json')):
+        before, after = compact_user_history(p.stem)
+        total_before += before
+        total_after += after
+        print(f"{p.name}: {before} -> {after} bytes")
+    print(f"total: {total_before} -> {total_after} bytes")
@@ -0,0 +1,208 @@
+"""Minimal local stand-in for an Ollama server, for exercising llm.py.
+
+Implements the endpoints the project uses (`/api/generate`, streaming and
+not, `/api/tags`, `/api/ps`) with a canned response and optional fault
+injection: fixed/random latency, a failure rate (HTTP 500), a hang rate (the
+request stalls for `--hang-s` seconds) and a drop rate (connection closed
+without a response).
+
+Run one or more from a shell:
+    python scripts/ollama_stub.py --port 11501 --delay 0.2 --fail-rate 0.1
+or start them in-process with `start_stub(...)` (see scripts/check_llm_router.py).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class StubConfig:
+    def __init__(self, models=("deepseek-r1:latest",), response='{"ok": true}', delay=0.0, jitter=0.0,
+                 fail_rate=0.0, hang_rate=0.0, hang_s=30.0, drop_rate=0.0, seed: Optional[int] = None,
+                 schema_format: bool = True):
+        self.models = list(models)
+        self.response = response
+        self.delay = delay
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self.drop_rate = drop_rate
+        self.schema_format = schema_format  # False: answer 400 to a JSON-schema `format`, like Ollama < 0.5
+        self.rng = random.Random(seed)
+        self.loaded = set()
+        self.requests = 0
+        self.down = False  # simulate an outage: drop every connection
+        self.lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig  # set per server in start_stub()
+
+    def log_message(self, *args):  # keep the console quiet
+        pass
+
+    def _json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse_request(self):
+        if self.config.down:
+            # close without answering, also on connections kept alive from before the outage
+            self.close_connection = True
+            return False
+        return super().parse_request()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        cfg = self.config
+        if self.path == '/':
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/api/tags':
+            self._json(200, {"models": [{"model": m, "name": m} for m in cfg.models]})
+        elif self.path == '/api/ps':
+            expires = (datetime.now(timezone.utc) + timedelta(minutes=30)).isoformat()
+            with cfg.lock:
+                loaded = sorted(cfg.loaded)
+            self._json(200, {"models": [{"model": m, "name": m, "expires_at": expires} for m in loaded]})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        cfg = self.config
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._json(400, {"error": "invalid json"})
+        if self.path != '/api/generate':
+            return self._json(404, {"error": "not found"})
+
+        model = req.get('model', '')
+        if model not in cfg.models:
+            return self._json(404, {"error": f"model '{model}' not found"})
+        if isinstance(req.get('format'), dict) and not cfg.schema_format:
+            return self._json(400, {"error": "invalid format: expected \"json\" or a valid JSON schema"})
+
+        with cfg.lock:
+            cfg.requests += 1
+            roll = cfg.rng.random()
+            wait = cfg.delay + cfg.rng.random() * cfg.jitter
+            was_loaded = model in cfg.loaded
+            cfg.loaded.add(model)
+
+        if roll < cfg.drop_rate:
+            self.close_connection = True
+            self.connection.close()
+            return
+        roll -= cfg.drop_rate
+        if roll < cfg.fail_rate:
+            return self._json(500, {"error": "injected failure"})
+        roll -= cfg.fail_rate
+        if roll < cfg.hang_rate:
+            wait = cfg.hang_s
+
+        prompt = req.get('prompt') or ""
+        text = cfg.response if prompt else ""
+        stats = {
+            "model": model, "created_at": _now(), "done": True, "done_reason": "stop",
+            "total_duration": int(wait * 1e9),
+            "load_duration": 0 if was_loaded else 1_000_000,
+            "prompt_eval_count": len(prompt) // 4, "eval_count": len(text) // 4,
+        }
+        if not req.get('stream', True):
+            time.sleep(wait)
+            return self._json(200, dict(stats, response=text))
+
+        # NDJSON stream: spread the latency across a few chunks
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [text[i:i + 16] for i in range(0, len(text), 16)] or [""]
+        try:
+            for piece in pieces:
+                time.sleep(wait / len(pieces))
+                self._chunk({"model": model, "created_at": _now(), "response": piece, "done": False})
+            self._chunk(dict(stats, response=""))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled
+
+    def _chunk(self, payload) -> None:
+        data = (json.dumps(payload) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub(port: int = 0, config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """Start a stub server in a daemon thread; `server.server_address[1]` is its port."""
+    handler = type('StubHandler', (_Handler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_stub(server: ThreadingHTTPServer) -> None:
+    """Take a stub down, including connections kept alive by clients."""
+    server.RequestHandlerClass.config.down = True
+    server.shutdown()
+    server.server_close()
+
+
+def stub_host(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local Ollama stub with fault injection")
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--model', action='append', dest='models', help="model name to serve (repeatable)")
+    parser.add_argument('--response', default='{"ok": true}', help="text returned for every prompt")
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random seconds per request")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="fraction of requests that stall for --hang-s")
+    parser.add_argument('--hang-s', type=float, default=30.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of connections closed without a reply")
+    parser.add_argument('--no-schema-format', action='store_true', help="reject JSON-schema `format` (Ollama < 0.5)")
+    args = parser.parse_args()
+
+    config = StubConfig(models=args.models or ["deepseek-r1:latest"], response=args.response, delay=args.delay,
+                        jitter=args.jitter, fail_rate=args.fail_rate, hang_rate=args.hang_rate,
+                        hang_s=args.hang_s, drop_rate=args.drop_rate, schema_format=not args.no_schema_format)
+    server = start_stub(args.port, config)
+    print(f"Ollama stub listening on {stub_host(server)} (models: {', '.join(config.models)})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""Recompute cache/analytics.npz from every history in data/user_plans.
+
+The aggregates are normally updated on each save; run this after editing or
+deleting history files, or to backfill histories saved before analytics existed.
+"""
+from pathlib import Path
+import json
+import sys
+
+repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root / 'src'))
+
+from utils.analytics import rebuild_analytics
+
+if __name__ == '__main__':
+    summary = rebuild_analytics()
+    print(f"Rebuilt analytics: {summary['users']} users, {summary['entries']} entries")
+    print(json.dumps(summary['dimensions']['overall'], indent=2))
@@ -9,7 +9,7 @@ class AnalystAgent:
         """
         skill_summary = skill_tree.get_summary()
         prompt = get_analyst_prompt(example=example, skill_summary=skill_summary)
-        response = call_llm(prompt, temp=0.7)
+        response = call_llm(prompt, temp=0.7, profile="analyst")
         try:
             start = response.find('{')
             end = response.rfind('}')
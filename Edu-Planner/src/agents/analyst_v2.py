@@ -1,42 +1,74 @@
 from utils.prompts import get_analyst_prompt
-from llm import call_llm
-import json
+from utils.errordb import lookup_misconceptions, learn_misconceptions
+from utils.cascade import call_cascade
+from utils.structured import parse_json
+from utils.tracing import span, traced
 from typing import List
 
 class AnalystAgent:
+    @traced("analyst.analyze_errors", cat="agent")
     def analyze_errors(self, example: str, skill_tree, focus_areas: List[str] | None = None) -> dict:
         """Faster, focused analyst that prioritizes small context and focus areas.
 
-        Returns: {"misconceptions": [...], "raw": str}
+        Known misconceptions are first looked up in the errordb index for the
+        focus areas (or the student's weakest skill dimensions); the LLM is only
+        called when that retrieval is not confident, and what it returns is
+        added to the index.
+
+        Returns: {"misconceptions": [...], "raw": str, "source": "errordb" | "llm"}
         """
+        query_areas = focus_areas or (skill_tree.weakest_dimensions() if skill_tree is not None else None)
+        with span("analyst.errordb_lookup", cat="agent") as sp:
+            retrieved = lookup_misconceptions(example, query_areas, k=6)
+            sp["confident"] = retrieved["confident"]
+        if retrieved["confident"]:
+            return {
+                "misconceptions": retrieved["misconceptions"],
+                "entries": retrieved["entries"],
+                "confidence": retrieved["confidence"],
+                "source": "errordb",
+                "raw": "",
+            }
+
         skill_summary = skill_tree.get_summary() if skill_tree is not None else ""
-        # Truncate very long inputs to keep LLM work small
-        excerpt = example
-        if isinstance(example, str) and len(example) > 1200:
-            excerpt = example[:1200] + "\n..."
-
-        prompt = get_analyst_prompt(example=excerpt, skill_summary=skill_summary, focus_areas=focus_areas, max_items=6)
-        response = call_llm(prompt, temp=0.3)
-
-        # Try direct JSON parse, then fallback to object extraction
-        try:
-            parsed = json.loads(response)
-            if isinstance(parsed, dict) and 'misconceptions' in parsed:
-                parsed['raw'] = response
-                return parsed
-        except Exception:
-            pass
-
-        try:
-            start = response.find('{')
-            end = response.rfind('}')
-            if start != -1 and end != -1 and end > start:
-                parsed = json.loads(response[start:end+1])
-                if isinstance(parsed, dict) and 'misconceptions' in parsed:
-                    parsed['raw'] = response
-                    return parsed
-        except Exception:
-            pass
+        # The full plan is passed on purpose: the prompt then shares its prefix
+        # with the evaluator/optimizer prompts for the same plan, so within a
+        # session the plan tokens are evaluated once and reused from the cache.
+        with span("analyst.prompt", cat="agent"):
+            prompt = get_analyst_prompt(example=example, skill_summary=skill_summary, focus_areas=focus_areas, max_items=6)
+        response = call_cascade(prompt, temp=0.3, profile="analyst", validate=self._check)
+
+        with span("analyst.parse", cat="agent"):
+            return self._parse(response, query_areas)
+
+    @staticmethod
+    def _check(response: str) -> str | None:
+        """Cascade validator: None when the response holds a non-empty misconception list."""
+        parsed = parse_json(response, "analyst", record=False)
+        if parsed is None:
+            return "invalid_json"
+        items = parsed.get('misconceptions') if isinstance(parsed, dict) else None
+        if not isinstance(items, list):
+            return "no_misconceptions_list"
+        if not [m for m in items if (isinstance(m, str) and m.strip()) or (isinstance(m, dict) and m)]:
+            return "empty_misconceptions"
+        return None
+
+    def _parse(self, response: str, query_areas: List[str] | None) -> dict:
+        # JSON parse, object extraction, then local repair (utils.structured)
+        parsed = parse_json(response, "analyst")
+        if isinstance(parsed, dict) and 'misconceptions' in parsed:
+            return self._from_llm(parsed, response, query_areas)
 
         # Last-resort: return the whole response as a single-item misconception
-        return {"misconceptions": [response], "raw": response}
+        return {"misconceptions": [response], "raw": response, "source": "llm"}
+
+    @staticmethod
+    def _from_llm(parsed: dict, response: str, focus_areas: List[str] | None) -> dict:
+        parsed['raw'] = response
+        parsed['source'] = "llm"
+        items = parsed.get('misconceptions')
+        if isinstance(items, list):
+            # feed the index so the next lookup for these areas can skip the LLM
+            learn_misconceptions(items, topic=", ".join(focus_areas or []))
+        return parsed
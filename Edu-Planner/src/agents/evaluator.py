@@ -1,10 +1,14 @@
-from llm import call_llm
+from core.records import CIDDP_DIMENSIONS
+from utils.cascade import call_cascade
 from utils.prompts import get_evaluator_prompt
-from utils.io import load_questions
-import json
+from utils.question_index import select_relevant_questions
+from utils.config import get_setting
+from utils.structured import parse_json
+from utils.tracing import span, traced
 
 
 class EvaluatorAgent:
+    @traced("evaluator.evaluate", cat="agent")
     def evaluate(self, lesson_plan: str, skill_tree, sample_questions=None) -> tuple[dict, str]:
         """Call the LLM evaluator and parse CIDDP-style bracketed scores.
 
@@ -17,34 +21,47 @@ class EvaluatorAgent:
 
         This method normalizes tags and returns a dict of scores plus the raw response.
         """
-        skill_summary = skill_tree.get_summary()
-
-        # If caller didn't provide sample_questions, load 10 random ones from
-        # the repository data file. This keeps the evaluator self-contained
-        # and ensures the prompt includes representative questions.
-        if sample_questions is None:
+        skill_summary = skill_tree.get_summary() if skill_tree is not None else ""
+
+        # If caller didn't provide sample_questions, pick the bank questions most
+        # relevant to the plan's chapters and the student's weakest dimensions
+        # (a few targeted questions make a shorter, more useful prompt than
+        # random padding).
+        with span("evaluator.prompt", cat="agent"):
+            if sample_questions is None:
+                sample_questions = select_relevant_questions(
+                    lesson_plan, skill_tree, k=int(get_setting('evaluator.sample_questions', 5)))
+
+            prompt = get_evaluator_prompt(lesson_plan, skill_summary, sample_questions=sample_questions)
+        response = call_cascade(prompt, temp=0.0, profile="evaluator", validate=self._check_scores)
+
+        with span("evaluator.parse", cat="agent"):
+            return self._parse_scores(response)
+
+    @classmethod
+    def _check_scores(cls, response: str) -> str | None:
+        """Cascade validator: None when all five CIDDP dimensions are scored 1-5."""
+        scores, _ = cls._parse_scores(response, record=False)
+        if not isinstance(scores, dict):
+            return "no_scores"
+        missing = [d for d in CIDDP_DIMENSIONS if d not in scores]
+        if missing:
+            return f"missing_scores: {', '.join(missing)}"
+        for dim in CIDDP_DIMENSIONS:
             try:
-                sample_questions = load_questions(n=10)
-            except FileNotFoundError:
-                # fallback to empty list if file not found
-                sample_questions = []
-
-        prompt = get_evaluator_prompt(lesson_plan, skill_summary, sample_questions=sample_questions)
-        response = call_llm(prompt, temp=0.0)
-
-        # Try to extract JSON object from the LLM response first
-        try:
-            # crude bounding of JSON object
-            start = response.find('{')
-            end = response.rfind('}')
-            if start != -1 and end != -1 and end > start:
-                json_text = response[start:end+1]
-                parsed = json.loads(json_text)
-                if isinstance(parsed, dict) and 'scores' in parsed:
-                    return parsed.get('scores', {}), response
-        except Exception:
-            # fall back to legacy parsing
-            pass
+                value = float(scores[dim])
+            except (TypeError, ValueError):
+                return f"score_not_numeric: {dim}={scores[dim]!r}"
+            if not 1 <= value <= 5:
+                return f"score_out_of_range: {dim}={value:g}"
+        return None
+
+    @staticmethod
+    def _parse_scores(response: str, record: bool = True) -> tuple[dict, str]:
+        # Try to extract (or repair) the JSON object from the LLM response first
+        parsed = parse_json(response, "evaluator", record=record)
+        if isinstance(parsed, dict) and 'scores' in parsed:
+            return parsed.get('scores', {}), response
 
         # Legacy bracketed-line parsing fallback
         scores = {}
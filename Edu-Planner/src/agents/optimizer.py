@@ -1,5 +1,8 @@
 from utils.prompts import get_optimizer_prompt
-from llm import call_llm
+from utils.cascade import call_cascade
+from utils.structured import parse_json
+from utils.tracing import span, traced
+import hashlib
 import json
 from typing import Dict, List, Optional, Any
 from pathlib import Path
@@ -7,20 +10,25 @@ import time
 
 class OptimizerAgent:
     def __init__(self):
-        # Simple in-memory cache with timestamp
+        # Simple in-memory cache with timestamp; populated from disk on first
+        # use so constructing the agent (at import time in the backend) is free.
         self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache_loaded = False
         # Conservative temperature for stability
         self._temperature = 0.7
-        # Load prior successful improvements if available
-        self._load_improvements()
 
     def _load_improvements(self) -> None:
-        """Load cached successful improvements from disk."""
+        """Load cached successful improvements from disk (once)."""
+        if self._cache_loaded:
+            return
+        self._cache_loaded = True
         try:
             cache_file = Path(__file__).resolve().parents[2] / 'cache' / 'improvements.json'
             if cache_file.exists():
                 data = json.loads(cache_file.read_text(encoding='utf-8'))
                 if isinstance(data, dict):
+                    # keep anything cached in memory before the lazy load
+                    data.update(self._cache)
                     self._cache = data
         except Exception:
             pass
@@ -40,37 +48,44 @@ class OptimizerAgent:
         except Exception:
             pass
 
-    def _parse_response(self, response: str) -> Optional[dict]:
-        """Safely extract JSON from LLM response."""
+    def _check(self, response: str) -> Optional[str]:
+        """Cascade validator: None when the response is a JSON object with a non-empty plan."""
+        result = self._parse_response(response, record=False)
+        if not isinstance(result, dict):
+            return "invalid_json"
+        if not isinstance(result.get('plan'), str) or not result['plan'].strip():
+            return "no_plan"
+        return None
+
+    def _parse_response(self, response: str, record: bool = True) -> Optional[dict]:
+        """Safely extract JSON from LLM response, repairing it if needed."""
         if not response:
             return None
-        
-        try:
-            # First try: whole response as JSON
-            return json.loads(response)
-        except json.JSONDecodeError:
-            try:
-                # Second try: find JSON object markers
-                start = response.find('{')
-                end = response.rfind('}')
-                if start != -1 and end != -1 and end > start:
-                    return json.loads(response[start:end+1])
-            except json.JSONDecodeError:
-                pass
-        return None
+        result = parse_json(response, "optimizer", record=record)
+        return result if isinstance(result, dict) else None
 
-    def optimize(self, lesson_plan: str, feedback: str, skill_tree) -> dict:
+    @traced("optimizer.optimize", cat="agent")
+    def optimize(self, lesson_plan: str, feedback: str, skill_tree,
+                 history: Optional[List[dict]] = None, focus_areas: Optional[List[str]] = None) -> dict:
         """Optimize lesson plan with caching for stability.
-        
+
+        `history` (earlier edits and their outcomes, see utils.opt_memory) and
+        `focus_areas` are passed to the prompt and are part of the cache key, so
+        an edit that turned out badly is not served again from the cache.
+
         Returns a dict with:
         - plan: improved lesson plan text
         - improvements: list of specific changes
         - exercise: practice exercise dict
         """
-        skill_summary = skill_tree.get_summary()
+        skill_summary = skill_tree.get_summary() if skill_tree is not None else ""
+        with span("optimizer.load_cache", cat="io"):
+            self._load_improvements()
 
         # Check cache first
         cache_key = f"{lesson_plan[:100]}:{feedback[:100]}"
+        if history or focus_areas:
+            cache_key += ":" + hashlib.sha1(json.dumps([history, focus_areas], sort_keys=True).encode('utf-8')).hexdigest()[:12]
         cached = self._cache.get(cache_key)
         if cached:
             # Use cached result if less than 1 hour old
@@ -78,14 +93,18 @@ class OptimizerAgent:
                 return cached['result']
 
         # Get improvements from LLM
-        prompt = get_optimizer_prompt(
-            lesson_plan=lesson_plan,
-            skill_summary=skill_summary,
-            feedback=feedback
-        )
+        with span("optimizer.prompt", cat="agent"):
+            prompt = get_optimizer_prompt(
+                lesson_plan=lesson_plan,
+                skill_summary=skill_summary,
+                feedback=feedback,
+                focus_areas=focus_areas,
+                history=history,
+            )
         
-        response = call_llm(prompt, temp=self._temperature)
-        result = self._parse_response(response)
+        response = call_cascade(prompt, temp=self._temperature, profile="optimizer", validate=self._check)
+        with span("optimizer.parse", cat="agent"):
+            result = self._parse_response(response)
         
         if result and isinstance(result, dict):
             # Cache successful result
@@ -93,10 +112,12 @@ class OptimizerAgent:
                 'result': result,
                 'timestamp': time.time()
             }
-            self._save_improvements()
+            with span("optimizer.save_cache", cat="io"):
+                self._save_improvements()
             return result
 
         # Safe fallback
+        print("Warning: optimizer response is not usable JSON even after repair; keeping the current plan")
         return {
             "plan": lesson_plan,
             "improvements": [],
@@ -0,0 +1,133 @@
+"""Run planning sessions for a whole roster without any prompts.
+
+Usage:
+    python src/batch.py roster.jsonl [--workers 4] [--processes] [--max-llm-calls 2]
+
+Each roster line is a JSON object:
+    {"user_id": "s01", "level": "easy", "answers": [{"question": "...", "answer": "..."}],
+     "skills": {"Memory_Management": 3}}
+
+Sessions run concurrently on a thread pool (or a process pool with
+--processes) while at most --max-llm-calls LLM requests are in flight across
+all of them. Stage results are checkpointed under cache/batch/<run id>/, so
+rerunning the same command after a crash resumes where it stopped; users
+already in the results file are skipped.
+"""
+import argparse
+import json
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from core.session import run_session
+from llm import set_llm_concurrency
+from utils.config import get_setting
+from utils.write_behind import flush_pending_writes
+
+
+def _init_worker(limit):
+    set_llm_concurrency(limit)
+
+
+def _run(entry, config):
+    config = dict(config)
+    if entry.get("skills"):
+        # otherwise the config's own, or run_session's default (the CLI's levels)
+        config["skills"] = entry["skills"]
+    try:
+        return run_session(entry["user_id"], entry.get("level", "easy"), entry.get("answers", []), config)
+    finally:
+        # on disk before the user is recorded as done (process-pool workers skip atexit)
+        flush_pending_writes()
+
+
+def load_roster(path):
+    roster = []
+    for n, line in enumerate(Path(path).read_text(encoding='utf-8').splitlines(), 1):
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if not entry.get("user_id"):
+            raise ValueError(f"{path}:{n}: missing user_id")
+        roster.append(entry)
+    return roster
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roster", help="JSONL file, one student per line")
+    parser.add_argument("--workers", type=int, default=4, help="sessions run at the same time")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    parser.add_argument("--max-llm-calls", type=int, default=int(get_setting('llm.max_concurrent_calls', 0) or 2),
+                        help="LLM requests in flight across all sessions")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--run-id", default=None, help="checkpoint namespace (default: roster file name)")
+    parser.add_argument("--out", default=None, help="results JSONL (default: cache/batch/<run id>/results.jsonl)")
+    args = parser.parse_args(argv)
+
+    repo_root = Path(__file__).resolve().parents[1]
+    run_id = args.run_id or Path(args.roster).stem
+    run_dir = repo_root / 'cache' / 'batch' / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    out_path = Path(args.out) if args.out else run_dir / 'results.jsonl'
+
+    done = set()
+    if out_path.exists():
+        for line in out_path.read_text(encoding='utf-8').splitlines():
+            try:
+                done.add(json.loads(line)["user_id"])
+            except Exception:
+                pass
+    roster = load_roster(args.roster)
+    pending = [e for e in roster if e["user_id"] not in done]
+    print(f"Run '{run_id}': {len(roster)} students, {len(roster) - len(pending)} already done, "
+          f"{len(pending)} to run ({args.workers} {'processes' if args.processes else 'threads'}, "
+          f"{args.max_llm_calls} concurrent LLM calls)")
+
+    config = {"iterations": args.iterations, "checkpoint_dir": str(run_dir / 'checkpoints')}
+    if args.processes:
+        limit = multiprocessing.BoundedSemaphore(args.max_llm_calls)
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(limit,))
+    else:
+        set_llm_concurrency(args.max_llm_calls)
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+
+    started = time.perf_counter()
+    results, failed = [], []
+    with pool, out_path.open('a', encoding='utf-8') as out:
+        futures = {pool.submit(_run, entry, config): entry["user_id"] for entry in pending}
+        for fut in as_completed(futures):
+            user_id = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                failed.append(user_id)
+                print(f"[{user_id}] failed: {e}")
+                continue
+            results.append(result)
+            if not result["errors"]:
+                # only finished sessions are recorded; others rerun (from checkpoints) next time
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+            print(f"[{user_id}] best score {result['best_score']}, {result['llm_calls']} LLM calls, "
+                  f"{result['replayed_stages']} stages resumed, {result['elapsed_s']:.1f}s")
+    wall = time.perf_counter() - started
+
+    durations = sorted(r["elapsed_s"] for r in results)
+    calls = sum(r["llm_calls"] for r in results)
+    print("\n=== Batch summary ===")
+    print(f"sessions: {len(results)} completed ({sum(1 for r in results if r['errors'])} with errors), "
+          f"{len(failed)} failed, {len(done)} skipped")
+    print(f"wall time: {wall:.1f}s, throughput {len(results) / wall * 60 if wall else 0:.2f} sessions/min, "
+          f"{calls / wall * 60 if wall else 0:.1f} LLM calls/min")
+    print(f"LLM calls: {calls}, stages resumed from checkpoints: {sum(r['replayed_stages'] for r in results)}")
+    if durations:
+        p95 = durations[min(len(durations) - 1, int(0.95 * len(durations)))]
+        print(f"session time: p50 {statistics.median(durations):.1f}s, p95 {p95:.1f}s")
+    print(f"results: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
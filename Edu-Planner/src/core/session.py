@@ -0,0 +1,324 @@
+"""Non-interactive planning session: the evaluate -> optimize -> analyze loop of
+`main.main()` without any `input()`, for batch runs over a class roster.
+
+`run_session` takes the student's quiz answers up front. Each stage's result
+is written to a checkpoint file as soon as the stage finishes; rerunning the
+same session with the same checkpoint directory replays finished stages from
+the file instead of calling the LLM again.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from core.ciddp import compute_ciddp_score
+from core.skill_tree import OSSkillTree
+from llm import llm_session
+from utils.io import load_user_best, save_user_iteration
+from utils.opt_memory import get_memory
+from utils.plan_library import warm_start_plan
+from utils.quiz_prefetch import save_best_plan
+from utils.tracing import trace_session
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "iterations": 3,
+    # None -> no checkpoints (every stage runs)
+    "checkpoint_dir": None,
+    # skill levels used when the roster entry gives none (same as the CLI)
+    "skills": {"Processes_and_Threads": 2, "Memory_Management": 3},
+    # None -> initial_plan_for(user_id, skills); set by the plan-library build
+    "initial_plan": None,
+    # False: save nothing to the user's history, best plan or optimizer memory (offline plan-library runs)
+    "persist": True,
+    # number of the first iteration (a WebSocket session continuing where its last run stopped)
+    "first_iteration": 1,
+    # LLM usage / trace session name; None -> "batch:<user_id>"
+    "session_name": None,
+}
+
+StageCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[2]
+
+
+@lru_cache(maxsize=None)
+def _agents():
+    # built once per process and shared by its sessions
+    from agents.analyst_v2 import AnalystAgent
+    from agents.evaluator import EvaluatorAgent
+    from agents.optimizer import OptimizerAgent
+    return EvaluatorAgent(), OptimizerAgent(), AnalystAgent()
+
+
+@lru_cache(maxsize=8)
+def _answer_key(level: str) -> Dict[str, Dict[str, Any]]:
+    p = _repo_root() / 'data' / f"os_questions_{level}.json"
+    try:
+        data = json.loads(p.read_text(encoding='utf-8'))
+    except Exception:
+        return {}
+    items = data if isinstance(data, list) else []
+    return {str(q.get('question', '')).strip(): q for q in items if isinstance(q, dict)}
+
+
+def grade_answers(level: str, answers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normalise roster answers to the CLI's user_answers records.
+
+    Each answer needs `question` and `answer` (the chosen option text);
+    `correct` and `options` are looked up in the level's question bank when
+    missing.
+    """
+    key = _answer_key(level)
+    graded = []
+    for a in answers or []:
+        q = key.get(str(a.get('question', '')).strip(), {})
+        graded.append({
+            "question": a.get('question'),
+            "correct": a.get('correct', q.get('answer')),
+            "options": a.get('options', q.get('options', [])),
+            "user_choice": a.get('choice', ''),
+            "user_answer": a.get('answer', a.get('user_answer', '')),
+        })
+    return graded
+
+
+def initial_plan_for(user_id: str, skills: Any = None) -> str:
+    """The user's saved best plan, else the plan library's plan for the
+    nearest skill profile, else data/lessonplan.txt (as in the CLI)."""
+    data = load_user_best(user_id)
+    if data and data.get('plan'):
+        return data['plan']
+    if skills is not None:
+        entry = warm_start_plan(skills)
+        if entry is not None:
+            return entry['plan']
+    return default_plan()
+
+
+def default_plan() -> str:
+    lp = _repo_root() / 'data' / 'lessonplan.txt'
+    return lp.read_text(encoding='utf-8') if lp.exists() else ""
+
+
+class _Checkpoint:
+    """Stage results for one session, rewritten atomically after each stage."""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self.stages: Dict[str, Any] = {}
+        if path is not None and path.exists():
+            try:
+                self.stages = json.loads(path.read_text(encoding='utf-8')).get('stages', {})
+            except Exception:
+                self.stages = {}
+        self.replayed = 0
+
+    def get(self, stage: str) -> Optional[Any]:
+        if stage in self.stages:
+            self.replayed += stage != "initial_plan"
+            return self.stages[stage]
+        return None
+
+    def put(self, stage: str, result: Any) -> None:
+        self.stages[stage] = result
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({"stages": self.stages}, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+
+def _quiz_scores(user_answers: List[Dict[str, Any]]) -> tuple[dict, str]:
+    # the CLI's fallback when the evaluator returns no scores
+    total_q = len(user_answers) if user_answers else 10
+    correct = sum(ua['user_answer'] == ua['correct'] for ua in user_answers)
+    pct = correct / total_q if total_q else 0.0
+    est_val = max(1, min(5, int(round(pct * 4)) + 1))
+    scores = {dim: est_val for dim in ("Clarity", "Integrity", "Depth", "Practicality", "Pertinence")}
+    return scores, f"Quiz performance: {correct}/{total_q} correct"
+
+
+def _emit(on_stage: Optional[StageCallback], stage: str, payload: Dict[str, Any]) -> None:
+    if on_stage is None:
+        return
+    try:
+        on_stage(stage, payload)
+    except Exception as e:
+        # a listener that went away must not end the session
+        print(f"Warning: stage listener failed: {e}")
+
+
+def run_session(user_id: str, level: str, answers: List[Dict[str, Any]],
+                config: Optional[Dict[str, Any]] = None, on_stage: Optional[StageCallback] = None,
+                stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """Run the planning loop for one student and return its summary.
+
+    Stages are `evaluate_<i>`, `optimize_<i>` and `analyze_<i>`. Every
+    evaluation is saved to the user's history like in the CLI (a crash
+    between saving and checkpointing can save that entry twice on resume).
+
+    `on_stage(stage, payload)` is called from this thread as each stage
+    finishes ("initial_plan", "evaluate", "optimize", "analyze", "error").
+    Once `stop` is set the loop ends before its next stage. Like the CLI,
+    the loop feeds the user's optimizer memory (utils.opt_memory) to the
+    optimizer and ends early (`converged`) once recent optimizations stop
+    improving the score or the optimizer proposes a plan that already
+    scored worse.
+    """
+    cfg = dict(DEFAULT_CONFIG, **(config or {}))
+    started = time.perf_counter()
+    checkpoint_dir = cfg.get("checkpoint_dir")
+    ckpt = _Checkpoint(Path(checkpoint_dir) / f"{user_id}.json" if checkpoint_dir else None)
+
+    skill_tree = OSSkillTree()
+    for dim, lvl in (cfg.get("skills") or {}).items():
+        skill_tree.set_level(dim, int(lvl))
+    user_answers = grade_answers(level, answers)
+    evaluator, optimizer, analyst = _agents()
+
+    # checkpointed too: an interrupted run may already have updated the user's best plan
+    best_plan = ckpt.get("initial_plan")
+    if best_plan is None:
+        best_plan = cfg.get("initial_plan") or initial_plan_for(user_id, skill_tree)
+        ckpt.put("initial_plan", best_plan)
+    _emit(on_stage, "initial_plan", {"plan": best_plan})
+    top_plan, top_score, top_scores = best_plan, None, {}
+    iterations: List[Dict[str, Any]] = []
+    misconceptions: List[str] = []
+    errors: List[str] = []
+    # earlier optimizer edits and how they scored, fed back into the optimizer prompt (as in the CLI)
+    memory = get_memory() if cfg.get("persist", True) else None
+    converged = False
+
+    def failed(stage: str, e: Exception) -> None:
+        errors.append(f"{stage}: {e}")
+        _emit(on_stage, "error", {"stage": stage, "error": str(e)})
+
+    def stopped() -> bool:
+        return stop is not None and stop.is_set()
+
+    name = cfg.get("session_name") or f"batch:{user_id}"
+    first = int(cfg.get("first_iteration") or 1)
+    with trace_session(name), llm_session(name) as session:
+        for i in range(first, first + int(cfg["iterations"])):
+            if stopped() or converged:
+                break
+            result = ckpt.get(f"evaluate_{i}")
+            if result is None:
+                try:
+                    # no answers (e.g. plan-library runs): the evaluator picks bank questions for the profile
+                    scores, feedback = evaluator.evaluate(best_plan, skill_tree, sample_questions=user_answers or None)
+                except (ConnectionError, TimeoutError) as e:
+                    failed(f"evaluate_{i}", e)
+                    continue
+                if not scores or not isinstance(scores, dict):
+                    scores, feedback = _quiz_scores(user_answers)
+                entry = {
+                    "plan": best_plan,
+                    "score": compute_ciddp_score(scores),
+                    "scores": scores,
+                    "iteration": i,
+                    "weak_topics": skill_tree.weakest_dimensions(),
+                }
+                if cfg.get("persist", True):
+                    save_user_iteration(user_id, entry)
+                    # a new best plan is what the user's next quiz is built from
+                    save_best_plan(user_id, entry, level)
+                # closes the optimizer attempt that produced this plan, if any
+                if memory is not None and memory.record_outcome(user_id, best_plan, entry["score"], scores):
+                    converged = memory.converged(user_id)
+                result = {"scores": scores, "score": entry["score"], "feedback": feedback}
+                ckpt.put(f"evaluate_{i}", result)
+            iterations.append({"iteration": i, "score": result["score"], "scores": result["scores"]})
+            _emit(on_stage, "evaluate", dict(result, iteration=i))
+            # ties go to the later plan, which has been through more optimizer passes
+            if top_score is None or result["score"] >= top_score:
+                top_plan, top_score, top_scores = best_plan, result["score"], result["scores"]
+
+            if stopped() or converged:
+                # converged: the last optimizations brought no improvement
+                break
+            # optimize from this run's best plan, not one that just scored worse (as in the CLI)
+            evaluated, best_plan = best_plan, top_plan
+            opt = ckpt.get(f"optimize_{i}")
+            if opt is None:
+                history = focus = None
+                if memory is not None:
+                    history, focus = memory.history(user_id), memory.focus_next(user_id) or None
+                try:
+                    opt = optimizer.optimize(best_plan, result["feedback"], skill_tree, history=history, focus_areas=focus)
+                except (ConnectionError, TimeoutError) as e:
+                    failed(f"optimize_{i}", e)
+                    continue
+                if memory is not None and isinstance(opt, dict) and opt.get('plan') and opt['plan'] != best_plan:
+                    if memory.is_rejected(user_id, opt['plan']):
+                        # this exact plan already scored worse; evaluating it again would only repeat that
+                        opt = dict(opt, plan=best_plan, rejected_plan=True)
+                        converged = True
+                    else:
+                        memory.record_attempt(user_id, opt, top_score, top_scores)
+                ckpt.put(f"optimize_{i}", opt)
+            if isinstance(opt, dict) and opt.get('plan'):
+                best_plan = opt['plan']
+            # against the plan the client saw evaluated last
+            changed = best_plan != evaluated
+            _emit(on_stage, "optimize", {
+                "iteration": i,
+                # the plan text only when it changed; otherwise the client already has it
+                "plan": best_plan if changed else None,
+                "changed": changed,
+                "improvements": opt.get('improvements', []) if isinstance(opt, dict) else [],
+                "focus_next": opt.get('focus_next', []) if isinstance(opt, dict) else [],
+            })
+
+            if stopped():
+                break
+
+            analysis = ckpt.get(f"analyze_{i}")
+            if analysis is None:
+                focus_areas = None
+                if isinstance(opt, dict):
+                    focus_areas = opt.get('focus_next') or [imp.get('area') for imp in opt.get('improvements', []) if imp.get('area')][:3]
+                    focus_areas = [str(f).strip() for f in focus_areas if f] if isinstance(focus_areas, (list, tuple)) else None
+                try:
+                    analysis = analyst.analyze_errors(best_plan, skill_tree, focus_areas=focus_areas)
+                except (ConnectionError, TimeoutError) as e:
+                    failed(f"analyze_{i}", e)
+                    continue
+                ckpt.put(f"analyze_{i}", analysis)
+            found = (analysis.get('misconceptions') or []) if isinstance(analysis, dict) else []
+            for m in found:
+                if m not in misconceptions:
+                    misconceptions.append(m)
+            _emit(on_stage, "analyze", {"iteration": i, "misconceptions": found})
+
+    best = max(iterations, key=lambda it: it["score"], default=None)
+    usage = session.report()
+    return {
+        "user_id": user_id,
+        "level": level,
+        "best_score": best["score"] if best else None,
+        "iterations": iterations,
+        "final_plan": best_plan,
+        # the plan that received best_score (final_plan is the last, unevaluated, optimizer output)
+        "best_plan": top_plan,
+        "misconceptions": misconceptions,
+        "errors": errors,
+        "stopped": stopped(),
+        "converged": converged,
+        "replayed_stages": ckpt.replayed,
+        "llm_calls": usage["calls"],
+        "prompt_tokens_est": usage["prompt_tokens_est"],
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+
+
+__all__ = ["run_session", "grade_answers", "initial_plan_for", "default_plan", "DEFAULT_CONFIG"]
@@ -14,4 +14,8 @@ class OSSkillTree:
             self.levels[dim] = level
 
     def get_summary(self) -> str:
-        return "; ".join([f"{k}: Level {v}" for k, v in self.levels.items()])
\ No newline at end of file
+        return "; ".join([f"{k}: Level {v}" for k, v in self.levels.items()])
+
+    def weakest_dimensions(self, n: int = 2) -> list[str]:
+        """The `n` dimensions with the lowest level (ties keep declaration order)."""
+        return sorted(self.dimensions, key=lambda d: self.levels[d])[:n]
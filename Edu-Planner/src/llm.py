@@ -1,11 +1,710 @@
-import ollama
-
-def call_llm(prompt: str, model: str = "deepseek-r1:latest", temp: float = 0.7) -> str:
-    response = ollama.generate(
-        model=model,
-        prompt=prompt,
-        options={"temperature": temp}
-    )
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.config import get_setting
+from utils.scheduler import get_scheduler
+from utils.structured import format_unsupported, output_format
+from utils.tokens import context_size, estimate_tokens, rebudget
+from utils.tracing import span
+
+
+def response_field(response: Any, key: str) -> Any:
+    """Read a field from an ollama response (dict in old clients, model in new ones)."""
+    try:
+        return response[key]
+    except (KeyError, AttributeError, TypeError):
+        return None
+
+
+class LLMSession:
+    """Per-session bookkeeping for prompt-prefix reuse.
+
+    The prompt builders put the lesson plan and skill profile in a shared
+    prefix, and every call in a session asks Ollama to keep the model
+    resident (`keep_alive`). Ollama then reuses the KV cache for the part of
+    the prompt that matches the previous request and only evaluates the rest;
+    `prompt_eval_count` in its response is the number of tokens it actually
+    evaluated. The session records that per call so the savings can be shown.
+    """
+
+    def __init__(self, session_id: str, keep_alive: Optional[str] = None):
+        self.session_id = session_id
+        # None -> use the per-model default from model_keep_alive()
+        self.keep_alive = keep_alive
+        self.calls: List[Dict[str, Any]] = []
+        self._last_prompt: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, prompt: str, response: Any, elapsed: float) -> None:
+        with self._lock:
+            previous = self._last_prompt.get(model, "")
+            self._last_prompt[model] = prompt
+            shared_chars = len(os.path.commonprefix([previous, prompt]))
+            prompt_tokens = estimate_tokens(prompt)
+            evaluated = response_field(response, 'prompt_eval_count')
+            # Ollama omits prompt_eval_count when the entire prompt was cached
+            evaluated = int(evaluated) if evaluated is not None else 0
+            self.calls.append({
+                "model": model,
+                "prompt_tokens_est": prompt_tokens,
+                "shared_prefix_tokens_est": estimate_tokens(prompt[:shared_chars]) if shared_chars else 0,
+                "prompt_eval_count": evaluated,
+                "eval_count": int(response_field(response, 'eval_count') or 0),
+                "elapsed_s": round(elapsed, 3),
+                # per-section token counts from the prompt builders (utils.tokens.Prompt)
+                "sections": dict(getattr(prompt, 'report', {}).get('sections', {})),
+            })
+
+    def report(self) -> Dict[str, Any]:
+        """Totals for the session; `saved_tokens_est` is what the cache spared."""
+        with self._lock:
+            calls = list(self.calls)
+        prompt_tokens = sum(c['prompt_tokens_est'] for c in calls)
+        evaluated = sum(c['prompt_eval_count'] for c in calls)
+        sections: Dict[str, int] = {}
+        for c in calls:
+            for name, tokens in c['sections'].items():
+                sections[name] = sections.get(name, 0) + tokens
+        return {
+            "session_id": self.session_id,
+            "calls": len(calls),
+            "prompt_tokens_est": prompt_tokens,
+            "prompt_eval_count": evaluated,
+            "saved_tokens_est": max(0, prompt_tokens - evaluated),
+            "shared_prefix_tokens_est": sum(c['shared_prefix_tokens_est'] for c in calls),
+            "eval_count": sum(c['eval_count'] for c in calls),
+            "section_tokens_est": sections,
+        }
+
+
+_current_session: contextvars.ContextVar[Optional[LLMSession]] = contextvars.ContextVar('llm_session', default=None)
+_sessions: "OrderedDict[str, LLMSession]" = OrderedDict()
+_sessions_lock = threading.Lock()
+_MAX_SESSIONS = 256
+_MAX_SESSION_HOSTS = 4 * _MAX_SESSIONS  # router's (session, model) -> host entries
+
+
+def get_session(session_id: str) -> LLMSession:
+    """Return the session registered under `session_id`, creating it if needed."""
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            session = LLMSession(session_id)
+            _sessions[session_id] = session
+            while len(_sessions) > _MAX_SESSIONS:
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(session_id)
+        return session
+
+
+@contextlib.contextmanager
+def llm_session(session_id: str) -> Iterator[LLMSession]:
+    """Route every `call_llm` inside the block through the named session."""
+    token = _current_session.set(get_session(session_id))
+    try:
+        yield _current_session.get()
+    finally:
+        _current_session.reset(token)
+
+
+_token_meter: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar('llm_token_meter', default=None)
+_token_meter_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def count_llm_tokens() -> Iterator[Dict[str, int]]:
+    """Add up the tokens Ollama processed for every `call_llm` in the block.
+
+    Yields {"calls", "prompt_eval_count", "eval_count"}; calls made from
+    threads that run in a copy of the block's context are counted too.
+    """
+    meter = {"calls": 0, "prompt_eval_count": 0, "eval_count": 0}
+    token = _token_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _token_meter.reset(token)
+
+
+class LLMTimeoutError(TimeoutError):
+    """A call did not complete within its deadline (retries and hedges included)."""
+
+
+class CallPolicy:
+    """Deadline / retry / hedging policy for one agent profile.
+
+    Built from `llm.profiles.default` overlaid with `llm.profiles.<name>`:
+      timeout_s      overall deadline for the call, retries included
+      retries        extra rounds over the endpoints after every host failed
+      backoff_s      base for full-jitter exponential backoff between rounds
+      hedge          fire a duplicate request at a second endpoint when the
+                     first is slower than the profile's observed p95
+      hedge_after_s  hedge delay used until enough latency samples exist
+    """
+
+    def __init__(self, name: str = "default", timeout_s: float = 300.0, retries: int = 2,
+                 backoff_s: float = 1.0, hedge: bool = False, hedge_after_s: Optional[float] = None):
+        self.name = name
+        self.timeout_s = float(timeout_s)
+        self.retries = int(retries)
+        self.backoff_s = float(backoff_s)
+        self.hedge = bool(hedge)
+        self.hedge_after_s = float(hedge_after_s) if hedge_after_s is not None else None
+
+    @classmethod
+    def for_profile(cls, name: str = "default") -> "CallPolicy":
+        profiles = get_setting('llm.profiles', None) or {}
+        merged = dict(profiles.get('default') or {})
+        merged.update(profiles.get(name) or {})
+        known = ('timeout_s', 'retries', 'backoff_s', 'hedge', 'hedge_after_s')
+        return cls(name, **{k: v for k, v in merged.items() if k in known})
+
+    def backoff(self, round_no: int) -> float:
+        """Full-jitter backoff before retry round `round_no` (1-based)."""
+        return random.uniform(0, self.backoff_s * (2 ** (round_no - 1)))
+
+
+class _Cancelled(Exception):
+    """Raised inside a worker whose request lost a hedge race or ran out of time."""
+
+
+class _AttemptFailed(Exception):
+    def __init__(self, endpoints: tuple, error: Exception):
+        super().__init__(str(error))
+        self.endpoints = endpoints
+        self.error = error
+
+
+# response fields copied from the final chunk of a streamed generation
+_STAT_FIELDS = ('model', 'done_reason', 'total_duration', 'load_duration', 'prompt_eval_count',
+                'prompt_eval_duration', 'eval_count', 'eval_duration')
+
+
+DEFAULT_HOST = "http://localhost:11434"
+
+
+def configured_hosts() -> List[str]:
+    """Ollama endpoints to route across.
+
+    `OLLAMA_HOSTS` (comma separated) wins, then `llm.endpoints` in
+    settings.yaml, then the client's usual `OLLAMA_HOST` / localhost default.
+    """
+    env = os.environ.get('OLLAMA_HOSTS', '')
+    hosts = [h.strip() for h in env.split(',') if h.strip()]
+    if not hosts:
+        hosts = [str(h) for h in get_setting('llm.endpoints', None) or [] if h]
+    if not hosts:
+        hosts = [os.environ.get('OLLAMA_HOST') or DEFAULT_HOST]
+    return hosts
+
+
+def _is_failover_error(exc: Exception) -> bool:
+    """True if the request may succeed on another endpoint."""
+    if isinstance(exc, (ConnectionError, OSError)):
+        return True
+    status = getattr(exc, 'status_code', None)
+    if isinstance(status, int):
+        # 404: model not pulled on this host; 5xx: server-side failure
+        return status == 404 or status >= 500
+    try:
+        import httpx
+        return isinstance(exc, httpx.TransportError)
+    except ImportError:
+        return False
+
+
+class OllamaEndpoint:
+    """One Ollama host plus the router's view of its health and load."""
+
+    def __init__(self, host: str, stall_timeout_s: float = 300.0):
+        self.host = host
+        self.stall_timeout_s = stall_timeout_s
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0
+        self.models: Optional[set] = None   # pulled models; None until first health check
+        self.resident: set = set()          # models currently loaded in memory
+        self.latency_s: Optional[float] = None
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    import ollama
+                    # The read timeout only bounds silence between streamed chunks
+                    # (it also reaps requests abandoned after a deadline or hedge);
+                    # the per-call deadline is enforced by the router.
+                    timeout = httpx.Timeout(self.stall_timeout_s, connect=10.0)
+                    self._client = ollama.Client(host=self.host, timeout=timeout)
+        return self._client
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+            "resident": sorted(self.resident),
+            "latency_s": round(self.latency_s, 3) if self.latency_s is not None else None,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaRouter:
+    """Spread `generate` calls across several Ollama hosts.
+
+    Routing picks, among healthy endpoints, the one with the fewest
+    outstanding requests, preferring hosts that already have the model
+    resident (loading it elsewhere costs far more than a short queue) as long
+    as they have fewer than `affinity_max_outstanding` requests in flight.
+    Calls made under an `llm_session` stick to the endpoint that served the
+    session's last call for the same model, under the same health and load
+    conditions, so Ollama can reuse the prompt prefix it already evaluated
+    (the shared plan/profile prefix of `core.prompts`) instead of every host
+    evaluating it from scratch.
+    Connection errors, 5xx and "model not found" responses fail over to the
+    next endpoint; the failed one is marked unhealthy until a background
+    health check (`/api/ps` + `/api/tags`) sees it answer again.
+
+    Each call runs under a `CallPolicy`: a deadline for the whole call,
+    jittered-backoff retry rounds once every endpoint has failed, and
+    optional hedging. Generations are streamed on a worker thread so a call
+    that loses a hedge race or passes its deadline can be cancelled: closing
+    the stream drops the connection, which makes Ollama stop generating.
+    """
+
+    def __init__(self, hosts: List[str], health_interval_s: float = 15.0,
+                 affinity_max_outstanding: int = 2, unhealthy_after: int = 1,
+                 stall_timeout_s: float = 300.0, max_workers: int = 32,
+                 hedge_quantile: float = 0.95, hedge_min_samples: int = 20):
+        self.endpoints = [OllamaEndpoint(h, stall_timeout_s) for h in hosts]
+        self.health_interval_s = health_interval_s
+        self.affinity_max_outstanding = affinity_max_outstanding
+        self.unhealthy_after = unhealthy_after
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ollama-call")
+        self._latencies: Dict[tuple, deque] = {}
+        # (session_id, model) -> endpoint of the session's last call, least recent first
+        self._session_hosts: "OrderedDict[tuple, OllamaEndpoint]" = OrderedDict()
+        self.counters = {"calls": 0, "retries": 0, "failovers": 0, "timeouts": 0,
+                         "hedges": 0, "hedge_wins": 0, "cancelled": 0, "session_affinity": 0}
+
+    # -- health -----------------------------------------------------------
+    def check(self, ep: OllamaEndpoint) -> bool:
+        """Actively probe one endpoint and refresh its model inventory."""
+        try:
+            resident = {str(response_field(m, 'model') or response_field(m, 'name'))
+                        for m in response_field(ep.client.ps(), 'models') or []}
+            models = {str(response_field(m, 'model') or response_field(m, 'name'))
+                      for m in response_field(ep.client.list(), 'models') or []}
+            with self._lock:
+                ep.resident, ep.models = resident, models
+                ep.healthy, ep.failures, ep.last_error = True, 0, None
+                ep.last_check = time.time()
+            return True
+        except Exception as e:
+            with self._lock:
+                ep.healthy, ep.last_error = False, str(e)
+                ep.last_check = time.time()
+            return False
+
+    def check_all(self) -> None:
+        for ep in self.endpoints:
+            self.check(ep)
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_interval_s):
+            self.check_all()
+
+    def start_health_checks(self) -> None:
+        """Start periodic health checks (no-op for a single endpoint)."""
+        if len(self.endpoints) < 2 or (self._health_thread and self._health_thread.is_alive()):
+            return
+        self.check_all()
+        self._stop.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -- routing ----------------------------------------------------------
+    def _rank(self, ep: OllamaEndpoint, model: str) -> tuple:
+        if not ep.healthy:
+            tier = 3  # still tried last: the health view may be stale
+        elif model in ep.resident and ep.outstanding < self.affinity_max_outstanding:
+            tier = 0
+        elif ep.models is None or model in ep.models:
+            tier = 1
+        else:
+            tier = 2
+        return (tier, ep.outstanding, ep.latency_s if ep.latency_s is not None else 0.0)
+
+    def _sticky(self, ep: Optional[OllamaEndpoint], model: str) -> bool:
+        return (ep is not None and ep.healthy and ep.outstanding < self.affinity_max_outstanding
+                and (ep.models is None or model in ep.models))
+
+    def acquire(self, model: str, exclude: tuple = (), session_id: str = "") -> Optional[OllamaEndpoint]:
+        """Pick an endpoint for `model` and count the request as outstanding on it.
+
+        With a `session_id`, the endpoint that served the session's last call
+        for `model` is preferred while it is healthy and not too busy.
+        """
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep not in exclude]
+            if not candidates:
+                return None
+            ep = self._session_hosts.get((session_id, model)) if session_id else None
+            if ep in candidates and self._sticky(ep, model):
+                self.counters["session_affinity"] += 1
+            else:
+                ep = min(candidates, key=lambda e: self._rank(e, model))
+            ep.outstanding += 1
+            return ep
+
+    def _remember(self, session_id: str, model: str, ep: OllamaEndpoint) -> None:
+        if not session_id or len(self.endpoints) < 2:
+            return
+        with self._lock:
+            self._session_hosts[(session_id, model)] = ep
+            self._session_hosts.move_to_end((session_id, model))
+            while len(self._session_hosts) > _MAX_SESSION_HOSTS:
+                self._session_hosts.popitem(last=False)
+
+    def release(self, ep: OllamaEndpoint, model: str, elapsed: Optional[float] = None,
+                error: Optional[Exception] = None, cancelled: bool = False) -> None:
+        with self._lock:
+            ep.outstanding = max(0, ep.outstanding - 1)
+            if cancelled:
+                self.counters["cancelled"] += 1
+            elif error is None:
+                ep.healthy, ep.failures, ep.last_error = True, 0, None
+                ep.resident.add(model)
+                if elapsed is not None:
+                    ep.latency_s = elapsed if ep.latency_s is None else 0.8 * ep.latency_s + 0.2 * elapsed
+            else:
+                ep.last_error = str(error)
+                if getattr(error, 'status_code', None) == 404 and ep.models is not None:
+                    ep.models.discard(model)
+                    ep.resident.discard(model)
+                else:
+                    ep.failures += 1
+                    if ep.failures >= self.unhealthy_after:
+                        ep.healthy = False
+
+    # -- latency tracking for hedging --------------------------------------
+    def _record_latency(self, model: str, profile: str, elapsed: float) -> None:
+        with self._lock:
+            self._latencies.setdefault((model, profile), deque(maxlen=200)).append(elapsed)
+
+    def latency_quantile(self, model: str, profile: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get((model, profile), ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def _hedge_delay(self, model: str, policy: CallPolicy) -> Optional[float]:
+        if not policy.hedge or len(self.endpoints) < 2:
+            return None
+        observed = self.latency_quantile(model, policy.name, self.hedge_quantile)
+        return observed if observed is not None else policy.hedge_after_s
+
+    # -- request execution -------------------------------------------------
+    def _stream(self, ep: OllamaEndpoint, model: str, prompt: str, kwargs: dict,
+                cancel: threading.Event, deadline: float) -> Dict[str, Any]:
+        """Run one streamed generation on `ep`; returns an ollama-shaped dict."""
+        started = time.perf_counter()
+        parts: List[str] = []
+        final: Any = None
+        try:
+            stream = ep.client.generate(model=model, prompt=prompt, stream=True, **kwargs)
+            try:
+                for chunk in stream:
+                    if cancel.is_set() or time.monotonic() > deadline:
+                        raise _Cancelled()
+                    parts.append(response_field(chunk, 'response') or '')
+                    if response_field(chunk, 'done'):
+                        final = chunk
+            finally:
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()  # drops the HTTP stream -> Ollama aborts the generation
+        except _Cancelled:
+            self.release(ep, model, cancelled=True)
+            raise
+        except Exception as e:
+            # a request abandoned by the caller is not the endpoint's fault
+            self.release(ep, model, error=None if cancel.is_set() else e, cancelled=cancel.is_set())
+            raise
+        elapsed = time.perf_counter() - started
+        self.release(ep, model, elapsed=elapsed)
+        result = {k: response_field(final, k) for k in _STAT_FIELDS} if final is not None else {}
+        result['response'] = ''.join(parts)
+        result['host'] = ep.host
+        result['elapsed_s'] = elapsed
+        return result
+
+    def _submit(self, ep: OllamaEndpoint, model: str, prompt: str, kwargs: dict, deadline: float):
+        cancel = threading.Event()
+        future = self._pool.submit(self._stream, ep, model, prompt, kwargs, cancel, deadline)
+        return future, cancel
+
+    def _attempt(self, model: str, prompt: str, kwargs: dict, deadline: float,
+                 policy: CallPolicy, exclude: tuple, session_id: str = "") -> Dict[str, Any]:
+        """One (possibly hedged) request; raises _AttemptFailed or LLMTimeoutError."""
+        primary = self.acquire(model, exclude=exclude, session_id=session_id)
+        future, cancel = self._submit(primary, model, prompt, kwargs, deadline)
+        pending = {future: (primary, cancel)}
+
+        hedge_after = self._hedge_delay(model, policy)
+        if hedge_after is not None:
+            done, _ = wait([future], timeout=max(0.0, min(hedge_after, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                second = self.acquire(model, exclude=exclude + (primary,))
+                if second is not None:
+                    with self._lock:
+                        self.counters["hedges"] += 1
+                    f2, c2 = self._submit(second, model, prompt, kwargs, deadline)
+                    pending[f2] = (second, c2)
+
+        failed: List[tuple] = []
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                for _, c in pending.values():
+                    c.set()
+                raise LLMTimeoutError(f"LLM call ({policy.name}) exceeded {policy.timeout_s:.0f}s deadline")
+            done, _ = wait(list(pending), timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                ep, _ = pending.pop(f)
+                try:
+                    result = f.result()
+                except _Cancelled:
+                    continue
+                except Exception as e:
+                    failed.append((ep, e))
+                    continue
+                for _, loser_cancel in pending.values():
+                    loser_cancel.set()
+                if ep is not primary:
+                    with self._lock:
+                        self.counters["hedge_wins"] += 1
+                self._record_latency(model, policy.name, result['elapsed_s'])
+                self._remember(session_id, model, ep)
+                return result
+        if not failed:
+            raise LLMTimeoutError(f"LLM call ({policy.name}) exceeded {policy.timeout_s:.0f}s deadline")
+        raise _AttemptFailed(tuple(ep for ep, _ in failed), failed[-1][1])
+
+    def generate(self, model: str, prompt: str, policy: Optional[CallPolicy] = None, session_id: str = "",
+                 **kwargs) -> Dict[str, Any]:
+        """Generate on the best endpoint, with failover, retries, hedging and a deadline.
+
+        Every endpoint is tried once per round (immediate failover); after a
+        round in which all of them failed, the call backs off with jitter and
+        starts another round, up to `policy.retries` times. Raises
+        `LLMTimeoutError` at the deadline, and `ConnectionError` when all
+        rounds failed.
+        """
+        policy = policy or CallPolicy()
+        self.start_health_checks()
+        deadline = time.monotonic() + policy.timeout_s
+        with self._lock:
+            self.counters["calls"] += 1
+        tried: tuple = ()
+        rounds = 0
+        last_error: Optional[Exception] = None
+        try:
+            while True:
+                if len(tried) >= len(self.endpoints):
+                    if rounds >= policy.retries:
+                        break
+                    rounds += 1
+                    delay = policy.backoff(rounds)
+                    if time.monotonic() + delay >= deadline:
+                        raise LLMTimeoutError(
+                            f"LLM call ({policy.name}) ran out of time after {rounds} round(s): {last_error}")
+                    with self._lock:
+                        self.counters["retries"] += 1
+                    time.sleep(delay)
+                    tried = ()
+                try:
+                    return self._attempt(model, prompt, kwargs, deadline, policy, tried, session_id)
+                except _AttemptFailed as failed:
+                    if not _is_failover_error(failed.error):
+                        raise failed.error
+                    with self._lock:
+                        self.counters["failovers"] += 1
+                    tried += tuple(ep for ep in failed.endpoints if ep not in tried)
+                    last_error = failed.error
+        except LLMTimeoutError:
+            with self._lock:
+                self.counters["timeouts"] += 1
+            raise
+        raise ConnectionError(
+            f"No Ollama endpoint could serve model '{model}' after {rounds + 1} round(s) "
+            f"over {len(self.endpoints)} host(s): {last_error}"
+        )
+
+    def model_available(self, model: str) -> Optional[bool]:
+        """Whether some endpoint has `model` pulled; None until an inventory is known."""
+        with self._lock:
+            inventories = [ep.models for ep in self.endpoints if ep.models is not None]
+        if not inventories:
+            return None
+        return any(model in models for models in inventories)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters)
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.snapshot() for ep in self.endpoints]
+
+
+_router: Optional[OllamaRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> OllamaRouter:
+    """Process-wide router built from `configured_hosts()` and `llm.routing` settings."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = OllamaRouter(
+                configured_hosts(),
+                health_interval_s=float(get_setting('llm.routing.health_interval_s', 15)),
+                affinity_max_outstanding=int(get_setting('llm.routing.affinity_max_outstanding', 2)),
+                stall_timeout_s=float(get_setting('llm.routing.stall_timeout_s', 300)),
+                max_workers=int(get_setting('llm.routing.max_workers', 32)),
+                hedge_quantile=float(get_setting('llm.routing.hedge_quantile', 0.95)),
+                hedge_min_samples=int(get_setting('llm.routing.hedge_min_samples', 20)),
+            )
+        return _router
+
+
+def model_keep_alive(model: str) -> Optional[str]:
+    """keep_alive to send for `model`: its llm.warmup.models entry, else llm.keep_alive.
+
+    Every request resets Ollama's unload timer, so all callers (sessions, the
+    warm-up pinger) must agree on the value or they would shorten each other's.
+    """
+    for entry in get_setting('llm.warmup.models', None) or []:
+        if isinstance(entry, dict) and entry.get('name') == model and entry.get('keep_alive') is not None:
+            return str(entry['keep_alive'])
+    keep_alive = get_setting('llm.keep_alive')
+    return str(keep_alive) if keep_alive is not None else None
+
+
+_call_limit: Optional[Any] = None
+_call_limit_lock = threading.Lock()
+
+
+def set_llm_concurrency(limit: Optional[Any]) -> None:
+    """Cap concurrent `call_llm` calls in this process.
+
+    `limit` is a number of slots (the scheduler's, see utils.scheduler), or a
+    semaphore object (e.g. a multiprocessing.BoundedSemaphore shared by pool
+    workers so the cap is global across processes); None removes the cap.
+    """
+    global _call_limit
+    with _call_limit_lock:
+        if isinstance(limit, int) or limit is None:
+            get_scheduler().configure(slots=limit or 0)
+            _call_limit = None
+        else:
+            _call_limit = limit
+
+
+def _llm_slot():
+    with _call_limit_lock:
+        return _call_limit if _call_limit is not None else contextlib.nullcontext()
+
+
+def call_llm(prompt: str, model: str = "deepseek-r1:latest", temp: float = 0.7, profile: str = "default",
+             priority: Optional[str] = None, policy: Optional[CallPolicy] = None) -> str:
+    # The ollama client (httpx/pydantic) is only imported by the router when
+    # the first request is made, keeping CLI and backend start-up fast.
+    session = _current_session.get()
+    keep_alive = (session.keep_alive if session else None) or model_keep_alive(model)
+    kwargs = {"keep_alive": keep_alive} if keep_alive else {}
+
+    # Always send num_ctx: the prompt builders budget against it, and Ollama
+    # would otherwise silently drop the start of a prompt that overflows its
+    # default window.
+    num_ctx = context_size(model)
+    report = getattr(prompt, 'report', None)
+    if report is not None and report.get('num_ctx') != num_ctx:
+        # budgeted for another model (e.g. the large one, then sent to the cascade's small one)
+        if getattr(prompt, 'sections', None) is not None:
+            prompt = rebudget(prompt, model)
+            report = prompt.report
+        else:
+            report = None
+    if report is None and estimate_tokens(prompt) > num_ctx:
+        print(f"Warning: prompt of ~{estimate_tokens(prompt)} tokens exceeds num_ctx={num_ctx} for {model}")
+
+    # Queue for a slot: interactive calls are admitted ahead of background
+    # work, users share their class fairly (utils.scheduler).
+    scheduler = get_scheduler()
+    priority = scheduler.resolve(priority, profile)
+    policy = policy or CallPolicy.for_profile(profile)
+    with span("llm.call", cat="llm", model=model, profile=profile, priority=priority) as sp, \
+            contextlib.ExitStack() as slot:
+        with span("llm.wait_slot", cat="llm", priority=priority):
+            slot.enter_context(scheduler.slot(priority, session.session_id if session else ""))
+            slot.enter_context(_llm_slot())
+        started = time.perf_counter()
+        # Constrain the answer to the profile's JSON schema (utils.structured)
+        schema = output_format(profile, model)
+        if schema is not None:
+            kwargs["format"] = schema
+        generate = functools.partial(get_router().generate, model=model, prompt=prompt, policy=policy,
+                                     session_id=session.session_id if session else "",
+                                     options={"temperature": temp, "num_ctx": num_ctx})
+        try:
+            response = generate(**kwargs)
+        except Exception as e:
+            if schema is None or getattr(e, 'status_code', None) != 400:
+                raise
+            # the server predates schema `format`: stop sending it for this model
+            print(f"Warning: {model} rejected the JSON schema ({e}); retrying without it")
+            format_unsupported(model)
+            del kwargs["format"]
+            response = generate(**kwargs)
+        sp["prompt_eval_count"] = response_field(response, 'prompt_eval_count')
+        sp["eval_count"] = response_field(response, 'eval_count')
+    if session is not None:
+        session.record(model, prompt, response, time.perf_counter() - started)
+    meter = _token_meter.get()
+    if meter is not None:
+        with _token_meter_lock:
+            meter["calls"] += 1
+            meter["prompt_eval_count"] += int(response_field(response, 'prompt_eval_count') or 0)
+            meter["eval_count"] += int(response_field(response, 'eval_count') or 0)
     print(response['response'].strip())
     return response['response'].strip()
 
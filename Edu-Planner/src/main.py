@@ -3,6 +3,7 @@ from agents.evaluator import EvaluatorAgent
 from agents.optimizer import OptimizerAgent
 from agents.analyst_v2 import AnalystAgent
 from core.ciddp import compute_ciddp_score
+from core.records import decode_questions
 # try to import a python module that provides `lessonplan` (optional)
 try:
     from data.lessonplan import lessonplan as lessonplan_text
@@ -14,14 +15,16 @@ import random
 import time
 from utils.io import (
     save_user_iteration,
-    update_user_best_plan_if_higher,
     get_user_best_plan,
-    save_generated_questions,
-    append_questions_to_level,
+    load_user_best,
 )
-from llm import call_llm
-from utils.prompts import get_question_generation_prompt
-import uuid
+from llm import llm_session
+from utils import codec
+from utils.question_gen import GeneratedQuestionStore, generate_questions
+from utils.opt_memory import get_memory
+from utils.plan_library import warm_start_plan
+from utils.quiz_prefetch import get_prefetcher, prefetch_enabled, save_best_plan
+from utils.tracing import span, trace_session
 
 def main():
 
@@ -35,22 +38,22 @@ def main():
     # Step 2: Load questions (resolve path relative to project root)
     repo_root = Path(__file__).resolve().parents[1]
     questions_file = repo_root / 'data' / f"os_questions_{level}.json"
-    with open(questions_file, "r", encoding="utf-8") as f:
-        questions = json.load(f)
+    questions = codec.loads(questions_file.read_bytes())
 
     # Step 3: Select 10 random (unordered) MCQs and collect answers
-    # Normalize loaded JSON to a list of question dicts if needed
-    questions_list = []
+    # Normalize loaded JSON to a list of question records (invalid items are dropped)
+    items = []
     if isinstance(questions, list):
-        questions_list = questions
+        items = questions
     elif isinstance(questions, dict):
         for key in ("questions", "items", "data"):
             if key in questions and isinstance(questions[key], list):
-                questions_list = questions[key]
+                items = questions[key]
                 break
         else:
             lists = [v for v in questions.values() if isinstance(v, list)]
-            questions_list = lists[0] if lists else []
+            items = lists[0] if lists else []
+    questions_list, _errors = decode_questions(items, level, source=questions_file.name)
 
     if not questions_list:
         print("No questions found in the selected file.")
@@ -100,13 +103,12 @@ def main():
     if user_best_path.exists():
         # User has previous iteration - load their specific plan
         try:
-            with open(user_best_path, 'r', encoding='utf-8') as f:
-                user_data = json.loads(f.read())
-                if user_data and isinstance(user_data, dict) and user_data.get('plan'):
-                    initial_plan = user_data['plan']
-                    print(f"Loading your previous lesson plan for user {user_id}")
-                else:
-                    raise ValueError("Invalid user plan data")
+            user_data = load_user_best(user_id)
+            if user_data and user_data.get('plan'):
+                initial_plan = user_data['plan']
+                print(f"Loading your previous lesson plan for user {user_id}")
+            else:
+                raise ValueError("Invalid user plan data")
         except Exception as e:
             print(f"Error loading user plan: {e}")
             initial_plan = None
@@ -116,9 +118,16 @@ def main():
         initial_plan = None
 
     # If no user plan loaded, use default initialization priority:
+    # 0) the plan library's plan for the nearest skill profile
     # 1) lessonplan_text from module
     # 2) lessonplan.txt file
     # 3) built-in default
+    if initial_plan is None:
+        library_entry = warm_start_plan(skill_tree)
+        if library_entry is not None:
+            initial_plan = library_entry['plan']
+            print(f"Starting from the precomputed plan for skill profile {library_entry['profile']} "
+                  f"(distance {library_entry['distance']}, score {library_entry.get('score', 0):.2f})")
     if initial_plan is None:
         if lessonplan_text:
             initial_plan = lessonplan_text
@@ -156,115 +165,151 @@ def main():
     best_plan_snapshot = initial_plan
     collected_pitfalls = []
     seen_pitfalls = set()
+    # earlier optimizer edits and how they scored, fed back into the optimizer prompt
+    memory = get_memory()
+    run_best = None  # (score, scores, plan, feedback) of this run's best evaluation
+    stop_early = False
+
+    # One LLM session per run: the plan/profile prefix stays cached in Ollama
+    # across the evaluator/optimizer/analyst calls of consecutive iterations.
+    # The loop (not the interactive quiz) is traced when sampled, see utils.tracing.
+    with trace_session(f"cli:{user_id}") as trace, llm_session(f"cli:{user_id}") as session:
+        for iteration in range(3):
+            print(f"\n--- Evaluator Agent (Iteration {iteration+1}) ---")
+            avg_score = 0.0
+            try:
+                scores, feedback = evaluator.evaluate(best_plan, skill_tree, sample_questions=user_answers)
+            except (ConnectionError, TimeoutError) as e:
+                # call_llm has already failed over / retried within its deadline
+                print(f"[Iter {iteration+1}] Ollama unavailable: {e}")
+                print("Skipping evaluation for this iteration.")
+                score_queue.append({"score": 0.0, "scores": {}, "plan": best_plan})
+                continue
 
-    for iteration in range(3):
-        print(f"\n--- Evaluator Agent (Iteration {iteration+1}) ---")
-        avg_score = 0.0
-        try:
-            scores, feedback = evaluator.evaluate(best_plan, skill_tree, sample_questions=user_answers)
-        except ConnectionError as e:
-            print(f"[Iter {iteration+1}] Ollama connection error: {e}")
-            print("Skipping evaluation for this iteration.")
-            score_queue.append({"score": 0.0, "scores": {}, "plan": best_plan})
-            continue
-
-        # Get or estimate scores
-        if not scores or not isinstance(scores, dict):
-            print("Estimating scores from quiz performance...")
-            total_q = len(user_answers) if user_answers else 10
-            correct = sum(ua['user_answer'] == ua['correct'] for ua in user_answers)
-            pct = correct / total_q if total_q else 0.0
-            # Map to 1-5 scale
-            est_val = max(1, min(5, int(round(pct * 4)) + 1))
-            scores = {
-                'Clarity': est_val,
-                'Integrity': est_val,
-                'Depth': est_val,
-                'Practicality': est_val,
-                'Pertinence': est_val
+            # Get or estimate scores
+            if not scores or not isinstance(scores, dict):
+                print("Estimating scores from quiz performance...")
+                total_q = len(user_answers) if user_answers else 10
+                correct = sum(ua['user_answer'] == ua['correct'] for ua in user_answers)
+                pct = correct / total_q if total_q else 0.0
+                # Map to 1-5 scale
+                est_val = max(1, min(5, int(round(pct * 4)) + 1))
+                scores = {
+                    'Clarity': est_val,
+                    'Integrity': est_val,
+                    'Depth': est_val,
+                    'Practicality': est_val,
+                    'Pertinence': est_val
+                }
+                feedback = f"Quiz performance: {correct}/{total_q} correct"
+
+            # Compute CIDDP score
+            avg_score = compute_ciddp_score(scores)
+            print(f" CIDDP Score: {avg_score:.2f}")
+
+            # User ID is already obtained at the start
+
+            # Save plan snapshot (persist per-user history) and keep runtime queue
+            plan_entry = {
+                "plan": best_plan,
+                "score": avg_score,
+                "scores": scores,
+                "iteration": iteration + 1,
+                "weak_topics": skill_tree.weakest_dimensions(),
             }
-            feedback = f"Quiz performance: {correct}/{total_q} correct"
-
-        # Compute CIDDP score
-        avg_score = compute_ciddp_score(scores)
-        print(f" CIDDP Score: {avg_score:.2f}")
-
-        # User ID is already obtained at the start
-
-        # Save plan snapshot (persist per-user history) and keep runtime queue
-        plan_entry = {
-            "plan": best_plan,
-            "score": avg_score,
-            "scores": scores,
-            "iteration": iteration + 1
-        }
-        save_user_iteration(user_id, plan_entry)
-        # also update the user's best plan file if this iteration improved the score
-        try:
-            update_user_best_plan_if_higher(user_id, plan_entry)
-        except Exception:
-            pass
-        # keep an in-memory session list for quick runtime reporting
-        score_queue.append(plan_entry)
-
-        # Optimize plan (cached if recently done)
-        print("\n--- Optimizer Agent ---")
-        
-        # Get current user's best plan path
-        user_best_path = repo_root / 'data' / 'user_best' / f"{user_id}.json"
-        
-        # Get the current score for comparison if user has previous iteration
-        current_best_score = 0
-        focus_next = None
-        if user_best_path.exists():
+            save_user_iteration(user_id, plan_entry)
+            # also update the user's best plan file if this iteration improved the score;
+            # quizzes are built from that plan, so a new one starts the next quiz's generation
             try:
-                with open(user_best_path, 'r', encoding='utf-8') as f:
-                    user_data = json.loads(f.read())
-                    if isinstance(user_data, dict):
-                        current_best_score = user_data.get('score', 0)
-                        # Get focus areas from last optimization if available
-                        last_opt = user_data.get('last_optimization', {})
-                        if isinstance(last_opt, dict):
-                            focus_next = last_opt.get('focus_next')
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"Warning: Could not read previous optimization data: {e}")
-
-        opt_result = optimizer.optimize(best_plan, feedback, skill_tree)
+                save_best_plan(user_id, plan_entry, level)
+            except Exception:
+                pass
+            # keep an in-memory session list for quick runtime reporting
+            score_queue.append(plan_entry)
+            if run_best is None or avg_score >= run_best[0]:
+                run_best = (avg_score, scores, best_plan, feedback)
+
+            # Close the previous optimizer attempt with this evaluation
+            attempt = memory.record_outcome(user_id, best_plan, avg_score, scores) if memory else None
+            if attempt is not None:
+                print(f"Last optimization: {attempt['outcome']} ({attempt['delta']:+.2f})")
+                if memory.converged(user_id):
+                    print("The last optimizations brought no improvement; stopping early.")
+                    break
+            # optimize from this run's best plan, not one that just scored worse
+            base_score, base_scores, best_plan, feedback = run_best
+
+            # Optimize plan (cached if recently done)
+            print("\n--- Optimizer Agent ---")
         
-        if isinstance(opt_result, dict) and opt_result.get('plan'):
-            best_plan = opt_result['plan']
-            if opt_result.get('improvements'):
-                print("\nImprovements made:")
-                for imp in opt_result['improvements']:
-                    print(f"- {imp.get('text', '')}")
-                print(f"\nCurrent iteration score: {avg_score:.2f}")
-                print(f"Previous best score: {current_best_score:.2f}")
+            # Get the current score for comparison if user has previous iteration
+            # (the best-plan file may still be in the write-behind buffer)
+            current_best_score = 0
+            focus_next = None
+            with span("cli.read_user_best", cat="io"):
+                user_data = load_user_best(user_id)
+            if user_data:
+                current_best_score = user_data.get('score', 0)
+                # Get focus areas from last optimization if available
+                last_opt = user_data.get('last_optimization', {})
+                if isinstance(last_opt, dict):
+                    focus_next = last_opt.get('focus_next')
+
+            history = memory.history(user_id) if memory else None
+            if memory:
+                focus_next = memory.focus_next(user_id) or focus_next
+            opt_result = optimizer.optimize(best_plan, feedback, skill_tree, history=history, focus_areas=focus_next)
+
+            if (memory and isinstance(opt_result, dict) and opt_result.get('plan')
+                    and memory.is_rejected(user_id, opt_result['plan'])):
+                print("The optimizer proposed a plan that already scored worse; keeping the current plan.")
+                # the next evaluation would only repeat this one
+                stop_early = True
+            elif isinstance(opt_result, dict) and opt_result.get('plan'):
+                best_plan = opt_result['plan']
+                if memory:
+                    memory.record_attempt(user_id, opt_result, base_score, base_scores)
+                if opt_result.get('improvements'):
+                    print("\nImprovements made:")
+                    for imp in opt_result['improvements']:
+                        print(f"- {imp.get('text', '')}")
+                    print(f"\nCurrent iteration score: {avg_score:.2f}")
+                    print(f"Previous best score: {current_best_score:.2f}")
         
-        # Store last optimization result for next iteration
-        plan_entry['last_optimization'] = opt_result
+            # Store last optimization result for next iteration
+            plan_entry['last_optimization'] = opt_result
         
-        # Short delay to avoid overwhelming the LLM
-        time.sleep(1)
-
-        # Analyst step: get misconceptions as JSON (focused)
-        print("\n--- Analyst Agent ---")
-        # Determine focus areas from optimizer output if available
-        focus_areas = None
-        if isinstance(opt_result, dict):
-            focus_areas = opt_result.get('focus_next') or [imp.get('area') for imp in opt_result.get('improvements', []) if imp.get('area')][:3]
-            # normalize focus_areas to list of strings
-            if isinstance(focus_areas, (list, tuple)):
-                focus_areas = [str(f).strip() for f in focus_areas if f]
-            else:
-                focus_areas = None
+            # Short delay to avoid overwhelming the LLM
+            with span("cli.sleep"):
+                time.sleep(1)
+
+            # Analyst step: get misconceptions as JSON (focused)
+            print("\n--- Analyst Agent ---")
+            # Determine focus areas from optimizer output if available
+            focus_areas = None
+            if isinstance(opt_result, dict):
+                focus_areas = opt_result.get('focus_next') or [imp.get('area') for imp in opt_result.get('improvements', []) if imp.get('area')][:3]
+                # normalize focus_areas to list of strings
+                if isinstance(focus_areas, (list, tuple)):
+                    focus_areas = [str(f).strip() for f in focus_areas if f]
+                else:
+                    focus_areas = None
+
+            analyst_result = analyst.analyze_errors(best_plan, skill_tree, focus_areas=focus_areas)
+            misconceptions = analyst_result.get('misconceptions') if isinstance(analyst_result, dict) else [analyst_result]
+            print("Common Pitfalls Suggested:")
+            print(misconceptions)
+            if misconceptions and json.dumps(misconceptions) not in seen_pitfalls:
+                collected_pitfalls.append(misconceptions)
+                seen_pitfalls.add(json.dumps(misconceptions))
+            if stop_early:
+                break
 
-        analyst_result = analyst.analyze_errors(best_plan, skill_tree, focus_areas=focus_areas)
-        misconceptions = analyst_result.get('misconceptions') if isinstance(analyst_result, dict) else [analyst_result]
-        print("Common Pitfalls Suggested:")
-        print(misconceptions)
-        if misconceptions and json.dumps(misconceptions) not in seen_pitfalls:
-            collected_pitfalls.append(misconceptions)
-            seen_pitfalls.add(json.dumps(misconceptions))
+    if trace is not None:
+        print(f"\nTrace written to {trace.path}")
+    usage = session.report()
+    print(f"\nLLM prompt tokens: ~{usage['prompt_tokens_est']} sent, {usage['prompt_eval_count']} evaluated "
+          f"(~{usage['saved_tokens_est']} reused from the cached prefix over {usage['calls']} calls)")
 
     # Show max CIDPP score and corresponding lesson plan
     max_score_entry = max(score_queue, key=lambda x: x["score"], default=None)
@@ -323,51 +368,30 @@ def main():
             else:
                 plan_text = best_plan
 
-            prompt = get_question_generation_prompt(plan_text, gen_level, n_q)
-            print("Requesting LLM to generate questions... (this may take a moment)")
-            resp = call_llm(prompt)
-
-            # crude JSON array extraction
+            # Generated in concurrent shards; each shard's valid items are saved
+            # as soon as it finishes, so an interrupted run keeps what it has.
             try:
-                start = resp.find('[')
-                end = resp.rfind(']')
-                if start == -1 or end == -1:
-                    raise ValueError("No JSON array found in LLM response")
-                arr_text = resp[start:end+1]
-                generated = json.loads(arr_text)
-                # validate items
-                valid = []
-                for i, it in enumerate(generated):
-                    if not isinstance(it, dict):
-                        continue
-                    # ensure required keys
-                    for k in ("id", "topic", "level", "question", "options", "answer", "explanation"):
-                        if k not in it:
-                            it[k] = None
-                    # normalize id if missing
-                    if not it.get('id'):
-                        it['id'] = f"gen-{gen_level}-{uuid.uuid4().hex[:8]}"
-                    # ensure level matches requested
-                    it['level'] = gen_level
-                    # ensure options is a list
-                    if not isinstance(it.get('options'), list):
-                        it['options'] = [str(it.get('answer'))] if it.get('answer') else []
-                    valid.append(it)
+                filename = f"generated_questions_{gen_level}_{user_id}.json"
+                store = GeneratedQuestionStore(gen_level, filename)
+                # usually ready already: pre-generated in the background for this plan and level
+                prefetched = get_prefetcher().get(user_id, plan_text, gen_level, n_q) if prefetch_enabled() else None
+                if prefetched and len(prefetched) >= n_q:
+                    store.add(prefetched)
+                    valid = store.questions
+                    print(f"Using {len(valid)} questions prepared in the background for this plan")
+                else:
+                    print("Requesting LLM to generate questions... (this may take a moment)")
+                    with trace_session(f"cli-questions:{user_id}"):
+                        gen = generate_questions(plan_text, gen_level, n_q, store=store)
+                    valid = gen['questions']
+                    print(f"Generated {len(valid)}/{n_q} questions in {gen['shards']} shards "
+                          f"({gen['retries']} retries, {gen['invalid']} invalid, {gen['duplicates']} duplicates) "
+                          f"in {gen['elapsed_s']:.1f}s")
 
                 if not valid:
                     print("LLM returned no valid question objects.")
                 else:
-                    filename = f"generated_questions_{gen_level}_{user_id}.json"
-                    save_generated_questions(filename, valid)
-
-                    # Append generated questions to the canonical level dataset (os_questions_<level>.json)
-                    try:
-                        appended = append_questions_to_level(gen_level, valid)
-                    except Exception as e:
-                        appended = 0
-                        print(f"Warning: failed to append to level dataset: {e}")
-
-                    print(f"Saved {len(valid)} questions to data/{filename}. Appended {appended} to os_questions_{gen_level}.json.")
+                    print(f"Saved {len(valid)} questions to data/{filename}. Appended {store.appended} to os_questions_{gen_level}.json.")
 
                     # Offer the user to attempt the generated questions now
                     try:
@@ -441,7 +465,7 @@ def main():
                             }
                             try:
                                 save_user_iteration(user_id, entry)
-                                update_user_best_plan_if_higher(user_id, entry)
+                                save_best_plan(user_id, entry, gen_level)
                             except Exception as e:
                                 print(f"Warning: failed to save personalized plan: {e}")
                         else:
@@ -449,7 +473,7 @@ def main():
                     except Exception as e:
                         print(f"Failed to generate personalized plan: {e}")
             except Exception as e:
-                print(f"Failed to parse generated questions: {e}\nRaw response:\n{resp}")
+                print(f"Failed to generate questions: {e}")
     except Exception:
         pass
 
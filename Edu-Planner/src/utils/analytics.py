@@ -0,0 +1,231 @@
+"""Cohort analytics over CIDDP scores, maintained incrementally.
+
+Every `save_user_iteration` feeds the new entry to `record_iteration`, which
+updates a handful of NumPy arrays in O(1): running mean/variance per CIDDP
+dimension (Welford), score histograms, the mean score change per iteration
+number, and how often each topic was flagged weak. The arrays are persisted
+to cache/analytics.npz, so `/api/analytics` answers from them without
+reading any history file. `rebuild_analytics()` recomputes them from
+data/user_plans when needed (e.g. after deleting histories).
+
+Entries whose scores are all 0 (the placeholder written when evaluation
+failed) are not counted, nor are plans saved before they were evaluated
+(`/api/optimize` candidates: `candidate: true`, or, in older histories,
+an overall score of 0 next to the previous plan's scores).
+
+Several processes (backend workers, batch processes, the CLI) update the
+same file: each load-add-save runs under its cross-process lock
+(`utils.file_lock`) and starts from the file as the previous process left
+it, so no update is lost.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.file_lock import file_lock
+
+DIMENSIONS = ("Clarity", "Integrity", "Depth", "Practicality", "Pertinence")
+# histogram bins over the 0-5 CIDDP scale, 0.5 wide; the last row is the overall score
+BIN_EDGES = np.linspace(0.0, 5.0, 11)
+MAX_ITERATIONS = 64
+
+
+def _analytics_path() -> Path:
+    return Path(__file__).resolve().parents[2] / 'cache' / 'analytics.npz'
+
+
+class CohortAnalytics:
+    """Aggregates over every saved iteration of every user."""
+
+    def __init__(self):
+        n = len(DIMENSIONS) + 1  # five dimensions + overall score
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n, dtype=np.float64)
+        self.m2 = np.zeros(n, dtype=np.float64)
+        self.hist = np.zeros((n, len(BIN_EDGES) - 1), dtype=np.int64)
+        # score change vs. the user's previous entry, by iteration number
+        self.improve_count = np.zeros(MAX_ITERATIONS, dtype=np.int64)
+        self.improve_sum = np.zeros(MAX_ITERATIONS, dtype=np.float64)
+        self.users: List[str] = []
+        self.last_score = np.zeros(0, dtype=np.float64)
+        self.topics: List[str] = []
+        self.topic_counts = np.zeros(0, dtype=np.int64)
+        self._user_index: Dict[str, int] = {}
+        self._topic_index: Dict[str, int] = {}
+
+    # -- updates ---------------------------------------------------------
+
+    def _user_slot(self, user_id: str) -> int:
+        slot = self._user_index.get(user_id)
+        if slot is None:
+            slot = self._user_index[user_id] = len(self.users)
+            self.users.append(user_id)
+            self.last_score = np.append(self.last_score, np.nan)
+        return slot
+
+    def add(self, user_id: str, entry: Dict[str, Any]) -> bool:
+        """Fold one history entry into the aggregates; returns False if it had no usable scores."""
+        scores = entry.get('scores') if isinstance(entry.get('scores'), dict) else {}
+        values = np.full(len(DIMENSIONS) + 1, np.nan)
+        for i, dim in enumerate(DIMENSIONS):
+            v = scores.get(dim)
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                values[i] = float(v)
+        if not np.any(values[:-1] > 0):
+            return False
+        score = entry.get('score')
+        if entry.get('candidate') or (isinstance(score, (int, float)) and score <= 0):
+            return False  # not evaluated yet
+        values[-1] = float(score) if isinstance(score, (int, float)) else np.nanmean(values[:-1])
+
+        present = ~np.isnan(values)
+        x = np.clip(values[present], 0.0, 5.0)
+        self.count[present] += 1
+        delta = x - self.mean[present]
+        self.mean[present] += delta / self.count[present]
+        self.m2[present] += delta * (x - self.mean[present])
+        bins = np.minimum(np.searchsorted(BIN_EDGES, x, side='right') - 1, len(BIN_EDGES) - 2)
+        self.hist[np.nonzero(present)[0], bins] += 1
+
+        slot = self._user_slot(user_id)
+        previous = self.last_score[slot]
+        iteration = entry.get('iteration')
+        if not np.isnan(previous) and isinstance(iteration, int) and 0 < iteration <= MAX_ITERATIONS:
+            self.improve_count[iteration - 1] += 1
+            self.improve_sum[iteration - 1] += values[-1] - previous
+        self.last_score[slot] = values[-1]
+
+        for topic in entry.get('weak_topics') or []:
+            slot = self._topic_index.get(str(topic))
+            if slot is None:
+                self._topic_index[str(topic)] = len(self.topics)
+                self.topics.append(str(topic))
+                self.topic_counts = np.append(self.topic_counts, 1)
+            else:
+                self.topic_counts[slot] += 1
+        return True
+
+    # -- queries ---------------------------------------------------------
+
+    def summary(self, top_topics: int = 10) -> Dict[str, Any]:
+        names = list(DIMENSIONS) + ["overall"]
+        var = np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), 0.0)
+        dims = {
+            name: {
+                "count": int(self.count[i]),
+                "mean": round(float(self.mean[i]), 4),
+                "variance": round(float(var[i]), 4),
+                "std": round(float(np.sqrt(var[i])), 4),
+                "histogram": self.hist[i].tolist(),
+            }
+            for i, name in enumerate(names)
+        }
+        used = np.nonzero(self.improve_count)[0]
+        improvement = [
+            {"iteration": int(i + 1), "count": int(self.improve_count[i]),
+             "mean_change": round(float(self.improve_sum[i] / self.improve_count[i]), 4)}
+            for i in used
+        ]
+        order = np.argsort(-self.topic_counts, kind='stable')[:top_topics]
+        return {
+            "users": len(self.users),
+            "entries": int(self.count[-1]),
+            "bin_edges": BIN_EDGES.tolist(),
+            "dimensions": dims,
+            "improvement_per_iteration": improvement,
+            "weak_topics": [{"topic": self.topics[i], "count": int(self.topic_counts[i])} for i in order],
+        }
+
+    # -- persistence -----------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # per process: batch workers flush their analytics at the same moment
+        tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, count=self.count, mean=self.mean, m2=self.m2, hist=self.hist,
+                 improve_count=self.improve_count, improve_sum=self.improve_sum,
+                 users=np.array(self.users, dtype=str), last_score=self.last_score,
+                 topics=np.array(self.topics, dtype=str), topic_counts=self.topic_counts)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CohortAnalytics":
+        stats = cls()
+        with np.load(path) as data:
+            for name in ('count', 'mean', 'm2', 'hist', 'improve_count', 'improve_sum',
+                         'last_score', 'topic_counts'):
+                setattr(stats, name, data[name].copy())
+            stats.users = data['users'].tolist()
+            stats.topics = data['topics'].tolist()
+        stats._user_index = {u: i for i, u in enumerate(stats.users)}
+        stats._topic_index = {t: i for i, t in enumerate(stats.topics)}
+        return stats
+
+
+_analytics: Optional[CohortAnalytics] = None
+_analytics_stamp: Optional[tuple] = None
+_lock = threading.Lock()
+
+
+def _file_stamp(p: Path) -> Optional[tuple]:
+    # every save is a new file (os.replace), so the inode changes even within one mtime tick
+    try:
+        st = p.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _load_locked() -> CohortAnalytics:
+    # reload when another process (CLI run, other worker) has saved newer aggregates
+    global _analytics, _analytics_stamp
+    p = _analytics_path()
+    stamp = _file_stamp(p)
+    if _analytics is None or stamp != _analytics_stamp:
+        try:
+            _analytics = CohortAnalytics.load(p) if stamp is not None else CohortAnalytics()
+        except Exception:
+            _analytics = CohortAnalytics()
+        _analytics_stamp = stamp
+    return _analytics
+
+
+def record_iteration(user_id: str, entry: Dict[str, Any]) -> None:
+    """Update and persist the aggregates with one saved history entry."""
+    global _analytics_stamp
+    p = _analytics_path()
+    with _lock, file_lock(p):
+        stats = _load_locked()
+        if stats.add(user_id, entry):
+            stats.save(p)
+            _analytics_stamp = _file_stamp(p)
+
+
+def cohort_summary(top_topics: int = 10) -> Dict[str, Any]:
+    with _lock:
+        return _load_locked().summary(top_topics)
+
+
+def rebuild_analytics() -> Dict[str, Any]:
+    """Recompute the aggregates from every data/user_plans history (a full scan)."""
+    from utils.io import load_user_history_page
+    global _analytics, _analytics_stamp
+    stats = CohortAnalytics()
+    plans_dir = Path(__file__).resolve().parents[2] / 'data' / 'user_plans'
+    for p in sorted(plans_dir.glob('*.json')):
+        entries, _ = load_user_history_page(p.stem, 0, 10 ** 9, ['score', 'scores', 'iteration', 'weak_topics', 'candidate'])
+        for entry in entries:
+            stats.add(p.stem, entry)
+    path = _analytics_path()
+    with _lock, file_lock(path):
+        stats.save(path)
+        _analytics, _analytics_stamp = stats, _file_stamp(path)
+    return stats.summary()
+
+
+__all__ = ["CohortAnalytics", "DIMENSIONS", "record_iteration", "cohort_summary", "rebuild_analytics"]
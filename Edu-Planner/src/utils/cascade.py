@@ -0,0 +1,138 @@
+"""Small-model-first cascade for agent LLM calls.
+
+For the profiles listed in `llm.cascade.profiles`, `call_cascade` first asks
+`llm.cascade.small_model` (one attempt, `small_timeout_s` deadline). The
+caller's validator checks the answer (parses, scores in range, answer among
+the options, ...) and returns None to accept it or a short reason to
+escalate. On a rejected answer, an error or a timeout, the prompt goes to the
+large model (call_llm's default) with the profile's normal policy. When the
+small model turns out not to be pulled on any host it is skipped for
+`unavailable_retry_s`.
+
+Every decision is counted per profile (`cascade_stats()`, served at
+/api/llm/cascade) and appended to `llm.cascade.log` (JSON lines) for
+`scripts/cascade_report.py`.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from llm import CallPolicy, call_llm, get_router
+from utils import codec
+from utils.config import get_setting
+
+Validator = Callable[[str], Optional[str]]
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+_log_lock = threading.Lock()
+_unavailable_until: Dict[str, float] = {}
+
+
+def cascade_enabled(profile: str) -> bool:
+    return bool(get_setting('llm.cascade.small_model')) and profile in (get_setting('llm.cascade.profiles', None) or [])
+
+
+def _small_available(model: str) -> bool:
+    if time.monotonic() < _unavailable_until.get(model, 0.0):
+        return False
+    return get_router().model_available(model) is not False
+
+
+def _record(profile: str, decision: str, reason: Optional[str], small_s: Optional[float],
+            large_s: Optional[float], small_model: str) -> None:
+    total = (small_s or 0.0) + (large_s or 0.0)
+    with _stats_lock:
+        s = _stats.setdefault(profile, {"calls": 0, "small_accepted": 0, "escalated": 0, "skipped": 0,
+                                        "reasons": {}, "small_s": 0.0, "large_s": 0.0, "large_calls": 0,
+                                        "total_s": 0.0})
+        s["calls"] += 1
+        s[decision] += 1
+        if reason:
+            key = reason.split(':', 1)[0]
+            s["reasons"][key] = s["reasons"].get(key, 0) + 1
+        s["small_s"] += small_s or 0.0
+        if large_s is not None:
+            s["large_s"] += large_s
+            s["large_calls"] += 1
+        s["total_s"] += total
+    log = get_setting('llm.cascade.log', 'cache/cascade.jsonl')
+    if not log:
+        return
+    path = Path(str(log))
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parents[2] / path
+    line = codec.dumps({"ts": round(time.time(), 3), "profile": profile, "decision": decision, "reason": reason,
+                        "small_model": small_model, "small_s": small_s and round(small_s, 3),
+                        "large_s": large_s and round(large_s, 3), "total_s": round(total, 3)}, pretty=False)
+    try:
+        with _log_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open('a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def call_cascade(prompt: str, profile: str, validate: Validator, temp: float = 0.7) -> str:
+    """`call_llm` through the small model first when the profile is cascaded."""
+    if not cascade_enabled(profile):
+        return call_llm(prompt, temp=temp, profile=profile)
+    small = str(get_setting('llm.cascade.small_model'))
+    if not _small_available(small):
+        started = time.perf_counter()
+        response = call_llm(prompt, temp=temp, profile=profile)
+        _record(profile, "skipped", "small_unavailable", None, time.perf_counter() - started, small)
+        return response
+
+    policy = CallPolicy.for_profile(profile)
+    policy.timeout_s = float(get_setting('llm.cascade.small_timeout_s', 60))
+    policy.retries, policy.hedge = 0, False
+    started = time.perf_counter()
+    reason: Optional[str]
+    try:
+        response = call_llm(prompt, model=small, temp=temp, profile=profile, policy=policy)
+        reason = validate(response)
+    except TimeoutError:
+        reason = "small_timeout"
+    except Exception as e:
+        # any failure of the small tier (not pulled, server error, bad validator input) escalates
+        reason = f"small_error: {e}"
+        if "not found" in str(e).lower() or "404" in str(e):
+            _unavailable_until[small] = time.monotonic() + float(get_setting('llm.cascade.unavailable_retry_s', 300))
+    small_s = time.perf_counter() - started
+    if reason is None:
+        _record(profile, "small_accepted", None, small_s, None, small)
+        return response
+
+    started = time.perf_counter()
+    response = call_llm(prompt, temp=temp, profile=profile)
+    _record(profile, "escalated", reason, small_s, time.perf_counter() - started, small)
+    return response
+
+
+def cascade_stats() -> Dict[str, Any]:
+    """Per-profile hit rate and latency; `est_saving_s` compares with large-only calls."""
+    with _stats_lock:
+        out = {}
+        for profile, s in _stats.items():
+            large_mean = s["large_s"] / s["large_calls"] if s["large_calls"] else None
+            mean = s["total_s"] / s["calls"] if s["calls"] else None
+            out[profile] = {
+                "calls": s["calls"],
+                "small_accepted": s["small_accepted"],
+                "escalated": s["escalated"],
+                "skipped": s["skipped"],
+                "hit_rate": round(s["small_accepted"] / s["calls"], 3) if s["calls"] else None,
+                "escalation_reasons": dict(s["reasons"]),
+                "mean_s": round(mean, 3) if mean is not None else None,
+                "large_mean_s": round(large_mean, 3) if large_mean is not None else None,
+                "est_saving_s": round(large_mean - mean, 3) if large_mean is not None and mean is not None else None,
+            }
+        return out
+
+
+__all__ = ["call_cascade", "cascade_enabled", "cascade_stats", "Validator"]
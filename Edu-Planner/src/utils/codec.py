@@ -0,0 +1,68 @@
+"""JSON codec used for every data file.
+
+Uses orjson when it is installed (several times faster, bytes in/out) and the
+stdlib `json` module otherwise; both produce the same documents. Output is
+compact unless `storage.pretty_json` is true or `pretty=True` is passed.
+Record objects (core.records) are encoded through their `to_dict()`.
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+from utils.config import get_setting
+
+try:
+    import orjson  # optional
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj: Any) -> Any:
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _pretty(pretty: Optional[bool]) -> bool:
+    return bool(get_setting('storage.pretty_json', False)) if pretty is None else pretty
+
+
+def dumps_bytes(obj: Any, pretty: Optional[bool] = None) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_INDENT_2 if _pretty(pretty) else 0)
+    return dumps(obj, pretty).encode('utf-8')
+
+
+def dumps(obj: Any, pretty: Optional[bool] = None) -> str:
+    if orjson is not None:
+        return dumps_bytes(obj, pretty).decode('utf-8')
+    if _pretty(pretty):
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=_default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_json(path: Path, default: Any = None) -> Any:
+    """Decoded contents of `path`, or `default` if it is missing or invalid."""
+    try:
+        return loads(Path(path).read_bytes())
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: Path, obj: Any, pretty: Optional[bool] = None) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(dumps_bytes(obj, pretty))
+
+
+__all__ = ["BACKEND", "dumps", "dumps_bytes", "loads", "read_json", "write_json"]
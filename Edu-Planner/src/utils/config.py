@@ -0,0 +1,41 @@
+"""Access to config/settings.yaml.
+
+The file is parsed once per process; callers read values with dotted paths,
+e.g. ``get_setting("llm.model", "deepseek-r1:latest")``.
+"""
+from __future__ import annotations
+
+import functools
+from pathlib import Path
+from typing import Any
+
+
+def _settings_path() -> Path:
+    return Path(__file__).resolve().parents[2] / 'config' / 'settings.yaml'
+
+
+@functools.lru_cache(maxsize=1)
+def load_settings() -> dict:
+    """Return the parsed settings file, or an empty dict if it is missing/invalid."""
+    p = _settings_path()
+    if not p.exists():
+        return {}
+    try:
+        import yaml  # only needed once, keep it off the import path
+        data = yaml.safe_load(p.read_text(encoding='utf-8'))
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def get_setting(path: str, default: Any = None) -> Any:
+    """Look up a dotted key such as ``llm.keep_alive``; return `default` if absent."""
+    node: Any = load_settings()
+    for part in path.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return default
+        node = node[part]
+    return node
+
+
+__all__ = ["load_settings", "get_setting"]
@@ -0,0 +1,170 @@
+"""Retrieval over the curated misconception list in data/errordb.txt.
+
+The file is a JSON list of {error, topic, how_to_prone_it, outcome} entries.
+`lookup_misconceptions()` ranks them with BM25 against the current focus
+areas (restricted to the chapters the lesson plan covers), so the analyst
+can answer known misconceptions without an LLM call. Misconceptions the LLM
+produces are added back with `learn_misconceptions()`: they are indexed
+immediately and persisted to cache/errordb_learned.json (the curated file is
+never rewritten).
+
+The index is built once per process and rebuilt only when errordb.txt
+changes on disk.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.config import get_setting
+from utils.retrieval import BM25Index, tokenize
+
+_CHAPTER_RE = re.compile(r"^\s*(chapter\s+\d+)\b", re.IGNORECASE)
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[2]
+
+
+def _errordb_path() -> Path:
+    return _repo_root() / 'data' / 'errordb.txt'
+
+
+def _learned_path() -> Path:
+    return _repo_root() / 'cache' / 'errordb_learned.json'
+
+
+def _chapter_key(text: str) -> Optional[str]:
+    m = _CHAPTER_RE.match(text or "")
+    return ' '.join(m.group(1).lower().split()) if m else None
+
+
+def plan_chapters(plan: str) -> List[str]:
+    """Heading lines such as 'Chapter 3: Processes' found in a lesson plan."""
+    return [line.strip() for line in (plan or "").splitlines() if _chapter_key(line)]
+
+
+class MisconceptionIndex:
+    """BM25 index over misconception entries, with de-duplicated incremental adds."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries: List[Dict[str, Any]] = []
+        self.index = BM25Index()
+        self._seen: set = set()
+        for e in entries:
+            self.add(e)
+
+    @staticmethod
+    def _key(entry: Dict[str, Any]) -> str:
+        return ' '.join(tokenize(str(entry.get('error', ''))))
+
+    def add(self, entry: Dict[str, Any]) -> bool:
+        """Index `entry` unless an entry with the same error text exists."""
+        if not isinstance(entry, dict) or not entry.get('error'):
+            return False
+        key = self._key(entry)
+        if not key or key in self._seen:
+            return False
+        self._seen.add(key)
+        self.entries.append(entry)
+        # the error text is what a query should match first, so it counts twice
+        text = ' '.join(str(entry.get(f, '')) for f in ('error', 'error', 'topic', 'how_to_prone_it', 'outcome'))
+        self.index.add(text)
+        return True
+
+    def search(self, query: str, k: int = 6, chapters: Optional[List[str]] = None) -> List[tuple]:
+        """Top `k` (entry, score) pairs; `chapters` limits curated entries to those chapters."""
+        allowed = None
+        if chapters:
+            keys = {_chapter_key(c) for c in chapters}
+            allowed = {i for i, e in enumerate(self.entries)
+                       if _chapter_key(str(e.get('topic', ''))) in keys or not _chapter_key(str(e.get('topic', '')))}
+        return [(self.entries[i], score) for i, score in self.index.search(query, k=k, allowed=allowed)]
+
+
+_index: Optional[MisconceptionIndex] = None
+_index_mtime: Optional[float] = None
+_lock = threading.Lock()
+
+
+def _load_json_list(p: Path) -> List[Dict[str, Any]]:
+    try:
+        data = json.loads(p.read_text(encoding='utf-8'))
+        return [e for e in data if isinstance(e, dict)] if isinstance(data, list) else []
+    except Exception:
+        return []
+
+
+def get_misconception_index() -> MisconceptionIndex:
+    """Process-wide index over errordb.txt plus learned entries (built once)."""
+    global _index, _index_mtime
+    p = _errordb_path()
+    mtime = p.stat().st_mtime if p.exists() else None
+    with _lock:
+        if _index is None or mtime != _index_mtime:
+            entries = _load_json_list(p) if p.exists() else []
+            learned = _learned_path()
+            if learned.exists():
+                entries += _load_json_list(learned)
+            _index, _index_mtime = MisconceptionIndex(entries), mtime
+        return _index
+
+
+def lookup_misconceptions(plan: str, focus_areas: Optional[List[str]] = None, k: int = 6) -> Dict[str, Any]:
+    """Retrieve known misconceptions for the focus areas of a lesson plan.
+
+    The focus areas are the query; curated entries are limited to the
+    chapters present in the plan. Scores are normalised to [0, 1] by the
+    query's maximum BM25 score, and the result is `confident` when at least
+    `retrieval.errordb.min_hits` entries reach `retrieval.errordb.min_score`.
+    """
+    min_score = float(get_setting('retrieval.errordb.min_score', 0.25))
+    min_hits = int(get_setting('retrieval.errordb.min_hits', 3))
+
+    query = ' '.join(str(f) for f in (focus_areas or []) if f)
+    index = get_misconception_index()
+    ceiling = index.index.max_score(query) if query.strip() else 0.0
+    hits = []
+    if ceiling > 0:
+        for entry, score in index.search(query, k=k, chapters=plan_chapters(plan)):
+            if score / ceiling >= min_score:
+                hits.append((entry, score / ceiling))
+    return {
+        "misconceptions": [str(e['error']) for e, _ in hits],
+        "entries": [dict(e, score=round(s, 3)) for e, s in hits],
+        "confidence": round(min(1.0, len(hits) / max(1, min_hits)), 3),
+        "confident": len(hits) >= min_hits,
+    }
+
+
+def learn_misconceptions(items: List[Any], topic: str = "") -> int:
+    """Add LLM-produced misconceptions to the index and persist them; returns how many were new."""
+    index = get_misconception_index()
+    new_entries = []
+    with _lock:
+        for item in items or []:
+            if isinstance(item, dict):
+                entry = {k: item.get(k) for k in ('error', 'topic', 'how_to_prone_it', 'outcome') if item.get(k)}
+                entry.setdefault('error', item.get('misconception') or item.get('text'))
+            else:
+                entry = {"error": str(item).strip()}
+            entry.setdefault('topic', topic)
+            entry['source'] = 'llm'
+            if index.add(entry):
+                new_entries.append(entry)
+        if new_entries:
+            learned = _learned_path()
+            try:
+                existing = _load_json_list(learned) if learned.exists() else []
+                learned.parent.mkdir(parents=True, exist_ok=True)
+                learned.write_text(json.dumps(existing + new_entries, indent=2, ensure_ascii=False), encoding='utf-8')
+            except Exception:
+                pass  # the in-memory index still has them
+    return len(new_entries)
+
+
+__all__ = ["MisconceptionIndex", "get_misconception_index", "lookup_misconceptions",
+           "learn_misconceptions", "plan_chapters"]
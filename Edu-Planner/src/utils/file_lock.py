@@ -0,0 +1,66 @@
+"""Cross-process lock on a data file.
+
+Threads of one process serialise their read-modify-write cycles with
+`threading` locks, but the backend with several workers and
+`batch.py --processes` run several processes over the same data/ and cache/
+files. `file_lock(path)` holds an exclusive advisory lock on a sibling
+`<name>.lock` file (flock on POSIX, msvcrt on Windows) for the duration of a
+`with` block, so a process that reads a file, changes it and replaces it
+cannot interleave with another one doing the same. Separate opens conflict
+even within one process, so it also excludes other threads.
+
+Every writer of a file has to take the lock; readers do not need it, the
+files are replaced atomically.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_path(path: Path) -> Path:
+    return Path(path).with_name(f"{Path(path).name}.lock")
+
+
+def _acquire(f: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue  # LK_LOCK gives up after ten one-second retries
+
+
+def _release(f: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Hold the exclusive cross-process lock for `path` (waits for it)."""
+    p = lock_path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with open(p, 'a+b') as f:
+        _acquire(f)
+        try:
+            yield
+        finally:
+            _release(f)
+
+
+__all__ = ["file_lock", "lock_path"]
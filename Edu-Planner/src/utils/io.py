@@ -2,10 +2,14 @@ from __future__ import annotations
 
 import json
 import random
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
+from utils.tracing import traced
 
+
+@traced("io.load_questions", cat="io")
 def load_questions(file_path: Optional[str | Path] = None, n: int = 10) -> List[Dict[str, Any]]:
 	"""Load questions from a JSON file and return up to `n` random questions.
 
@@ -16,6 +20,8 @@ def load_questions(file_path: Optional[str | Path] = None, n: int = 10) -> List[
 	  common keys like 'questions' or 'items'.
 	- If the file contains fewer than `n` questions, returns all of them in
 	  random order.
+	- Items that are not valid questions (see core.records.Question) are
+	  skipped, with a warning naming each of them.
 
 	Returns an empty list if no questions can be found or parsed.
 	"""
@@ -31,8 +37,7 @@ def load_questions(file_path: Optional[str | Path] = None, n: int = 10) -> List[
 	if not file_path.exists():
 		raise FileNotFoundError(f"Questions file not found: {file_path}")
 
-	with file_path.open("r", encoding="utf-8") as fh:
-		data = json.load(fh)
+	data = codec.loads(file_path.read_bytes())
 
 	items: List[Dict[str, Any]] = []
 	if isinstance(data, list):
@@ -48,8 +53,10 @@ def load_questions(file_path: Optional[str | Path] = None, n: int = 10) -> List[
 			lists = [v for v in data.values() if isinstance(v, list)]
 			items = lists[0] if lists else []
 
-	# Ensure items are dict-like
-	items = [it for it in items if isinstance(it, dict)]
+	# Validate at decode time: items that are not usable questions (no text,
+	# answer not among the options, ...) are dropped here, once.
+	records, _errors = decode_questions(items, source=file_path.name)
+	items = [q.to_dict() for q in records]
 
 	if not items:
 		return []
@@ -65,8 +72,15 @@ def load_questions(file_path: Optional[str | Path] = None, n: int = 10) -> List[
 __all__ = ["load_questions"]
 
 import json
+import uuid
 from typing import Dict, Any, List
 
+from core.records import PlanEntry, decode_questions
+from utils import codec
+from utils.config import get_setting
+from utils.plan_delta import apply_delta, delta_is_worthwhile, diff_plans, make_delta
+from utils.write_behind import get_store
+
 
 def _repo_root() -> Path:
 	return Path(__file__).resolve().parents[2]
@@ -76,18 +90,20 @@ def _queues_path() -> Path:
 	return _repo_root() / 'data' / 'user_queues.json'
 
 
+@traced("io.load_user_queue", cat="io")
 def load_user_queue(user_id: str) -> List[Dict[str, Any]]:
 	"""Load per-user lesson plan queue from data/user_queues.json."""
 	p = _queues_path()
 	if not p.exists():
 		return []
 	try:
-		data = json.loads(p.read_text(encoding='utf-8'))
+		data = codec.loads(p.read_bytes())
 		return data.get(user_id, []) if isinstance(data, dict) else []
 	except Exception:
 		return []
 
 
+@traced("io.push_user_queue", cat="io")
 def push_user_queue(user_id: str, entry: Dict[str, Any]) -> None:
 	"""Append an entry to a user's queue and persist to disk.
 
@@ -96,7 +112,7 @@ def push_user_queue(user_id: str, entry: Dict[str, Any]) -> None:
 	p = _queues_path()
 	try:
 		if p.exists():
-			allq = json.loads(p.read_text(encoding='utf-8'))
+			allq = codec.loads(p.read_bytes())
 			if not isinstance(allq, dict):
 				allq = {}
 		else:
@@ -109,7 +125,7 @@ def push_user_queue(user_id: str, entry: Dict[str, Any]) -> None:
 	allq[user_id] = user_list
 
 	p.parent.mkdir(parents=True, exist_ok=True)
-	p.write_text(json.dumps(allq, indent=2), encoding='utf-8')
+	codec.write_json(p, allq)
 
 
 def get_user_top_plan(user_id: str) -> Dict[str, Any] | None:
@@ -123,13 +139,15 @@ def get_user_top_plan(user_id: str) -> Dict[str, Any] | None:
 		return None
 
 
+@traced("io.save_generated_questions", cat="io")
 def save_generated_questions(filename: str, questions: List[Dict[str, Any]]) -> None:
 	"""Save a list of generated questions to the given filename under data/."""
 	p = _repo_root() / 'data' / filename
 	p.parent.mkdir(parents=True, exist_ok=True)
-	p.write_text(json.dumps(questions, indent=2), encoding='utf-8')
+	codec.write_json(p, questions)
 
 
+@traced("io.append_questions_to_level", cat="io")
 def append_questions_to_level(level: str, questions: List[Dict[str, Any]]) -> int:
 	"""Append generated questions to the canonical level file (os_questions_<level>.json).
 
@@ -141,7 +159,7 @@ def append_questions_to_level(level: str, questions: List[Dict[str, Any]]) -> in
 	existing: List[Dict[str, Any]] = []
 	try:
 		if filename.exists():
-			existing = json.loads(filename.read_text(encoding='utf-8'))
+			existing = codec.loads(filename.read_bytes())
 			if not isinstance(existing, list):
 				existing = []
 	except Exception:
@@ -165,7 +183,7 @@ def append_questions_to_level(level: str, questions: List[Dict[str, Any]]) -> in
 
 	new_list = existing + to_add
 	try:
-		filename.write_text(json.dumps(new_list, indent=2, ensure_ascii=False), encoding='utf-8')
+		codec.write_json(filename, new_list)
 		return len(to_add)
 	except Exception:
 		return 0
@@ -184,67 +202,319 @@ def _user_best_dir() -> Path:
 	return p
 
 
+def _plan_snapshot_every() -> int:
+	return max(1, int(get_setting('storage.plan_snapshot_every', 10)))
+
+
+def _has_plan(entry: Dict[str, Any]) -> bool:
+	return isinstance(entry, dict) and ('plan' in entry or 'plan_delta' in entry)
+
+
+def _resolve_plans(raw: List[Dict[str, Any]], start: int, end: int) -> List[Dict[str, Any]]:
+	"""Entries raw[start:end] with `plan` rebuilt from the nearest snapshot at or before `start`."""
+	base = start
+	while base > 0 and not (isinstance(raw[base], dict) and 'plan' in raw[base]):
+		base -= 1
+	current = ""
+	out: List[Dict[str, Any]] = []
+	for i in range(base, min(end, len(raw))):
+		e = raw[i] if isinstance(raw[i], dict) else {}
+		if 'plan' in e:
+			current = e['plan']
+		elif 'plan_delta' in e:
+			current = apply_delta(e['plan_delta'], current)
+		if i >= start:
+			item = {k: v for k, v in e.items() if k != 'plan_delta'}
+			if _has_plan(e):
+				item['plan'] = current
+			out.append(item)
+	return out
+
+
+def _encode_entry(entry: Dict[str, Any], prev_plan: Optional[str], deltas_since_snapshot: int) -> Dict[str, Any]:
+	"""Stored form of `entry`: a delta against `prev_plan`, or a full snapshot.
+
+	A snapshot is written every `storage.plan_snapshot_every` versions (so a
+	read never replays more deltas than that), and whenever the delta would
+	not be clearly smaller than the plan.
+	"""
+	plan = entry.get('plan')
+	if not isinstance(plan, str) or prev_plan is None or deltas_since_snapshot >= _plan_snapshot_every() - 1:
+		return entry
+	ops = make_delta(prev_plan, plan)
+	if not delta_is_worthwhile(ops, plan):
+		return entry
+	stored = {k: v for k, v in entry.items() if k != 'plan'}
+	stored['plan_delta'] = ops
+	return stored
+
+
+def _plan_chain_state(raw: List[Dict[str, Any]]) -> tuple[Optional[str], int]:
+	"""(latest plan text, deltas written since the last snapshot) for a stored history."""
+	for i in range(len(raw) - 1, -1, -1):
+		if _has_plan(raw[i]):
+			deltas = 0
+			j = i
+			while j >= 0 and not (isinstance(raw[j], dict) and 'plan' in raw[j]):
+				if _has_plan(raw[j]):
+					deltas += 1
+				j -= 1
+			return _resolve_plans(raw, i, i + 1)[0]['plan'], deltas
+	return None, 0
+
+
+def _encode_entries(entries: List[Dict[str, Any]], prev_plan: Optional[str], deltas: int) -> List[Dict[str, Any]]:
+	"""Stored forms of `entries` (full plans) continuing a chain that ends at `prev_plan`."""
+	stored: List[Dict[str, Any]] = []
+	for e in entries:
+		enc = _encode_entry(e, prev_plan, deltas)
+		stored.append(enc)
+		if 'plan_delta' in enc:
+			deltas += 1
+		elif 'plan' in enc:
+			deltas = 0
+		if isinstance(e.get('plan'), str):
+			prev_plan = e['plan']
+	return stored
+
+
+def _entry_ids(entries: List[Any]) -> tuple[set, int]:
+	"""(entry ids, number of entries without one) of a stored history."""
+	ids = {e['entry_id'] for e in entries if isinstance(e, dict) and e.get('entry_id')}
+	return ids, len(entries) - len(ids)
+
+
+def _merge_history(on_disk: Any, ours: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	"""History to write when another process may have appended to the file since `ours` was read.
+
+	Entries are matched by the `entry_id` `save_user_iteration` gives them.
+	Ours that the file lacks follow the file's own entries, re-encoded against
+	its plan chain. Entries saved before ids existed are only ever on disk
+	already and are kept as they are.
+	"""
+	if not isinstance(on_disk, list) or not on_disk:
+		return ours
+	disk_ids, disk_legacy = _entry_ids(on_disk)
+	our_ids, our_legacy = _entry_ids(ours)
+	if disk_ids <= our_ids and disk_legacy <= our_legacy:
+		return ours  # nothing on disk we do not have (a single writer, or our compaction)
+	missing = [i for i, e in enumerate(ours) if isinstance(e, dict) and e.get('entry_id')
+	           and e['entry_id'] not in disk_ids]
+	if not missing:
+		return on_disk
+	new_ids = our_ids - disk_ids
+	added = [e for e in _resolve_plans(ours, missing[0], len(ours)) if e.get('entry_id') in new_ids]
+	prev_plan, deltas = _plan_chain_state(on_disk)
+	return on_disk + _encode_entries(added, prev_plan, deltas)
+
+
+def _load_raw_history(user_id: str) -> List[Dict[str, Any]]:
+	# includes entries still in the write-behind buffer; shared, do not modify
+	data = get_store().read(_user_history_dir() / f"{user_id}.json", [])
+	return data if isinstance(data, list) else []
+
+
+@traced("io.save_user_iteration", cat="io")
 def save_user_iteration(user_id: str, entry: Dict[str, Any]) -> None:
 	"""Append a plan iteration entry to a per-user history file.
 
 	The file is stored at data/user_plans/<user_id>.json as a JSON array of entries.
 	Each entry should include: plan (str), score (float), scores (dict), iteration (int), timestamp (optional).
+	It is stored with a unique `entry_id`, which the merge with other
+	processes' writes goes by. On disk most entries hold `plan_delta` (changes against the previous
+	version) instead of `plan`; `load_user_history` rebuilds the full text.
+
+	The file is written behind (utils.write_behind): readers in this process
+	see the entry at once, the disk write and the analytics update happen on
+	the flusher thread.
 	"""
-	p = _user_history_dir() / f"{user_id}.json"
-	try:
-		if p.exists():
-			data = json.loads(p.read_text(encoding='utf-8'))
-			if not isinstance(data, list):
-				data = []
-		else:
-			data = []
-	except Exception:
-		data = []
+	# validated and normalised (numeric scores, known keys) before it is stored
+	entry = PlanEntry.from_dict(entry).to_dict()
+	entry.setdefault('entry_id', uuid.uuid4().hex)
+
+	def append(data: Any) -> List[Dict[str, Any]]:
+		data = data if isinstance(data, list) else []
+		prev_plan, deltas = _plan_chain_state(data)
+		return data + [_encode_entry(entry, prev_plan, deltas)]
+
+	store = get_store()
+	store.update(_user_history_dir() / f"{user_id}.json", append, [], merge=_merge_history)
+	_bump_user_version(user_id)
+
+	def analytics() -> None:
+		try:
+			# imported here so numpy is only loaded once something is saved
+			from utils.analytics import record_iteration
+			record_iteration(user_id, entry)
+		except Exception as e:
+			print(f"Warning: analytics not updated: {e}")
 
-	data.append(entry)
-	p.write_text(json.dumps(data, indent=2), encoding='utf-8')
+	store.defer(analytics)
 
 
+@traced("io.load_user_history", cat="io")
 def load_user_history(user_id: str) -> List[Dict[str, Any]]:
+	"""All history entries for the user, with full plan texts."""
+	raw = _load_raw_history(user_id)
+	return _resolve_plans(raw, 0, len(raw))
+
+
+@traced("io.load_user_history_page", cat="io")
+def load_user_history_page(user_id: str, start: int = 0, limit: int = 20,
+                           fields: Optional[List[str]] = None) -> tuple[List[Dict[str, Any]], int]:
+	"""Return (entries[start:start + limit], total) from the user's history.
+
+	Each returned entry carries its position as `index`. With `fields`, only
+	those keys (plus `index`) are kept, e.g. ['score', 'scores'] to skip the
+	plan text; plans are only rebuilt when they are requested.
+	"""
+	raw = _load_raw_history(user_id)
+	if fields and 'plan' not in fields:
+		window = [e if isinstance(e, dict) else {} for e in raw[start:start + limit]]
+	else:
+		window = _resolve_plans(raw, start, start + limit)
+	page = []
+	for i, e in enumerate(window, start=start):
+		if fields:
+			e = {k: e[k] for k in fields if k in e and k != 'plan_delta'}
+		page.append(dict(e, index=i))
+	return page, len(raw)
+
+
+@traced("io.get_user_plan_version", cat="io")
+def get_user_plan_version(user_id: str, index: int) -> Dict[str, Any] | None:
+	"""History entry `index` with its full plan, or None if out of range."""
+	raw = _load_raw_history(user_id)
+	if not 0 <= index < len(raw):
+		return None
+	return _resolve_plans(raw, index, index + 1)[0]
+
+
+@traced("io.diff_user_plans", cat="io")
+def diff_user_plans(user_id: str, a: int, b: int) -> Dict[str, Any] | None:
+	"""Structural (chapter-level) diff between history entries `a` and `b`."""
+	raw = _load_raw_history(user_id)
+	if not (0 <= a < len(raw) and 0 <= b < len(raw)):
+		return None
+	old = _resolve_plans(raw, a, a + 1)[0].get('plan', '')
+	new = _resolve_plans(raw, b, b + 1)[0].get('plan', '')
+	return dict(diff_plans(old, new), **{"from": a, "to": b})
+
+
+def compact_user_history(user_id: str) -> tuple[int, int]:
+	"""Re-encode an existing history file with deltas; returns (bytes before, bytes after).
+
+	Goes through the store like `save_user_iteration`: the rewrite holds the
+	file's lock (no iteration of this process is appended in between), is
+	merged with what other processes appended meanwhile, and is replaced
+	atomically.
+	"""
 	p = _user_history_dir() / f"{user_id}.json"
-	if not p.exists():
-		return []
-	try:
-		data = json.loads(p.read_text(encoding='utf-8'))
-		return data if isinstance(data, list) else []
-	except Exception:
-		return []
+	store = get_store()
+	with store.path_lock(p):
+		store.flush()
+		if not p.exists():
+			return 0, 0
+		before = p.stat().st_size
+		stored = _encode_entries(load_user_history(user_id), None, 0)
+		store.write(p, stored, merge=_merge_history)
+		store.flush()
+		return before, p.stat().st_size
+
+
+_versions_lock = threading.Lock()
+
+
+def _versions_path() -> Path:
+	return _repo_root() / 'data' / 'user_versions.json'
+
+
+def _read_versions() -> Dict[str, int]:
+	data = get_store().read(_versions_path(), {})
+	return data if isinstance(data, dict) else {}
+
+
+class _PendingVersions(dict):
+	"""Buffered counters plus `bumps`, this process's increments not yet on disk."""
+
+	bumps: Dict[str, int]
+
 
+def _merge_versions(on_disk: Any, ours: Dict[str, int]) -> Dict[str, int]:
+	# Another process may have bumped the same user meanwhile: apply our
+	# increments to the file's value rather than keeping the larger one, or
+	# two different histories would end up with the same version (ETag).
+	merged = dict(on_disk) if isinstance(on_disk, dict) else {}
+	for user, n in getattr(ours, 'bumps', {}).items():
+		merged[user] = int(merged.get(user, 0)) + n
+	return merged
 
+
+def get_user_version(user_id: str) -> int:
+	"""Per-user counter bumped on every history write (used for HTTP ETags)."""
+	return int(_read_versions().get(user_id, 0))
+
+
+def _bump_user_version(user_id: str) -> int:
+	def bump(versions: Any) -> Dict[str, int]:
+		new = _PendingVersions(versions if isinstance(versions, dict) else {})
+		# a file read from disk has none; a bump made while a flush was under way
+		# carries the flushed ones too, which only makes the counter skip numbers
+		new.bumps = dict(getattr(versions, 'bumps', {}))
+		new[user_id] = int(new.get(user_id, 0)) + 1
+		new.bumps[user_id] = new.bumps.get(user_id, 0) + 1
+		return new
+
+	with _versions_lock:
+		return get_store().update(_versions_path(), bump, {}, merge=_merge_versions)[user_id]
+
+
+@traced("io.get_user_best_plan", cat="io")
 def get_user_best_plan(user_id: str) -> Dict[str, Any] | None:
-	"""Return the best (highest score) entry for the user from history, or None."""
-	history = load_user_history(user_id)
-	if not history:
+	"""Return the best (highest score) entry for the user from history, or None.
+
+	Scores are compared on the stored entries; only the winner's plan is rebuilt.
+	"""
+	raw = _load_raw_history(user_id)
+	if not raw:
 		return None
 	try:
-		return max(history, key=lambda x: x.get('score', 0))
+		best = max(range(len(raw)), key=lambda i: raw[i].get('score', 0))
+		return _resolve_plans(raw, best, best + 1)[0]
 	except Exception:
 		return None
 
 
+def _best_score(best: Any) -> float:
+	return best.get('score', 0) if isinstance(best, dict) else 0
+
+
+def _merge_best(on_disk: Any, ours: Dict[str, Any]) -> Dict[str, Any]:
+	# another process may have saved a higher score since ours was read
+	return on_disk if _best_score(on_disk) >= _best_score(ours) else ours
+
+
+@traced("io.update_user_best_plan_if_higher", cat="io")
 def update_user_best_plan_if_higher(user_id: str, entry: Dict[str, Any]) -> bool:
 	"""Update the persisted best-plan file for the user if `entry['score']` is higher.
 
-	Returns True if the best plan was updated, False otherwise.
+	Returns True if the best plan was updated, False otherwise. Like the
+	history, the file is written behind; `load_user_best` sees the update.
+	When the file is flushed, a higher score another process saved meanwhile
+	is kept instead.
 	"""
-	best_dir = _user_best_dir()
-	best_path = best_dir / f"{user_id}.json"
+	def replace(current: Any) -> Dict[str, Any] | None:
+		return dict(entry) if entry.get('score', 0) > _best_score(current) else None
+
 	try:
-		current = None
-		if best_path.exists():
-			current = json.loads(best_path.read_text(encoding='utf-8'))
-		current_score = current.get('score', 0) if isinstance(current, dict) else 0
-		new_score = entry.get('score', 0)
-		if new_score > current_score:
-			best_path.write_text(json.dumps(entry, indent=2), encoding='utf-8')
-			return True
+		return get_store().update(_user_best_dir() / f"{user_id}.json", replace, merge=_merge_best) is not None
 	except Exception:
-		pass
-	return False
+		return False
+
+
+def load_user_best(user_id: str) -> Dict[str, Any] | None:
+	"""Contents of data/user_best/<user_id>.json (including a pending update), or None."""
+	data = get_store().read(_user_best_dir() / f"{user_id}.json")
+	return data if isinstance(data, dict) else None
 
 
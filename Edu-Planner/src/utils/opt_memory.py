@@ -0,0 +1,221 @@
+"""Per-user memory of optimizer edits and how they scored.
+
+After each optimization, `record_attempt()` stores what the optimizer changed
+(improvement texts, areas, `focus_next`) together with the score of the plan
+it started from. The attempt stays pending until the new plan has been
+evaluated. `record_outcome()` then adds the CIDDP change, overall and per
+dimension. If that change is at least `min_delta` either way, the attempt
+counts as improved or regressed.
+
+The memory is bounded. The last `recent` attempts are kept as they are. Older
+ones are folded into per-area totals (attempts, improved/regressed counts,
+summed change, a few edits that worked and the ones that failed), so each
+attempt is summarised once, when it ages out. `history()` renders the totals
+and then the recent attempts as `get_optimizer_prompt` history items, within
+`max_tokens`. Plans whose evaluation regressed are remembered by hash
+(`is_rejected`) so they are not tried again. `converged()` is true once the
+last `patience` attempts brought no improvement, and the caller stops
+iterating.
+
+One JSON file per user under `optimizer_memory.dir`.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.records import CIDDP_DIMENSIONS
+from utils import codec
+from utils.config import get_setting
+from utils.tokens import estimate_tokens
+
+MAX_REJECTED = 32
+MAX_EXAMPLES = 3
+
+
+def _plan_hash(plan: str) -> str:
+    return hashlib.sha1((plan or "").encode('utf-8')).hexdigest()[:16]
+
+
+def _norm(text: Any) -> str:
+    return ' '.join(str(text or '').lower().split())
+
+
+def _short(text: Any, n: int = 80) -> str:
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= n else text[:n - 3] + "..."
+
+
+def _empty() -> Dict[str, Any]:
+    return {"recent": [], "areas": {}, "rejected": [], "pending": None, "focus_next": [], "attempts": 0}
+
+
+class OptimizationMemory:
+    """Bounded, incrementally summarised optimizer history (see module docstring)."""
+
+    def __init__(self, root: Path, recent: int = 4, max_tokens: int = 400, min_delta: float = 0.05,
+                 patience: int = 2, max_failed: int = 8):
+        self.root = Path(root)
+        self.recent = max(1, int(recent))
+        self.max_tokens = int(max_tokens)
+        self.min_delta = float(min_delta)
+        self.patience = max(1, int(patience))
+        self.max_failed = int(max_failed)
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str) -> Path:
+        return self.root / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', user_id)}.json"
+
+    def load(self, user_id: str) -> Dict[str, Any]:
+        data = codec.read_json(self._path(user_id))
+        return dict(_empty(), **data) if isinstance(data, dict) else _empty()
+
+    def _save(self, user_id: str, state: Dict[str, Any]) -> None:
+        path = self._path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        codec.write_json(tmp, state)
+        os.replace(tmp, path)
+
+    def record_attempt(self, user_id: str, opt_result: Any, score_before: float,
+                       scores_before: Optional[Dict[str, Any]] = None) -> None:
+        """Remember an optimizer result until its plan has been evaluated."""
+        if not isinstance(opt_result, dict) or not opt_result.get('plan'):
+            return
+        improvements = [i for i in opt_result.get('improvements') or [] if isinstance(i, dict)]
+        focus_next = [str(f) for f in opt_result.get('focus_next') or [] if f]
+        with self._lock:
+            state = self.load(user_id)
+            state["pending"] = {
+                "plan_hash": _plan_hash(opt_result['plan']),
+                "edits": [_short(i.get('text')) for i in improvements if i.get('text')],
+                "areas": sorted({str(i['area']) for i in improvements if i.get('area')}),
+                "score_before": float(score_before),
+                "scores_before": dict(scores_before or {}),
+            }
+            if focus_next:
+                state["focus_next"] = focus_next
+            self._save(user_id, state)
+
+    def record_outcome(self, user_id: str, plan: Optional[str], score: float,
+                       scores: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Close the pending attempt with the evaluation of `plan`; returns the
+        resolved attempt, or None if `plan` is not the one it produced."""
+        with self._lock:
+            state = self.load(user_id)
+            pending = state.get("pending")
+            if not pending or (plan is not None and _plan_hash(plan) != pending["plan_hash"]):
+                return None
+            delta = float(score) - pending["score_before"]
+            dims = {}
+            for d in CIDDP_DIMENSIONS:
+                try:
+                    dims[d] = float((scores or {})[d]) - float(pending["scores_before"][d])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            outcome = ("improved" if delta >= self.min_delta else
+                       "regressed" if delta <= -self.min_delta else "no change")
+            attempt = dict(pending, score_after=float(score), delta=round(delta, 3),
+                           dims={d: round(v, 2) for d, v in dims.items() if v}, outcome=outcome)
+            state["pending"] = None
+            state["attempts"] += 1
+            attempt["n"] = state["attempts"]
+            if outcome == "regressed":
+                state["rejected"] = (state["rejected"] + [pending["plan_hash"]])[-MAX_REJECTED:]
+            state["recent"].append(attempt)
+            while len(state["recent"]) > self.recent:
+                self._fold(state, state["recent"].pop(0))
+            self._save(user_id, state)
+            return attempt
+
+    def _fold(self, state: Dict[str, Any], attempt: Dict[str, Any]) -> None:
+        # summarise an attempt leaving the recent window into its areas' totals
+        for area in attempt.get("areas") or ["general"]:
+            a = state["areas"].setdefault(area, {"tries": 0, "improved": 0, "regressed": 0, "delta": 0.0,
+                                                 "worked": [], "failed": []})
+            a["tries"] += 1
+            a["delta"] = round(a["delta"] + attempt["delta"], 3)
+            if attempt["outcome"] == "improved":
+                a["improved"] += 1
+                a["worked"] = (a["worked"] + attempt["edits"][:1])[-MAX_EXAMPLES:]
+            elif attempt["outcome"] == "regressed":
+                a["regressed"] += 1
+                failed = [e for e in attempt["edits"] if _norm(e) not in {_norm(f) for f in a["failed"]}]
+                a["failed"] = (a["failed"] + failed)[-self.max_failed:]
+
+    def history(self, user_id: str) -> List[Dict[str, str]]:
+        """Prompt history items (`text`, `outcome`): area totals, then recent
+        attempts oldest first, trimmed to `max_tokens`."""
+        state = self.load(user_id)
+        summary, recent = [], []
+        for area, a in sorted(state["areas"].items(), key=lambda kv: -kv[1]["tries"]):
+            text = f"{area}: {a['tries']} earlier attempt(s), {a['improved']} improved, {a['regressed']} made it worse"
+            if a["worked"]:
+                text += "; worked: " + "; ".join(a["worked"])
+            outcome = f"net CIDDP {a['delta']:+.2f}"
+            if a["failed"]:
+                outcome += "; do not repeat: " + "; ".join(a["failed"])
+            summary.append({"text": text, "outcome": outcome})
+        for at in state["recent"]:
+            dims = ", ".join(f"{d} {v:+g}" for d, v in at.get("dims", {}).items())
+            edits = "; ".join(at["edits"]) or "no listed edits"
+            outcome = f"{at['outcome']} ({at['score_before']:.2f} -> {at['score_after']:.2f}{'; ' + dims if dims else ''})"
+            if at["outcome"] == "regressed":
+                outcome += ", do not repeat"
+            recent.append({"text": edits, "outcome": outcome})
+        def size() -> int:
+            return sum(estimate_tokens(f"- {h['text']} -> {h['outcome']}") for h in summary + recent)
+
+        # over budget: drop older recent attempts (keeping the latest), then the
+        # least-tried areas, then the latest attempt
+        while (summary or recent) and size() > self.max_tokens:
+            if len(recent) > 1:
+                recent.pop(0)
+            elif summary:
+                summary.pop()
+            else:
+                recent.pop()
+        return summary + recent
+
+    def focus_next(self, user_id: str) -> List[str]:
+        return list(self.load(user_id).get("focus_next") or [])
+
+    def is_rejected(self, user_id: str, plan: str) -> bool:
+        """True if `plan` was evaluated before and scored worse than its predecessor."""
+        return _plan_hash(plan) in self.load(user_id)["rejected"]
+
+    def converged(self, user_id: str) -> bool:
+        recent = self.load(user_id)["recent"]
+        last = recent[-self.patience:]
+        return len(last) == self.patience and all(a["outcome"] != "improved" for a in last)
+
+
+_memory: Optional[OptimizationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_memory() -> Optional[OptimizationMemory]:
+    """Process-wide memory from the `optimizer_memory` settings; None when disabled."""
+    global _memory
+    if not get_setting('optimizer_memory.enabled', True):
+        return None
+    with _memory_lock:
+        if _memory is None:
+            root = Path(str(get_setting('optimizer_memory.dir', 'data/user_memory')))
+            if not root.is_absolute():
+                root = Path(__file__).resolve().parents[2] / root
+            _memory = OptimizationMemory(
+                root,
+                recent=int(get_setting('optimizer_memory.recent', 4)),
+                max_tokens=int(get_setting('optimizer_memory.max_tokens', 400)),
+                min_delta=float(get_setting('optimizer_memory.min_delta', 0.05)),
+                patience=int(get_setting('optimizer_memory.patience', 2)),
+            )
+        return _memory
+
+
+__all__ = ["OptimizationMemory", "get_memory"]
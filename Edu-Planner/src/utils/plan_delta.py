@@ -0,0 +1,103 @@
+"""Line-based deltas between lesson plan versions, and structural plan diffs.
+
+Successive optimizer iterations rewrite only parts of a plan, so the history
+in data/user_plans stores most versions as a delta against the previous one:
+a list of `[start, end, new_lines]` ops replacing lines `start:end` of the
+previous version. `apply_delta(make_delta(a, b), a) == b` holds exactly
+(line endings included).
+
+`diff_plans` compares two versions chapter by chapter ("Chapter N" headings)
+for the history diff API.
+"""
+from __future__ import annotations
+
+import difflib
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+_HEADING_RE = re.compile(r"^\s*(chapter\s+\d+)\b", re.IGNORECASE)
+
+
+def make_delta(old: str, new: str) -> List[list]:
+    """Ops turning `old` into `new`; an empty list means unchanged."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return [[i1, i2, b[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def apply_delta(ops: List[list], old: str) -> str:
+    lines = old.splitlines(keepends=True)
+    out: List[str] = []
+    pos = 0
+    for start, end, new_lines in ops:
+        out.extend(lines[pos:start])
+        out.extend(new_lines)
+        pos = end
+    out.extend(lines[pos:])
+    return ''.join(out)
+
+
+def delta_is_worthwhile(ops: List[list], new: str, ratio: float = 0.8) -> bool:
+    """True when storing `ops` is clearly smaller than storing `new` itself."""
+    return len(json.dumps(ops)) < ratio * len(json.dumps(new))
+
+
+def split_chapters(plan: str) -> List[Tuple[str, List[str]]]:
+    """(heading, body lines) per chapter; text before the first heading has heading ''."""
+    chapters: List[Tuple[str, List[str]]] = [("", [])]
+    for line in (plan or "").splitlines():
+        if _HEADING_RE.match(line):
+            chapters.append((line.strip(), []))
+        elif line.strip():
+            chapters[-1][1].append(line.rstrip())
+    return [c for c in chapters if c[0] or c[1]]
+
+
+def _chapter_id(heading: str) -> str:
+    m = _HEADING_RE.match(heading)
+    return ' '.join(m.group(1).lower().split()) if m else heading
+
+
+def diff_plans(old: str, new: str) -> Dict[str, Any]:
+    """Chapter-level diff: added/removed chapters and line changes inside the others.
+
+    Chapters are matched by their number, so a retitled chapter shows up as
+    changed (with `old_heading`) rather than removed and added.
+    """
+    before = {_chapter_id(h): (h, body) for h, body in split_chapters(old)}
+    after = {_chapter_id(h): (h, body) for h, body in split_chapters(new)}
+    added = [after[k][0] or "(preamble)" for k in after if k not in before]
+    removed = [before[k][0] or "(preamble)" for k in before if k not in after]
+    changed = []
+    lines_added = sum(len(after[k][1]) for k in after if k not in before)
+    lines_removed = sum(len(before[k][1]) for k in before if k not in after)
+    for k, (heading, body) in after.items():
+        if k not in before:
+            continue
+        old_heading, old_body = before[k]
+        plus: List[str] = []
+        minus: List[str] = []
+        matcher = difflib.SequenceMatcher(None, old_body, body, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                minus.extend(old_body[i1:i2])
+                plus.extend(body[j1:j2])
+        if plus or minus or heading != old_heading:
+            item = {"chapter": heading or "(preamble)", "added_lines": plus, "removed_lines": minus}
+            if heading != old_heading:
+                item["old_heading"] = old_heading
+            changed.append(item)
+            lines_added += len(plus)
+            lines_removed += len(minus)
+    return {
+        "added_chapters": added,
+        "removed_chapters": removed,
+        "changed_chapters": changed,
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+    }
+
+
+__all__ = ["make_delta", "apply_delta", "delta_is_worthwhile", "split_chapters", "diff_plans"]
@@ -0,0 +1,204 @@
+"""Library of lesson plans optimised ahead of time for typical skill profiles.
+
+A skill profile is the vector of `OSSkillTree` levels (5 dimensions, levels
+1-5, so 3125 possible profiles). `scripts/build_plan_library.py` clusters the
+profiles it is given and runs the evaluate -> optimize -> analyze loop
+offline for each cluster centre. The best plan for each centre is stored in
+`plan_library.path` (JSON).
+
+On load, the library precomputes the nearest stored profile (L1 distance,
+higher score on ties) for every one of the 3125 profiles. A lookup is then an
+index into that table. A new user with no saved plan starts from the plan of
+the nearest profile, as long as it is within `plan_library.max_distance`
+levels; otherwise they start from data/lessonplan.txt as before. numpy is
+only imported once there is a library to index, keeping CLI start-up fast.
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from core.skill_tree import OSSkillTree
+from utils import codec
+from utils.config import get_setting
+
+DIMENSIONS: Tuple[str, ...] = tuple(OSSkillTree().dimensions)
+MAX_LEVEL = 5
+
+Profile = Tuple[int, ...]
+
+
+def profile_of(skills: Any) -> Profile:
+    """The level vector of an OSSkillTree, a {dimension: level} mapping or a sequence.
+
+    Dimensions a mapping leaves out are at level 1, like in a fresh OSSkillTree.
+    """
+    if isinstance(skills, OSSkillTree):
+        skills = skills.levels
+    if isinstance(skills, Mapping):
+        levels = [skills.get(d, 1) for d in DIMENSIONS]
+    else:
+        levels = list(skills)
+        if len(levels) != len(DIMENSIONS):
+            raise ValueError(f"a skill profile has {len(DIMENSIONS)} levels, got {len(levels)}")
+    return tuple(min(MAX_LEVEL, max(1, int(round(float(v))))) for v in levels)
+
+
+def _flat_index(profiles: Any) -> Any:
+    # profile (1-5 per dimension) -> position in the dense table, base-5 digits
+    import numpy as np
+    weights = MAX_LEVEL ** np.arange(len(DIMENSIONS) - 1, -1, -1)
+    return (np.asarray(profiles) - 1) @ weights
+
+
+class PlanLibrary:
+    """Stored plans by skill profile, with a precomputed nearest-profile table."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: List[Dict[str, Any]] = []
+        self._mtime: Optional[float] = None
+        # nearest entry and its distance for every possible profile (numpy arrays)
+        self._nearest: Any = None
+        self._distance: Any = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> None:
+        """Read the file again if it changed (the build job may have added plans)."""
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            data = codec.read_json(self.path) if mtime is not None else None
+            entries = data.get('entries', []) if isinstance(data, dict) else []
+            self.entries = [e for e in entries if isinstance(e, dict) and e.get('plan') and e.get('profile')]
+            self._mtime = mtime
+            self._build_index()
+
+    def _build_index(self) -> None:
+        # caller holds the lock
+        if not self.entries:
+            self._nearest = self._distance = None
+            return
+        import numpy as np
+        grid = np.array(list(itertools.product(range(1, MAX_LEVEL + 1), repeat=len(DIMENSIONS))))
+        centres = np.array([profile_of(e['profile']) for e in self.entries])
+        scores = np.array([float(e.get('score') or 0.0) for e in self.entries])
+        dist = np.abs(grid[:, None, :] - centres[None, :, :]).sum(axis=2)
+        # nearest first, then the better plan: lexsort sorts by its last key first
+        order = np.lexsort((-scores[None, :].repeat(len(grid), 0), dist), axis=1)
+        nearest = order[:, 0]
+        table = np.empty(len(grid), dtype=np.int64)
+        table[_flat_index(grid)] = nearest
+        distance = np.empty(len(grid), dtype=np.int64)
+        distance[_flat_index(grid)] = dist[np.arange(len(grid)), nearest]
+        self._nearest, self._distance = table, distance
+
+    def nearest(self, skills: Any, max_distance: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """The stored entry closest to `skills`, with its `distance`; None if
+        the library is empty or the closest is farther than `max_distance`."""
+        profile = profile_of(skills)
+        with self._lock:
+            if not self.entries:
+                return None
+            i = int(_flat_index(profile))
+            idx, distance = int(self._nearest[i]), int(self._distance[i])
+            if max_distance is not None and distance > max_distance:
+                return None
+            return dict(self.entries[idx], distance=distance)
+
+    def add(self, skills: Any, plan: str, score: float, **meta: Any) -> bool:
+        """Store `plan` for the profile unless it already has a better-scoring one."""
+        profile = list(profile_of(skills))
+        with self._lock:
+            for i, e in enumerate(self.entries):
+                if list(e['profile']) == profile:
+                    if float(e.get('score') or 0.0) >= score:
+                        return False
+                    del self.entries[i]
+                    break
+            self.entries.append(dict(meta, profile=profile, plan=plan, score=score, created=time.time()))
+            self._build_index()
+            return True
+
+    def save(self) -> None:
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            codec.write_json(tmp, {"dimensions": list(DIMENSIONS), "entries": self.entries})
+            os.replace(tmp, self.path)
+            self._mtime = self.path.stat().st_mtime
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"profile": dict(zip(DIMENSIONS, e['profile'])), "score": e.get('score'),
+                     "members": e.get('members'), "created": e.get('created')} for e in self.entries]
+
+
+def library_path() -> Path:
+    path = Path(str(get_setting('plan_library.path', 'data/plan_library.json')))
+    return path if path.is_absolute() else Path(__file__).resolve().parents[2] / path
+
+
+_library: Optional[PlanLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_plan_library() -> PlanLibrary:
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = PlanLibrary(library_path())
+        else:
+            _library.reload()
+        return _library
+
+
+def warm_start_plan(skills: Any) -> Optional[Dict[str, Any]]:
+    """The library entry to start a new user with this skill profile from, or None."""
+    if not get_setting('plan_library.enabled', True):
+        return None
+    return get_plan_library().nearest(skills, max_distance=int(get_setting('plan_library.max_distance', 4)))
+
+
+def cluster_profiles(profiles: Sequence[Any], k: int, seed: int = 0, iterations: int = 50) -> List[Tuple[Profile, int]]:
+    """Group `profiles` into at most `k` clusters (k-means on the level vectors).
+
+    Returns (centre rounded to whole levels, number of members) per cluster,
+    largest first.
+    """
+    import numpy as np
+    points = np.array([profile_of(p) for p in profiles], dtype=float)
+    unique = np.unique(points, axis=0)
+    if len(unique) <= k:
+        labels = [tuple(int(v) for v in u) for u in unique]
+        counts = [int((points == u).all(axis=1).sum()) for u in unique]
+        return sorted(zip(labels, counts), key=lambda c: -c[1])
+    rng = np.random.default_rng(seed)
+    centres = unique[rng.choice(len(unique), size=k, replace=False)]
+    for _ in range(iterations):
+        assign = np.abs(points[:, None, :] - centres[None, :, :]).sum(axis=2).argmin(axis=1)
+        moved = np.array([points[assign == c].mean(axis=0) if (assign == c).any() else centres[c] for c in range(k)])
+        if np.allclose(moved, centres):
+            break
+        centres = moved
+    assign = np.abs(points[:, None, :] - centres[None, :, :]).sum(axis=2).argmin(axis=1)
+    merged: Dict[Profile, int] = {}
+    for c in range(k):
+        members = int((assign == c).sum())
+        if members:
+            centre = profile_of(centres[c])
+            merged[centre] = merged.get(centre, 0) + members
+    return sorted(merged.items(), key=lambda c: -c[1])
+
+
+__all__ = ["PlanLibrary", "DIMENSIONS", "profile_of", "get_plan_library", "warm_start_plan",
+           "cluster_profiles", "library_path"]
@@ -5,8 +5,43 @@ an evaluator, an optimizer, and an analyst agent. Each function accepts the
 lesson_plan and skill_summary and returns a formatted prompt that asks the
 agent to evaluate using CIDDP criteria: Clarity, Integrity, Depth,
 Practicality, Pertinence.
+
+The evaluator, optimizer and analyst prompts all start with the same
+`get_shared_prefix()` block (role, student profile, lesson plan) and only
+differ in the task-specific instructions that follow. Within a session the
+plan and profile change rarely, so Ollama can reuse the already-evaluated
+prefix instead of re-processing the whole plan on every call.
+
+Every builder returns a `utils.tokens.Prompt`: a plain string sized to fit
+the model's context (`llm.context` minus `llm.output_reserve_tokens`), with
+a `.report` of tokens per section and which sections had to be trimmed.
 """
-from typing import Literal
+from typing import List, Literal, Optional
+
+from utils.tokens import Prompt, Section, build_prompt
+
+_ROLE = "You are an expert Operating Systems educator working on a personalised course.\n\n"
+
+
+def _prefix_sections(lesson_plan: str, skill_summary: str) -> List[Section]:
+    # the plan is the only part of the prefix that may be summarised
+    return [
+        Section("role", _ROLE),
+        Section("skill_profile", f"Student Skill Profile: {skill_summary}\n\n"),
+        Section("lesson_plan", lesson_plan, priority=1, kind="plan", header="Lesson Plan:\n", footer="\n\n"),
+        Section("separator", "---\n"),
+    ]
+
+
+def get_shared_prefix(lesson_plan: str, skill_summary: str, model: Optional[str] = None) -> str:
+    """Return the stable leading block shared by the per-agent prompts.
+
+    Keep anything that varies between calls (feedback, questions, focus
+    areas) out of this block, otherwise the cached prefix is invalidated.
+    The block is budgeted on its own (see `utils.tokens.build_prompt`), so a
+    long plan is summarised the same way for every agent.
+    """
+    return str(build_prompt(_prefix_sections(lesson_plan, skill_summary), [], model=model))
 
 
 def _format_scores_instructions() -> str:
@@ -27,40 +62,43 @@ def _format_scores_instructions() -> str:
     )
 
 
-def get_evaluator_prompt(lesson_plan: str, skill_summary: str, sample_questions=None) -> str:
+def get_evaluator_prompt(lesson_plan: str, skill_summary: str, sample_questions=None,
+                         model: Optional[str] = None) -> Prompt:
     """Return a clean evaluator prompt for assessing an OS lesson plan, skill tree, and sample questions.
 
     Args:
         lesson_plan: The full lesson plan text to evaluate.
         skill_summary: A one- to three-sentence summary of the student's current skill level and prior knowledge.
         sample_questions: List of sample questions (dicts) to include in the evaluation.
+        model: Model the prompt is budgeted for (its `llm.context` size).
 
     Returns:
-        A formatted prompt string ready to feed to an evaluator LLM agent.
+        A formatted prompt string ready to feed to an evaluator LLM agent;
+        `.report` holds the tokens used per section. Sample questions are
+        dropped from the end first, then the plan is summarised.
     """
     instructions = _format_scores_instructions()
-    questions_section = ""
-    if sample_questions:
-        questions_section = "Sample Questions for Evaluation:\n"
-        for q in sample_questions:
-            questions_section += f"Q: {q.get('question')}\nOptions: {', '.join(q.get('options', []))}\nCorrect: {q.get('answer')}\n\n"
-
-    return (
-        f"You are an expert Operating Systems instructor. Evaluate the following lesson plan using the CIDDP criteria (Clarity, Integrity, Depth, Practicality, Pertinence).\n\n"
-        f"Student Skill Profile: {skill_summary}\n\n"
-        f"Lesson Plan:\n{lesson_plan}\n\n"
-        f"{questions_section}"
-        f"Evaluate on the five CIDDP areas (Clarity, Integrity, Depth, Practicality, Pertinence).\n"
-        f"Return a single JSON object (no extra text) with this schema:\n"
-        f"{{\n  \"scores\": {{\"Clarity\": int(1-5), \"Integrity\": int, \"Depth\": int, \"Practicality\": int, \"Pertinence\": int}},\n  \"comments\": {{\"Clarity\": str, ...}},\n  \"summary\": str  // short human summary\n}}\n"
-        f"If you cannot provide values, set them to null, but always return valid JSON.\n"
-        f"Do NOT output any other text besides the JSON object."
-    )
+    questions = [
+        f"Q: {q.get('question')}\nOptions: {', '.join(q.get('options', []))}\nCorrect: {q.get('answer')}\n\n"
+        for q in (sample_questions or [])
+    ]
+
+    return build_prompt(_prefix_sections(lesson_plan, skill_summary), [
+        Section("task", "Task: act as an Operating Systems instructor and evaluate the lesson plan above using the CIDDP criteria (Clarity, Integrity, Depth, Practicality, Pertinence).\n\n"),
+        Section("sample_questions", questions, priority=2, kind="list", header="Sample Questions for Evaluation:\n"),
+        Section("output_format",
+            f"Evaluate on the five CIDDP areas (Clarity, Integrity, Depth, Practicality, Pertinence).\n"
+            f"Return a single JSON object (no extra text) with this schema:\n"
+            f"{{\n  \"scores\": {{\"Clarity\": int(1-5), \"Integrity\": int, \"Depth\": int, \"Practicality\": int, \"Pertinence\": int}},\n  \"comments\": {{\"Clarity\": str, ...}},\n  \"summary\": str  // short human summary\n}}\n"
+            f"If you cannot provide values, set them to null, but always return valid JSON.\n"
+            f"Do NOT output any other text besides the JSON object."),
+    ], model=model)
 
 
 def get_optimizer_prompt(lesson_plan: str, skill_summary: str, feedback: str = "",
                       focus_areas: list[str] = None,
-                      history: list[dict] = None) -> str:
+                      history: list[dict] = None,
+                      model: Optional[str] = None) -> Prompt:
     """Return a prompt guiding an optimizer agent to suggest concrete improvements.
     
     Args:
@@ -69,71 +107,66 @@ def get_optimizer_prompt(lesson_plan: str, skill_summary: str, feedback: str = "
         feedback: Latest feedback to address (optional)
         focus_areas: List of specific topics/areas to focus on (e.g., from low scores)
         history: Previous improvement attempts and their outcomes
+        model: Model the prompt is budgeted for (its `llm.context` size)
+
+    When over budget, the oldest history entries go first, then the
+    feedback is cut, then the focus list, and only then the plan.
     """
-    focus_section = ""
-    if focus_areas:
-        focus_section = "Focus Areas (prioritize these):\n- " + "\n- ".join(focus_areas) + "\n\n"
-
-    history_section = ""
-    if history:
-        history_section = "Previous Improvements:\n"
-        for h in history:
-            outcome = h.get("outcome", "unknown")
-            history_section += f"- {h.get('text', '')} -> {outcome}\n"
-        history_section += "\n"
-
-    feedback_section = ""
-    if feedback and feedback.strip():
-        feedback_section = f"Recent Feedback:\n{feedback}\n\n"
+    history_items = [f"- {h.get('text', '')} -> {h.get('outcome', 'unknown')}\n" for h in (history or [])]
+    focus_items = ["- " + str(f) + "\n" for f in (focus_areas or [])]
 
     # Build a more targeted prompt that encourages incremental, focused updates
-    return (
-        f"You are an expert curriculum optimizer for Operating Systems courses. Update the lesson plan considering:\n"
-        f"1. The student's current level and needs\n"
-        f"2. Any specific focus areas that need improvement\n"
-        f"3. What worked/didn't work in previous iterations\n\n"
-        f"Student Profile: {skill_summary}\n\n"
-        f"{focus_section}"
-        f"{history_section}"
-        f"{feedback_section}"
-        f"Current Plan:\n{lesson_plan}\n\n"
-        f"Return a single JSON object with this schema:\n"
-        "{\n"
-        '  "plan": "updated lesson plan text",\n'
-        '  "improvements": [\n'
-        '    {"text": "what changed", "area": "topic area", "priority": 1-5}\n'
-        "  ],\n"
-        '  "focus_next": ["topic1", "topic2"],  // areas to focus on next\n'
-        '  "exercise": {"title": "string", "steps": ["step1", ...]}\n'
-        "}\n\n"
-        f"Rules:\n"
-        f"1. Only suggest substantive changes that clearly improve the plan\n"
-        f"2. Focus on the specified areas if provided\n"
-        f"3. Build on what worked in history, avoid repeating failed approaches\n"
-        f"4. Keep changes minimal but impactful\n"
-        f"5. Output ONLY the JSON object\n"
-    )
-
-
-def get_analyst_prompt(example: str, skill_summary: str, focus_areas: list[str] | None = None, max_items: int = 5) -> str:
+    return build_prompt(_prefix_sections(lesson_plan, skill_summary), [
+        Section("task",
+            f"Task: act as a curriculum optimizer and update the lesson plan above considering:\n"
+            f"1. The student's current level and needs\n"
+            f"2. Any specific focus areas that need improvement\n"
+            f"3. What worked/didn't work in previous iterations\n\n"),
+        Section("focus_areas", focus_items, priority=1, kind="list",
+                header="Focus Areas (prioritize these):\n", footer="\n"),
+        Section("history", history_items, priority=3, kind="list", drop_from_start=True,
+                header="Previous Improvements:\n", footer="\n"),
+        Section("feedback", feedback.strip() if feedback else "", priority=2,
+                header="Recent Feedback:\n", footer="\n\n"),
+        Section("output_format",
+            f"Return a single JSON object with this schema:\n"
+            "{\n"
+            '  "plan": "updated lesson plan text",\n'
+            '  "improvements": [\n'
+            '    {"text": "what changed", "area": "topic area", "priority": 1-5}\n'
+            "  ],\n"
+            '  "focus_next": ["topic1", "topic2"],  // areas to focus on next\n'
+            '  "exercise": {"title": "string", "steps": ["step1", ...]}\n'
+            "}\n\n"
+            f"Rules:\n"
+            f"1. Only suggest substantive changes that clearly improve the plan\n"
+            f"2. Focus on the specified areas if provided\n"
+            f"3. Build on what worked in history, avoid repeating failed approaches\n"
+            f"4. Keep changes minimal but impactful\n"
+            f"5. Output ONLY the JSON object\n"),
+    ], model=model)
+
+
+def get_analyst_prompt(example: str, skill_summary: str, focus_areas: list[str] | None = None, max_items: int = 5,
+                       model: Optional[str] = None) -> Prompt:
     """Prompt to extract common misconceptions from a given OS example or explanation and return JSON.
 
     If `focus_areas` is provided, the analyst should prioritize those topics and return concise items.
+    When `example` is the current lesson plan, the prompt shares its prefix with
+    the evaluator/optimizer prompts for the same plan.
     """
-    focus_section = ""
-    if focus_areas:
-        focus_section = "Focus areas (prioritize these):\n- " + "\n- ".join(focus_areas) + "\n\n"
+    focus_items = ["- " + str(f) + "\n" for f in (focus_areas or [])]
 
-    return (
-        f"You are an instructional analyst for Operating Systems. Given the following short context or example, identify the top likely misconceptions students may have. Be concise and return at most {max_items} items.\n\n"
-        f"Student Skill Profile: {skill_summary}\n\n"
-        f"{focus_section}"
-        f"Context:\n{example}\n\n"
-        f"Return a JSON object exactly in this form (no extra text): {{\"misconceptions\": [\"...\", ...]}}."
-    )
+    return build_prompt(_prefix_sections(example, skill_summary), [
+        Section("task", f"Task: act as an instructional analyst. Given the lesson plan above, identify the top likely misconceptions students may have. Be concise and return at most {max_items} items.\n\n"),
+        Section("focus_areas", focus_items, priority=1, kind="list",
+                header="Focus areas (prioritize these):\n", footer="\n"),
+        Section("output_format", "Return a JSON object exactly in this form (no extra text): {\"misconceptions\": [\"...\", ...]}."),
+    ], model=model)
 
 
-def get_question_generation_prompt(lesson_plan: str, level: Literal["easy", "intermediate", "hard"], n: int = 10) -> str:
+def get_question_generation_prompt(lesson_plan: str, level: Literal["easy", "intermediate", "hard"], n: int = 10,
+                                    model: Optional[str] = None) -> Prompt:
     """Return a prompt that asks the LLM to generate `n` DB-formatted multiple-choice questions.
 
     Each question must be a JSON object with the following fields:
@@ -149,23 +182,25 @@ def get_question_generation_prompt(lesson_plan: str, level: Literal["easy", "int
     If it cannot produce exactly `n`, it should produce as many as it can, but still return a JSON array.
     """
 
-    return (
-        "You are an expert Operating Systems question-writer.\n\n"
-        f"Generate {n} multiple-choice questions suitable for the following lesson plan and student level.\n\n"
-        f"Lesson Plan:\n{lesson_plan}\n\n"
-        f"Target Level: {level}\n\n"
-        "Output format requirements:\n"
-        "- Return ONLY a single JSON array (no extra text).\n"
-        "- Each item in the array must be an object with exactly these fields: id, topic, level, question, options, answer, explanation.\n"
-        "- `options` should contain 3 to 5 distinct strings.\n"
-        "- `answer` must exactly equal one of the strings in `options`.\n"
-        "- Keep the language concise and clear, suitable for learners.\n\n"
-        "Example of one item (for clarity, do not include trailing comments in actual output):\n"
-        "{"
-        "\"id\": \"q1\", \"topic\": \"Processes\", \"level\": \"easy\", \"question\": \"What is a process?\", \"options\": [\"A program in execution\", \"An instruction\", \"A file\"], \"answer\": \"A program in execution\", \"explanation\": \"A process is an instance of a program in execution.\"}"
-        "\n\n"
-        "Return ONLY the JSON array."
-    )
+    return build_prompt([], [
+        Section("role",
+            "You are an expert Operating Systems question-writer.\n\n"
+            f"Generate {n} multiple-choice questions suitable for the following lesson plan and student level.\n\n"),
+        Section("lesson_plan", lesson_plan, priority=1, kind="plan", header="Lesson Plan:\n", footer="\n\n"),
+        Section("output_format",
+            f"Target Level: {level}\n\n"
+            "Output format requirements:\n"
+            "- Return ONLY a single JSON array (no extra text).\n"
+            "- Each item in the array must be an object with exactly these fields: id, topic, level, question, options, answer, explanation.\n"
+            "- `options` should contain 3 to 5 distinct strings.\n"
+            "- `answer` must exactly equal one of the strings in `options`.\n"
+            "- Keep the language concise and clear, suitable for learners.\n\n"
+            "Example of one item (for clarity, do not include trailing comments in actual output):\n"
+            "{"
+            "\"id\": \"q1\", \"topic\": \"Processes\", \"level\": \"easy\", \"question\": \"What is a process?\", \"options\": [\"A program in execution\", \"An instruction\", \"A file\"], \"answer\": \"A program in execution\", \"explanation\": \"A process is an instance of a program in execution.\"}"
+            "\n\n"
+            "Return ONLY the JSON array."),
+    ], model=model)
 
 # if _name_ == "_main_":
 #     # quick sanity check example
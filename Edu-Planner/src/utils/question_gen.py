@@ -0,0 +1,212 @@
+"""Sharded, concurrent question generation.
+
+A request for many questions is split into shards of at most
+`question_generation.shard_size` questions, each covering a slice of the
+plan's chapters, and the shards run concurrently. Items are parsed one by
+one (a malformed item no longer loses the whole array), validated, and
+de-duplicated across shards and the existing bank. Each shard's items are
+handed to the store as soon as that shard finishes, and a shard that comes
+back short is retried on its own for the missing questions.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from core.records import Question, RecordError
+from utils.cascade import call_cascade
+from utils import codec
+from utils.config import get_setting
+from utils.io import append_questions_to_level, save_generated_questions
+from utils.plan_delta import split_chapters
+from utils.prompts import get_question_generation_prompt
+from utils.structured import parse_json
+from utils.tracing import span
+
+def _norm(text: Any) -> str:
+    return ' '.join(str(text or '').lower().split())
+
+
+def plan_shards(plan: str, n: int, shard_size: int) -> List[Dict[str, Any]]:
+    """Split `n` questions into shards, each with the chapters it should cover.
+
+    Chapters are dealt out round-robin so every shard gets a distinct slice of
+    the plan (and a shorter prompt); with fewer chapters than shards, shards
+    share chapters.
+    """
+    count = max(1, -(-n // max(1, shard_size)))
+    chapters = [h + "\n" + "\n".join(body) if h else "\n".join(body) for h, body in split_chapters(plan)]
+    shards = []
+    for i in range(count):
+        size = n // count + (1 if i < n % count else 0)
+        if not chapters:
+            text = plan
+        elif len(chapters) >= count:
+            text = "\n".join(chapters[i::count])
+        else:
+            text = chapters[i % len(chapters)]
+        shards.append({"shard": i, "n": size, "plan": text})
+    return shards
+
+
+def parse_items(response: str, record: bool = True) -> List[Any]:
+    """The question objects in `response`: the (repaired) JSON array if there
+    is one, else every top-level JSON object, skipping malformed ones."""
+    parsed = parse_json(response, "question_generation", record=record)
+    if isinstance(parsed, dict) and isinstance(parsed.get('questions'), list):
+        parsed = parsed['questions']
+    if isinstance(parsed, list):
+        return [item for item in parsed if isinstance(item, dict)]
+    decoder = json.JSONDecoder()
+    items: List[Any] = []
+    pos = response.find('{')
+    while pos != -1:
+        try:
+            obj, end = decoder.raw_decode(response, pos)
+        except ValueError:
+            pos = response.find('{', pos + 1)
+            continue
+        if isinstance(obj, dict):
+            items.append(obj)
+        pos = response.find('{', end)
+    return items
+
+
+def normalise_question(item: Any, level: str) -> Optional[Dict[str, Any]]:
+    """A question dict with every required key, or None if it is unusable."""
+    try:
+        return Question.from_dict(item, level).to_dict()
+    except RecordError:
+        return None
+
+
+def check_shard(response: str, level: str, n: int) -> Optional[str]:
+    """Cascade validator: None when at least half of the `n` requested questions are valid."""
+    valid = sum(1 for item in parse_items(response, record=False) if normalise_question(item, level) is not None)
+    return None if valid * 2 >= n else f"too_few_valid: {valid}/{n}"
+
+
+class GeneratedQuestionStore:
+    """Persists generated questions as they arrive (per-user file + level bank)."""
+
+    def __init__(self, level: str, filename: Optional[str] = None, append_to_bank: bool = True):
+        self.level = level
+        self.filename = filename
+        self.append_to_bank = append_to_bank
+        self.questions: List[Dict[str, Any]] = []
+        self.appended = 0
+        self._lock = threading.Lock()
+
+    def add(self, items: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.questions.extend(items)
+            if self.filename:
+                save_generated_questions(self.filename, self.questions)
+            if self.append_to_bank:
+                self.appended += append_questions_to_level(self.level, items)
+
+
+def _existing_questions(level: str) -> tuple[set, set]:
+    """(normalised question texts, ids) already in the level's bank."""
+    p = Path(__file__).resolve().parents[2] / 'data' / f"os_questions_{level}.json"
+    data = codec.read_json(p, [])
+    data = [q for q in data if isinstance(q, dict)] if isinstance(data, list) else []
+    return {_norm(q.get('question')) for q in data}, {str(q['id']) for q in data if q.get('id')}
+
+
+def generate_questions(plan: str, level: str, n: int,
+                       store: Optional[GeneratedQuestionStore] = None,
+                       concurrency: Optional[int] = None,
+                       shard_size: Optional[int] = None,
+                       retries: Optional[int] = None,
+                       llm: Optional[Callable[..., str]] = None,
+                       on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Generate up to `n` new questions for `level` from `plan`.
+
+    Returns {"questions", "requested", "shards", "retries", "failed_shards",
+    "duplicates", "invalid", "elapsed_s"}. Questions already in the level's
+    bank or produced by another shard count as duplicates.
+    """
+    concurrency = int(concurrency or get_setting('question_generation.concurrency', 4))
+    shard_size = int(shard_size or get_setting('question_generation.shard_size', 10))
+    retries = int(get_setting('question_generation.retries', 2) if retries is None else retries)
+    store = store or GeneratedQuestionStore(level)
+
+    started = time.perf_counter()
+    seen, seen_ids = _existing_questions(level)
+    stats = {"shards": 0, "retries": 0, "failed_shards": 0, "duplicates": 0, "invalid": 0}
+
+    def run(shard: Dict[str, Any]) -> List[Any]:
+        with span("question_gen.shard", cat="agent", shard=shard["shard"], n=shard["n"], attempt=shard["attempt"]):
+            prompt = get_question_generation_prompt(shard["plan"], level, shard["n"])
+            if llm is not None:
+                return parse_items(llm(prompt, profile="question_generation"))
+            return parse_items(call_cascade(prompt, profile="question_generation",
+                                            validate=lambda r: check_shard(r, level, shard["n"])))
+
+    def submit(shard: Dict[str, Any]):
+        # each shard runs in a copy of this context: keeps the LLM session and trace
+        return pool.submit(contextvars.copy_context().run, run, shard)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="qgen")
+    try:
+        pending = {}
+        for shard in plan_shards(plan, n, shard_size):
+            shard = dict(shard, attempt=0)
+            pending[submit(shard)] = shard
+            stats["shards"] += 1
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                shard = pending.pop(fut)
+                try:
+                    raw = fut.result()
+                except Exception as e:
+                    print(f"Question shard {shard['shard']} failed: {e}")
+                    raw = []
+                accepted = []
+                for item in raw:
+                    q = normalise_question(item, level)
+                    if q is None:
+                        stats["invalid"] += 1
+                        continue
+                    key = _norm(q['question'])
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    # shards all number their items q1, q2, ...: keep ids unique (the bank dedupes by id)
+                    if not q.get('id') or str(q['id']) in seen_ids:
+                        q['id'] = f"gen-{level}-{uuid.uuid4().hex[:8]}"
+                    seen_ids.add(str(q['id']))
+                    accepted.append(q)
+                    if len(accepted) >= shard["n"]:
+                        break
+                if accepted:
+                    store.add(accepted)
+                missing = shard["n"] - len(accepted)
+                if missing > 0:
+                    if shard["attempt"] < retries:
+                        stats["retries"] += 1
+                        retry = dict(shard, n=missing, attempt=shard["attempt"] + 1)
+                        pending[submit(retry)] = retry
+                    else:
+                        stats["failed_shards"] += 1
+                if on_progress:
+                    on_progress({"shard": shard["shard"], "accepted": len(accepted),
+                                 "total": len(store.questions), "requested": n})
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return dict(stats, questions=list(store.questions), requested=n, appended=store.appended,
+                elapsed_s=round(time.perf_counter() - started, 3))
+
+
+__all__ = ["generate_questions", "plan_shards", "parse_items", "normalise_question", "check_shard",
+           "GeneratedQuestionStore"]
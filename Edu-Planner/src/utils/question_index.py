@@ -0,0 +1,106 @@
+"""Relevance-ranked selection of sample questions from the level banks.
+
+`data/os_questions_<level>.json` are indexed once per process (BM25 over
+topic, question and explanation) and re-indexed only when a bank file
+changes, e.g. after `append_questions_to_level`. `select_relevant_questions`
+then returns the top-k questions for a lesson plan's chapters and the
+student's weakest skill dimensions, instead of random padding.
+"""
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.records import Question, decode_questions
+from utils import codec
+from utils.errordb import plan_chapters
+from utils.retrieval import BM25Index
+
+LEVELS = ("easy", "intermediate", "hard")
+
+
+def _bank_path(level: str) -> Path:
+    return Path(__file__).resolve().parents[2] / 'data' / f"os_questions_{level}.json"
+
+
+class QuestionIndex:
+    """BM25 index over every question bank, remembering each question's level."""
+
+    def __init__(self, banks: Dict[str, List[Question]]):
+        self.questions: List[Question] = []
+        self.levels: List[str] = []
+        self.index = BM25Index()
+        seen = set()
+        for level, items in banks.items():
+            for q in items:
+                text = q.question
+                if text in seen:
+                    continue
+                seen.add(text)
+                self.questions.append(q)
+                self.levels.append(level)
+                # topic twice: it is the most reliable signal of what a question covers
+                topic = q.topic or ''
+                self.index.add(f"{topic} {topic} {text} {q.explanation or ''}")
+
+    def search(self, query: str, k: int = 5, level: Optional[str] = None,
+               max_per_topic: int = 2) -> List[Question]:
+        """Top `k` questions for `query`, at most `max_per_topic` from any one topic."""
+        allowed = None
+        if level:
+            allowed = {i for i, lvl in enumerate(self.levels) if lvl == level}
+        picked: List[Question] = []
+        per_topic: Dict[str, int] = {}
+        for doc_id, _score in self.index.search(query, k=max(k * 8, 40), allowed=allowed):
+            q = self.questions[doc_id]
+            topic = str(q.get('topic') or '')
+            if per_topic.get(topic, 0) >= max_per_topic:
+                continue
+            per_topic[topic] = per_topic.get(topic, 0) + 1
+            picked.append(q)
+            if len(picked) >= k:
+                break
+        return picked
+
+
+_index: Optional[QuestionIndex] = None
+_index_stamp: Optional[tuple] = None
+_lock = threading.Lock()
+
+
+def _banks_stamp() -> tuple:
+    return tuple(_bank_path(l).stat().st_mtime if _bank_path(l).exists() else None for l in LEVELS)
+
+
+def get_question_index() -> QuestionIndex:
+    """Process-wide index over all level banks; rebuilt only when a bank file changes."""
+    global _index, _index_stamp
+    stamp = _banks_stamp()
+    with _lock:
+        if _index is None or stamp != _index_stamp:
+            banks = {}
+            for level in LEVELS:
+                data = codec.read_json(_bank_path(level), [])
+                # slotted records: the index holds every bank in memory
+                banks[level], _errors = decode_questions(data if isinstance(data, list) else [],
+                                                         source=_bank_path(level).name)
+            _index, _index_stamp = QuestionIndex(banks), stamp
+        return _index
+
+
+def select_relevant_questions(lesson_plan: str, skill_tree=None, k: int = 5,
+                              level: Optional[str] = None) -> List[Question]:
+    """Pick the `k` bank questions most relevant to the plan and the student's weak areas.
+
+    The query is the plan's chapter headings plus the weakest skill
+    dimensions, which are weighted three times so they dominate broad plans.
+    """
+    weak = skill_tree.weakest_dimensions() if skill_tree is not None else []
+    query = ' '.join([d.replace('_', ' ') for d in weak] * 3 + plan_chapters(lesson_plan))
+    if not query.strip():
+        query = lesson_plan or ""
+    return get_question_index().search(query, k=k, level=level)
+
+
+__all__ = ["QuestionIndex", "get_question_index", "select_relevant_questions"]
@@ -0,0 +1,211 @@
+"""Speculative generation of a user's next personalised quiz.
+
+When a new best plan is persisted, `schedule()` queues generation of the
+next question set for it on a background thread, at the scheduler's
+background priority. The set is cached in memory and under
+cache/quizzes/ keyed by (user, plan hash, level). Only the newest plan
+counts: scheduling a different plan for the same user and level discards
+the older set, including one still being generated. `get()` serves the set
+only if it was made from the plan the student is being quizzed on. If that
+set is still being generated, `get()` waits for it rather than starting a
+second generation.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from llm import llm_session
+from utils import codec
+from utils.config import get_setting
+from utils.io import update_user_best_plan_if_higher
+from utils.question_gen import GeneratedQuestionStore, generate_questions
+from utils.scheduler import llm_priority
+
+
+def plan_hash(plan: str) -> str:
+    return hashlib.sha1((plan or "").encode('utf-8')).hexdigest()[:16]
+
+
+class _Job:
+    __slots__ = ("user_id", "level", "plan", "plan_hash", "n", "done", "questions", "state")
+
+    def __init__(self, user_id: str, level: str, plan: str, n: int):
+        self.user_id = user_id
+        self.level = level
+        self.plan = plan
+        self.plan_hash = plan_hash(plan)
+        self.n = n
+        self.done = threading.Event()
+        self.questions: Optional[List[Dict[str, Any]]] = None
+        # queued -> running -> ready | failed | stale
+        self.state = "queued"
+
+
+class QuizPrefetcher:
+    """Background quiz generation with a per-(user, level) cache (see module docstring)."""
+
+    def __init__(self, cache_dir: Optional[Path] = None, n: int = 10,
+                 generate: Callable[..., Dict[str, Any]] = generate_questions):
+        self.cache_dir = Path(cache_dir) if cache_dir else Path(__file__).resolve().parents[2] / 'cache' / 'quizzes'
+        self.n = n
+        self.generate = generate
+        # (user, level) -> newest job for that pair (queued, running or finished)
+        self._jobs: Dict[tuple, _Job] = {}
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self.counters = {"scheduled": 0, "generated": 0, "stale": 0, "hits": 0, "misses": 0, "waited": 0}
+
+    def _path(self, user_id: str, level: str) -> Path:
+        safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', user_id)
+        return self.cache_dir / f"{safe}-{level}.json"
+
+    def schedule(self, user_id: str, plan: str, level: str, n: Optional[int] = None) -> bool:
+        """Queue generation for `plan` unless a set for it exists or is on its way.
+
+        Returns True if a job was queued.
+        """
+        if not plan:
+            return False
+        job = _Job(user_id, level, plan, int(n or self.n))
+        key = (user_id, level)
+        with self._lock:
+            current = self._jobs.get(key)
+            if current is not None and current.plan_hash == job.plan_hash and current.state != "failed":
+                return False
+            if current is None and self._read(user_id, level, job.plan_hash) is not None:
+                return False
+            if current is not None and not current.done.is_set():
+                # generation for an older plan: its result is dropped when it finishes
+                current.state = "stale"
+                self.counters["stale"] += 1
+            self._jobs[key] = job
+            self.counters["scheduled"] += 1
+            self._ensure_worker()
+        self._remove_file(user_id, level)
+        self._queue.put(job)
+        return True
+
+    def get(self, user_id: str, plan: str, level: str, n: Optional[int] = None,
+            wait_s: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """The prefetched questions for exactly this plan (at most `n`), or None.
+
+        Waits up to `wait_s` (default `quiz_prefetch.wait_s`) when the set is
+        still being generated.
+        """
+        h = plan_hash(plan)
+        with self._lock:
+            job = self._jobs.get((user_id, level))
+        if job is not None and job.plan_hash == h and job.state in ("queued", "running"):
+            wait_s = float(get_setting('quiz_prefetch.wait_s', 600) if wait_s is None else wait_s)
+            self.counters["waited"] += 1
+            job.done.wait(wait_s)
+        questions = job.questions if job is not None and job.plan_hash == h and job.state == "ready" else None
+        if questions is None:
+            questions = self._read(user_id, level, h)
+        if not questions:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return questions[:n] if n else list(questions)
+
+    def invalidate(self, user_id: str, level: str) -> None:
+        with self._lock:
+            job = self._jobs.pop((user_id, level), None)
+            if job is not None and not job.done.is_set():
+                job.state = "stale"
+        self._remove_file(user_id, level)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j.state in ("queued", "running"))
+            return dict(self.counters, pending=pending)
+
+    def _read(self, user_id: str, level: str, h: str) -> Optional[List[Dict[str, Any]]]:
+        data = codec.read_json(self._path(user_id, level))
+        if isinstance(data, dict) and data.get('plan_hash') == h and isinstance(data.get('questions'), list):
+            return data['questions']
+        return None
+
+    def _remove_file(self, user_id: str, level: str) -> None:
+        try:
+            self._path(user_id, level).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _ensure_worker(self) -> None:
+        # caller holds the lock; a daemon thread so a CLI run can exit mid-generation
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="quiz-prefetch", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.state == "stale":
+                    job.done.set()
+                    continue
+                job.state = "running"
+            try:
+                store = GeneratedQuestionStore(job.level, append_to_bank=False)
+                with llm_priority("background"), llm_session(f"prefetch:{job.user_id}"):
+                    result = self.generate(job.plan, job.level, job.n, store=store)
+                questions = result.get('questions') or []
+            except Exception as e:
+                print(f"Quiz prefetch for {job.user_id} failed: {e}")
+                questions = []
+            with self._lock:
+                if job.state == "stale":
+                    job.done.set()
+                    continue
+                job.questions = questions
+                job.state = "ready" if questions else "failed"
+                if questions:
+                    self.counters["generated"] += 1
+                    self._write(job)
+            job.done.set()
+
+    def _write(self, job: _Job) -> None:
+        path = self._path(job.user_id, job.level)
+        tmp = path.with_suffix('.tmp')
+        codec.write_json(tmp, {"user_id": job.user_id, "level": job.level, "plan_hash": job.plan_hash,
+                               "created": time.time(), "questions": job.questions})
+        os.replace(tmp, path)
+
+
+_prefetcher: Optional[QuizPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> QuizPrefetcher:
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = QuizPrefetcher(n=int(get_setting('quiz_prefetch.questions', 10)))
+        return _prefetcher
+
+
+def prefetch_enabled() -> bool:
+    return bool(get_setting('quiz_prefetch.enabled', True))
+
+
+def save_best_plan(user_id: str, entry: Dict[str, Any], level: str) -> bool:
+    """`update_user_best_plan_if_higher`, and when `entry` became the user's
+    best plan, schedule the quiz for it. Every place that saves a best plan
+    goes through here."""
+    if not update_user_best_plan_if_higher(user_id, entry):
+        return False
+    if prefetch_enabled():
+        get_prefetcher().schedule(user_id, entry["plan"], level)
+    return True
+
+
+__all__ = ["QuizPrefetcher", "get_prefetcher", "prefetch_enabled", "plan_hash", "save_best_plan"]
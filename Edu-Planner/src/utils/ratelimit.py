@@ -0,0 +1,198 @@
+"""Token-bucket rate limits and LLM token quotas for the backend.
+
+Two kinds of bucket, both per user:
+
+- request buckets per endpoint (`ratelimit.endpoints.<name>`, falling back
+  to `default`): `burst` requests at once, refilled at `per_minute`;
+- one LLM token bucket (`ratelimit.llm_tokens`): requests to endpoints
+  marked `llm: true` are refused while it is empty, and after each such
+  request the tokens Ollama actually processed (prompt tokens evaluated plus
+  tokens generated) are taken from it. The bucket may go negative, so one
+  expensive request is paid for by waiting longer before the next.
+
+Buckets live in process memory, or in a SQLite file shared by all backend
+workers on the host (`ratelimit.store: sqlite`).
+"""
+from __future__ import annotations
+
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from utils.config import get_setting
+
+
+class MemoryBucketStore:
+    """Bucket levels in this process, least recently used keys evicted."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float,
+             allow_debt: bool = False, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Refill, then take `cost` tokens if there are enough (or always with
+        `allow_debt`); returns (taken, level afterwards)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            level, updated = self._buckets.pop(key, (capacity, now))
+            level, taken = _take(level, updated, now, capacity, rate, cost, allow_debt)
+            self._buckets[key] = (level, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return taken, level
+
+
+class SQLiteBucketStore:
+    """Bucket levels in a SQLite file, so every worker process on the host shares them."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, level REAL, updated REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: float, rate: float, cost: float,
+             allow_debt: bool = False, now: Optional[float] = None) -> Tuple[bool, float]:
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT level, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            level, updated = row if row else (capacity, now)
+            level, taken = _take(level, updated, now, capacity, rate, cost, allow_debt)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)", (key, level, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return taken, level
+
+
+def _take(level: float, updated: float, now: float, capacity: float, rate: float,
+          cost: float, allow_debt: bool) -> Tuple[float, bool]:
+    level = min(capacity, level + max(0.0, now - updated) * rate)
+    if level >= cost or allow_debt:
+        return level - cost, True
+    return level, False
+
+
+class Limit:
+    """What a bucket allowed, and the RateLimit-* headers describing it."""
+
+    def __init__(self, name: str, allowed: bool, capacity: float, rate: float, level: float, cost: float = 1.0):
+        self.name = name
+        self.allowed = allowed
+        self.capacity = capacity
+        self.rate = rate
+        self.level = level
+        self.cost = cost
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds until the bucket holds `cost` tokens again."""
+        return max(1, math.ceil((self.cost - self.level) / self.rate)) if self.rate > 0 else 3600
+
+    @property
+    def reset(self) -> int:
+        """Seconds until the bucket is full."""
+        return max(0, math.ceil((self.capacity - self.level) / self.rate)) if self.rate > 0 else 0
+
+    def headers(self, prefix: str = "RateLimit") -> Dict[str, str]:
+        headers = {
+            f"{prefix}-Limit": str(int(self.capacity)),
+            f"{prefix}-Remaining": str(max(0, int(self.level))),
+            f"{prefix}-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    """Per-user request buckets per endpoint plus an LLM token bucket (see module docstring)."""
+
+    def __init__(self, endpoints: Dict[str, Dict[str, Any]], llm_tokens: Dict[str, Any], store: Any):
+        self.endpoints = endpoints
+        self.llm_capacity = float(llm_tokens.get('burst', 60_000))
+        self.llm_rate = float(llm_tokens.get('per_hour', 120_000)) / 3600.0
+        self.store = store
+
+    def _endpoint(self, endpoint: str) -> Dict[str, Any]:
+        return self.endpoints.get(endpoint) or self.endpoints.get('default') or {"burst": 60, "per_minute": 120}
+
+    def uses_llm(self, endpoint: str) -> bool:
+        return bool(self._endpoint(endpoint).get('llm'))
+
+    def check(self, user: str, endpoint: str) -> Tuple[Limit, Optional[Limit]]:
+        """Take one request from the user's bucket for `endpoint`; for LLM
+        endpoints also check the token quota. Returns (request limit, LLM limit
+        or None); the request is allowed when every returned limit allows it."""
+        cfg = self._endpoint(endpoint)
+        capacity, rate = float(cfg.get('burst', 60)), float(cfg.get('per_minute', 120)) / 60.0
+        bucket = endpoint if endpoint in self.endpoints else 'default'
+        llm = None
+        if cfg.get('llm'):
+            # peek first: a request refused for lack of LLM tokens keeps its request token
+            _, level = self.store.take(f"llm:{user}", self.llm_capacity, self.llm_rate, 0.0)
+            llm = Limit("llm_tokens", level > 0, self.llm_capacity, self.llm_rate, level, cost=1.0)
+            if not llm.allowed:
+                _, req_level = self.store.take(f"req:{bucket}:{user}", capacity, rate, 0.0)
+                return Limit(bucket, True, capacity, rate, req_level), llm
+        allowed, level = self.store.take(f"req:{bucket}:{user}", capacity, rate, 1.0)
+        return Limit(bucket, allowed, capacity, rate, level), llm
+
+    def charge_llm(self, user: str, tokens: int) -> Limit:
+        """Take the tokens a finished request used from the user's LLM bucket."""
+        _, level = self.store.take(f"llm:{user}", self.llm_capacity, self.llm_rate, float(tokens), allow_debt=True)
+        return Limit("llm_tokens", True, self.llm_capacity, self.llm_rate, level)
+
+    def usage(self, user: str) -> Dict[str, Any]:
+        """Current levels of the user's buckets (no tokens taken)."""
+        out = {}
+        for name, cfg in self.endpoints.items():
+            capacity, rate = float(cfg.get('burst', 60)), float(cfg.get('per_minute', 120)) / 60.0
+            _, level = self.store.take(f"req:{name}:{user}", capacity, rate, 0.0)
+            out[name] = {"remaining": max(0, int(level)), "limit": int(capacity), "per_minute": cfg.get('per_minute')}
+        _, level = self.store.take(f"llm:{user}", self.llm_capacity, self.llm_rate, 0.0)
+        out["llm_tokens"] = {"remaining": int(level), "limit": int(self.llm_capacity),
+                             "per_hour": int(self.llm_rate * 3600)}
+        return out
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter built from the `ratelimit` settings."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            if get_setting('ratelimit.store', 'memory') == 'sqlite':
+                path = Path(str(get_setting('ratelimit.sqlite_path', 'cache/ratelimit.sqlite')))
+                if not path.is_absolute():
+                    path = Path(__file__).resolve().parents[2] / path
+                store: Any = SQLiteBucketStore(path)
+            else:
+                store = MemoryBucketStore()
+            _limiter = RateLimiter(get_setting('ratelimit.endpoints', None) or {},
+                                   get_setting('ratelimit.llm_tokens', None) or {}, store)
+        return _limiter
+
+
+__all__ = ["RateLimiter", "Limit", "MemoryBucketStore", "SQLiteBucketStore", "get_rate_limiter"]
@@ -0,0 +1,105 @@
+"""Small in-memory BM25 index used to answer lookups without an LLM call.
+
+Pure Python (no external dependencies): a postings dict per term, document
+lengths for normalisation, and incremental `add()` so new documents can be
+indexed without a rebuild.
+"""
+from __future__ import annotations
+
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how if in into is it its
+not of on or so such than that the their them then there these they this to was
+were what when where which while who why will with without you your
+""".split())
+
+
+def _stem(token: str) -> str:
+    # crude plural folding: "processes" -> "process", "threads" -> "thread"
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith('sses'):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens with stopwords removed and plurals folded."""
+    return [_stem(t) for t in _TOKEN_RE.findall((text or "").lower())
+            if len(t) > 1 and t not in _STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over short documents, with incremental additions."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_len: List[int] = []
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, text: str) -> int:
+        """Index `text` and return its document id (0-based, in insertion order)."""
+        doc_id = len(self.doc_len)
+        tokens = tokenize(text)
+        for term in tokens:
+            per_doc = self.postings.setdefault(term, {})
+            per_doc[doc_id] = per_doc.get(doc_id, 0) + 1
+        self.doc_len.append(len(tokens))
+        self._total_len += len(tokens)
+        return doc_id
+
+    def idf(self, term: str) -> float:
+        n = len(self.doc_len)
+        df = len(self.postings.get(term, ()))
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def max_score(self, query: str | Iterable[str]) -> float:
+        """Upper bound of `search` scores for `query` (each term saturated in a short document).
+
+        Dividing by it gives scores in [0, 1] that are comparable across
+        queries; unknown query terms still count, lowering the ratio.
+        """
+        terms = tokenize(query) if isinstance(query, str) else list(query)
+        return sum(self.idf(t) for t in terms) * (self.k1 + 1)
+
+    def search(self, query: str | Iterable[str], k: int = 10,
+               allowed: Optional[set] = None) -> List[Tuple[int, float]]:
+        """Return up to `k` (doc_id, score) pairs, best first.
+
+        `query` may be raw text or pre-tokenized terms; repeated terms weigh
+        more. `allowed` restricts the result to those document ids.
+        """
+        if not self.doc_len:
+            return []
+        terms = tokenize(query) if isinstance(query, str) else list(query)
+        avgdl = self._total_len / len(self.doc_len) or 1.0
+        scores: Dict[int, float] = {}
+        weights: Dict[str, int] = {}
+        for t in terms:
+            weights[t] = weights.get(t, 0) + 1
+        for term, qtf in weights.items():
+            per_doc = self.postings.get(term)
+            if not per_doc:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in per_doc.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+__all__ = ["BM25Index", "tokenize"]
@@ -0,0 +1,268 @@
+"""Priority scheduler for LLM calls.
+
+Every `call_llm` takes a slot from the process-wide scheduler before it is
+sent to Ollama. There are `llm.max_concurrent_calls` slots; when they are all
+busy, calls queue and are admitted by:
+
+1. aging: a call that has waited `llm.scheduler.aging_s` or longer goes
+   first (oldest first), whatever its class, so nothing starves;
+2. weighted fair share between priority classes (stride scheduling: a class
+   with weight 8 is admitted 8 times for every admission of a weight-1
+   class), skipping classes that are at their `max_concurrent` cap;
+3. fair share between users within a class (each user's queue is served in
+   turn), so one user's 40-question generation does not hold up another's.
+
+A call's class is its `priority` argument, else the enclosing
+`llm_priority(...)` block, else `llm.scheduler.profiles[<profile>]`, else
+`llm.scheduler.default_class`. The user is the LLM session id. With
+`llm.scheduler.max_wait_s` set, a call that cannot get a slot in time raises
+QueueTimeoutError (a TimeoutError, so the backend answers 504).
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, Optional
+
+from utils.config import get_setting
+
+
+class QueueTimeoutError(TimeoutError):
+    """A call waited longer than its deadline for a scheduler slot."""
+
+
+_current_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('llm_priority', default=None)
+
+
+@contextlib.contextmanager
+def llm_priority(name: str) -> Iterator[None]:
+    """Run every `call_llm` inside the block in priority class `name`."""
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class _Ticket:
+    __slots__ = ("cls", "user", "enqueued", "granted", "event")
+
+    def __init__(self, cls: "_PriorityClass", user: str):
+        self.cls = cls
+        self.user = user
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.event = threading.Event()
+
+
+class _PriorityClass:
+    def __init__(self, name: str, weight: float = 1.0, max_concurrent: int = 0):
+        self.name = name
+        self.weight = max(float(weight), 1e-6)
+        self.max_concurrent = int(max_concurrent or 0)
+        self.pass_value = 0.0
+        # user -> FIFO of waiting tickets; users with nothing queued are removed
+        self.queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.user_pass: Dict[str, float] = {}
+        self.user_vtime = 0.0
+        self.queued = 0
+        self.in_flight = 0
+        self.served = 0
+        self.timeouts = 0
+        self.waits = deque(maxlen=2048)
+
+    def has_room(self) -> bool:
+        return self.max_concurrent <= 0 or self.in_flight < self.max_concurrent
+
+    def push(self, ticket: _Ticket) -> None:
+        q = self.queues.get(ticket.user)
+        if q is None:
+            q = self.queues[ticket.user] = deque()
+            # a user (re)joining starts at the current virtual time: no credit for idle time
+            self.user_pass[ticket.user] = max(self.user_pass.get(ticket.user, 0.0), self.user_vtime)
+        q.append(ticket)
+        self.queued += 1
+
+    def remove(self, ticket: _Ticket) -> None:
+        q = self.queues.get(ticket.user)
+        if q is not None and ticket in q:
+            q.remove(ticket)
+            self.queued -= 1
+            if not q:
+                self._drop_user(ticket.user)
+
+    def pop_fair(self) -> _Ticket:
+        user = min(self.queues, key=lambda u: self.user_pass[u])
+        return self.pop(user)
+
+    def pop(self, user: str) -> _Ticket:
+        q = self.queues[user]
+        ticket = q.popleft()
+        self.queued -= 1
+        self.user_vtime = self.user_pass[user]
+        self.user_pass[user] += 1.0
+        if not q:
+            self._drop_user(user)
+        return ticket
+
+    def _drop_user(self, user: str) -> None:
+        del self.queues[user]
+        if len(self.user_pass) > 2 * len(self.queues) + 64:
+            # forget idle users whose turn has come round (they would rejoin at user_vtime anyway)
+            for u in [u for u, p in self.user_pass.items() if u not in self.queues and p <= self.user_vtime + 1.0]:
+                del self.user_pass[u]
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def q(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else None
+
+        return {
+            "weight": self.weight,
+            "max_concurrent": self.max_concurrent or None,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "waiting_users": len(self.queues),
+            "served": self.served,
+            "timeouts": self.timeouts,
+            "wait_ms": {
+                "mean": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+                "p50": q(0.5),
+                "p95": q(0.95),
+                "max": round(waits[-1] * 1000, 1) if waits else None,
+            },
+        }
+
+
+class LLMScheduler:
+    """Admission control for LLM calls; see the module docstring.
+
+    `slots` <= 0 means no overall cap (calls are still counted per class).
+    """
+
+    def __init__(self, slots: int = 4, classes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 aging_s: float = 30.0, default_class: str = "interactive",
+                 profiles: Optional[Dict[str, str]] = None, max_wait_s: Optional[float] = None):
+        self.slots = int(slots or 0)
+        self.max_wait_s = float(max_wait_s) if max_wait_s else None
+        self.aging_s = float(aging_s)
+        self.default_class = default_class
+        self.profiles = dict(profiles or {})
+        self.classes: Dict[str, _PriorityClass] = {}
+        for name, cfg in (classes or {}).items():
+            cfg = cfg or {}
+            self.classes[name] = _PriorityClass(name, cfg.get('weight', 1.0), cfg.get('max_concurrent', 0))
+        self.classes.setdefault(default_class, _PriorityClass(default_class))
+        self.in_flight = 0
+        self._vtime = 0.0
+        self._lock = threading.Lock()
+
+    def resolve(self, priority: Optional[str] = None, profile: str = "default") -> str:
+        name = priority or _current_priority.get() or self.profiles.get(profile) or self.default_class
+        return name if name in self.classes else self.default_class
+
+    def configure(self, slots: Optional[int] = None) -> None:
+        with self._lock:
+            if slots is not None:
+                self.slots = int(slots)
+            self._dispatch()
+
+    def acquire(self, priority: str, user: str, timeout: Optional[float] = None) -> _Ticket:
+        with self._lock:
+            cls = self.classes[priority]
+            ticket = _Ticket(cls, user)
+            if not cls.queued:
+                # an idle class rejoins at the current virtual time (no saved-up credit)
+                cls.pass_value = max(cls.pass_value, self._vtime)
+            cls.push(ticket)
+            self._dispatch()
+        if not ticket.event.wait(timeout):
+            with self._lock:
+                if not ticket.granted:
+                    cls.remove(ticket)
+                    cls.timeouts += 1
+                    raise QueueTimeoutError(
+                        f"LLM call waited more than {timeout:.1f}s for a slot ({priority}, {self.in_flight} in flight)")
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._lock:
+            ticket.cls.in_flight -= 1
+            self.in_flight -= 1
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, priority: str, user: str, timeout: Optional[float] = None) -> Iterator[_Ticket]:
+        """Hold a slot for the block; `timeout` defaults to `max_wait_s` (None waits indefinitely)."""
+        ticket = self.acquire(priority, user, self.max_wait_s if timeout is None else timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _next(self) -> Optional[_Ticket]:
+        eligible = [c for c in self.classes.values() if c.queued and c.has_room()]
+        if not eligible:
+            return None
+        now = time.monotonic()
+        aged = None
+        for c in eligible:
+            for q in c.queues.values():
+                head = q[0]
+                if now - head.enqueued >= self.aging_s and (aged is None or head.enqueued < aged.enqueued):
+                    aged = head
+        cls = aged.cls if aged is not None else min(eligible, key=lambda c: c.pass_value)
+        self._vtime = cls.pass_value
+        cls.pass_value += 1.0 / cls.weight
+        return cls.pop(aged.user) if aged is not None else cls.pop_fair()
+
+    def _dispatch(self) -> None:
+        # caller holds the lock
+        while self.slots <= 0 or self.in_flight < self.slots:
+            ticket = self._next()
+            if ticket is None:
+                return
+            cls = ticket.cls
+            cls.in_flight += 1
+            cls.served += 1
+            cls.waits.append(time.monotonic() - ticket.enqueued)
+            self.in_flight += 1
+            ticket.granted = True
+            ticket.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slots": self.slots or None,
+                "in_flight": self.in_flight,
+                "aging_s": self.aging_s,
+                "classes": {name: c.stats() for name, c in self.classes.items()},
+            }
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Process-wide scheduler built from `llm.max_concurrent_calls` and `llm.scheduler`."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                slots=int(get_setting('llm.max_concurrent_calls', 0) or 0),
+                classes=get_setting('llm.scheduler.classes', None) or {"interactive": {"weight": 8},
+                                                                       "background": {"weight": 1}},
+                aging_s=float(get_setting('llm.scheduler.aging_s', 30)),
+                default_class=str(get_setting('llm.scheduler.default_class', 'interactive')),
+                profiles=get_setting('llm.scheduler.profiles', None) or {},
+                max_wait_s=get_setting('llm.scheduler.max_wait_s', None),
+            )
+        return _scheduler
+
+
+__all__ = ["LLMScheduler", "QueueTimeoutError", "get_scheduler", "llm_priority"]
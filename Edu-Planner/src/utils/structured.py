@@ -0,0 +1,269 @@
+"""JSON schemas for agent output, and a local repair pass for broken JSON.
+
+For the profiles in `llm.structured_output.profiles`, `call_llm` sends the
+profile's schema (SCHEMAS) as Ollama's `format` option, so the server
+constrains generation to it (Ollama 0.5+). A server that rejects the schema
+gets none for that model from then on, and the call is sent again without it.
+
+The agents parse responses with `parse_json()`:
+
+1. the whole response, then the span from the first opening bracket to the
+   last closing one, with `json.loads` (what the agents always did);
+2. otherwise a deterministic repair: drop `<think>` blocks and code fences,
+   skip prose before the JSON and after it, drop `//` and `/* */` comments,
+   trailing commas and raw control characters in strings, and close a
+   truncated answer (unterminated string, dangling key, open arrays and
+   objects) and parse that.
+
+Per profile, `structured_stats()` counts responses parsed as is, parsed
+after repair (each one an LLM call the repair saved) and unparseable.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.records import CIDDP_DIMENSIONS, LEVELS
+from utils.config import get_setting
+
+SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "evaluator": {
+        "type": "object",
+        "properties": {
+            "scores": {
+                "type": "object",
+                "properties": {d: {"type": "integer", "minimum": 1, "maximum": 5} for d in CIDDP_DIMENSIONS},
+                "required": list(CIDDP_DIMENSIONS),
+            },
+            "comments": {"type": "object", "additionalProperties": {"type": "string"}},
+            "summary": {"type": "string"},
+        },
+        "required": ["scores"],
+    },
+    "optimizer": {
+        "type": "object",
+        "properties": {
+            "plan": {"type": "string"},
+            "improvements": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"},
+                        "area": {"type": "string"},
+                        "priority": {"type": "integer", "minimum": 1, "maximum": 5},
+                    },
+                    "required": ["text"],
+                },
+            },
+            "focus_next": {"type": "array", "items": {"type": "string"}},
+            "exercise": {
+                "type": "object",
+                "properties": {"title": {"type": "string"}, "steps": {"type": "array", "items": {"type": "string"}}},
+            },
+        },
+        "required": ["plan", "improvements"],
+    },
+    "analyst": {
+        "type": "object",
+        "properties": {"misconceptions": {"type": "array", "items": {"type": "string"}}},
+        "required": ["misconceptions"],
+    },
+    "question_generation": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                "topic": {"type": "string"},
+                "level": {"type": "string", "enum": list(LEVELS)},
+                "question": {"type": "string"},
+                "options": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 5},
+                "answer": {"type": "string"},
+                "explanation": {"type": "string"},
+            },
+            "required": ["id", "topic", "level", "question", "options", "answer", "explanation"],
+        },
+    },
+}
+
+_no_format_models: set = set()
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def output_format(profile: str, model: str) -> Optional[Dict[str, Any]]:
+    """The schema to send as `format` for this call, or None."""
+    if not get_setting('llm.structured_output.enabled', True) or model in _no_format_models:
+        return None
+    if profile not in (get_setting('llm.structured_output.profiles', None) or []):
+        return None
+    return SCHEMAS.get(profile)
+
+
+def format_unsupported(model: str) -> None:
+    """Stop sending schemas for `model` (its server rejected one)."""
+    _no_format_models.add(model)
+
+
+_THINK = re.compile(r'<think>.*?</think>', re.S)
+_FENCE = re.compile(r'```[a-zA-Z]*')
+
+
+def _strip_wrapping(text: str) -> str:
+    text = _THINK.sub('', text)
+    if '</think>' in text:
+        # the chat template opened the think block, only its end is in the response
+        text = text.rsplit('</think>', 1)[1]
+    if '<think>' in text:
+        # reasoning cut off before it ended: whatever came before it is all there is
+        text = text.split('<think>', 1)[0]
+    return _FENCE.sub('', text)
+
+
+def repair_json(text: str) -> Optional[str]:
+    """A loadable JSON text rebuilt from `text`, or None (see the module docstring)."""
+    text = _strip_wrapping(text)
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return None
+    out: List[str] = []
+    stack: List[str] = []
+    # (output length, stack depth) at each comma outside strings: where to cut a broken tail
+    commas: List[Tuple[int, int]] = []
+    in_str = escape = False
+    i, n = min(starts), len(text)
+    while i < n:
+        c = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_str = False
+            elif c < ' ':
+                c = {'\n': '\\n', '\t': '\\t', '\r': '\\r'}.get(c, '')
+            out.append(c)
+            i += 1
+            continue
+        if c == '"':
+            in_str = True
+        elif c == '/' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        elif c == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif c in '{[':
+            stack.append('}' if c == '{' else ']')
+        elif c in '}]':
+            if not stack or c != stack[-1]:
+                break
+            _drop_trailing_comma(out)
+            stack.pop()
+            while commas and commas[-1][1] > len(stack):
+                commas.pop()
+            out.append(c)
+            if not stack:
+                break
+            i += 1
+            continue
+        elif c == ',':
+            commas.append((len(out), len(stack)))
+        out.append(c)
+        i += 1
+    if not stack:
+        return ''.join(out)
+
+    # truncated: close the string, drop an incomplete member, close the containers
+    if in_str:
+        if escape:
+            out.pop()
+        out.append('"')
+    for _ in range(len(commas) + 1):
+        candidate = _close(out, stack)
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            pass
+        if not commas:
+            return None
+        # cut back to the last comma and close the containers still open there
+        cut, depth = commas.pop()
+        del out[cut:]
+        del stack[depth:]
+    return None
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ',':
+        del out[j:]
+
+
+def _close(out: List[str], stack: List[str]) -> str:
+    text = ''.join(out).rstrip().rstrip(',').rstrip()
+    if text.endswith(':'):
+        # a key without its value: drop the key as well
+        text = text[:text.rfind('"', 0, text.rfind('"'))].rstrip().rstrip(',')
+    return text + ''.join(reversed(stack))
+
+
+def _record(profile: str, outcome: str) -> None:
+    with _stats_lock:
+        s = _stats.setdefault(profile, {"parsed": 0, "repaired": 0, "failed": 0})
+        s[outcome] += 1
+
+
+def parse_json(text: str, profile: str = "default", record: bool = True) -> Any:
+    """The JSON value in an LLM response, repaired if needed; None if there is none.
+
+    With `record`, the outcome is counted for `profile` (validators that look
+    at a response before the agent parses it pass False).
+    """
+    value, outcome = _parse(text or "")
+    if record:
+        _record(profile, outcome)
+    return value
+
+
+def _parse(text: str) -> Tuple[Any, str]:
+    try:
+        return json.loads(text), "parsed"
+    except ValueError:
+        pass
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if starts:
+        start = min(starts)
+        end = text.rfind('}' if text[start] == '{' else ']')
+        if end > start:
+            try:
+                return json.loads(text[start:end + 1]), "parsed"
+            except ValueError:
+                pass
+    repaired = repair_json(text)
+    if repaired is not None:
+        try:
+            return json.loads(repaired, strict=False), "repaired"
+        except ValueError:
+            pass
+    return None, "failed"
+
+
+def structured_stats() -> Dict[str, Any]:
+    """Per profile: responses parsed as is, repaired (LLM calls saved) and failed."""
+    with _stats_lock:
+        out: Dict[str, Any] = {p: dict(s) for p, s in _stats.items()}
+    return {"profiles": out, "calls_saved": sum(s["repaired"] for s in out.values()),
+            "schema_disabled_models": sorted(_no_format_models)}
+
+
+__all__ = ["SCHEMAS", "output_format", "format_unsupported", "repair_json", "parse_json", "structured_stats"]
@@ -0,0 +1,207 @@
+"""Token estimation and priority-based prompt budgeting.
+
+`estimate_tokens` is a fast local approximation of a BPE tokenizer (no model
+files needed): words count one token plus one per further 6 letters, digit
+runs one token per 3 digits, every other symbol one token. It errs slightly
+high, which is the safe side for budgeting.
+
+A prompt is assembled from `Section`s. Priority 0 sections (role,
+instructions, output schema) are never touched; when the total is over
+budget, sections are shrunk from the highest priority number down:
+lists (sample questions, history) drop trailing items, lesson plans are
+summarised to their chapter headings plus the first lines of each chapter,
+and free text is cut at a line boundary.
+
+A `Prompt` remembers the model it was budgeted for and its untrimmed
+sections, so `rebudget` can fit it again when it is sent to a model with a
+different context size (the cascade's small model).
+"""
+from __future__ import annotations
+
+import functools
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.config import get_setting
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+_HEADING_RE = re.compile(r"^\s*chapter\s+\d+\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of `text`."""
+    n = 0
+    for piece in _PIECE_RE.findall(text or ""):
+        c = piece[0]
+        if c.isalpha():
+            n += 1 + (len(piece) - 1) // 6
+        elif c.isdigit():
+            n += (len(piece) + 2) // 3
+        else:
+            n += 1
+    return n
+
+
+def context_size(model: Optional[str] = None) -> int:
+    """num_ctx for `model` from `llm.context` (per model, then `default`)."""
+    model = model or get_setting('llm.model', 'deepseek-r1:latest')
+    ctx = get_setting('llm.context', None) or {}
+    return int(ctx.get(model) or ctx.get('default') or 8192)
+
+
+def prompt_budget(model: Optional[str] = None) -> int:
+    """Tokens available to the prompt: num_ctx minus the room kept for the answer."""
+    reserve = int(get_setting('llm.output_reserve_tokens', 3072))
+    return max(256, context_size(model) - reserve)
+
+
+def summarise_plan(plan: str, max_tokens: int) -> str:
+    """Shrink a lesson plan to `max_tokens`, keeping every chapter heading if possible.
+
+    Chapters keep progressively fewer body lines; if even the bare headings
+    do not fit, trailing headings are replaced by a count.
+    """
+    if estimate_tokens(plan) <= max_tokens:
+        return plan
+    lines = [l for l in plan.splitlines() if l.strip()]
+    chapters: List[List[str]] = []
+    for line in lines:
+        if _HEADING_RE.match(line) or not chapters:
+            chapters.append([line])
+        else:
+            chapters[-1].append(line)
+    if len(chapters) < 2:
+        return truncate_text(plan, max_tokens)
+
+    longest = max(len(c) - 1 for c in chapters)
+    for keep in range(longest - 1, -1, -1):
+        text = "\n".join("\n".join(c[:1 + keep]) for c in chapters)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+    headings = [c[0] for c in chapters]
+    while headings and estimate_tokens("\n".join(headings) + f"\n... ({len(chapters) - len(headings)} more chapters)") > max_tokens:
+        headings.pop()
+    return "\n".join(headings) + f"\n... ({len(chapters) - len(headings)} more chapters)" if headings else ""
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Keep the leading lines of `text` that fit in `max_tokens`."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept: List[str] = []
+    used = estimate_tokens("[...]")
+    for line in text.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept + ["[...]"]) if kept else ""
+
+
+class Section:
+    """One named part of a prompt.
+
+    `body` is a string, or a list of item strings for kind="list". `header`
+    and `footer` wrap the body and are dropped with it when it becomes empty.
+    `priority` 0 means required; higher numbers are trimmed first. List
+    sections drop trailing items, or leading ones with `drop_from_start`
+    (e.g. oldest history first).
+    """
+
+    def __init__(self, name: str, body: Any, priority: int = 0, kind: str = "text",
+                 header: str = "", footer: str = "", drop_from_start: bool = False):
+        self.name = name
+        self.body = body
+        self.priority = priority
+        self.kind = kind
+        self.header = header
+        self.footer = footer
+        self.drop_from_start = drop_from_start
+
+    def copy(self) -> "Section":
+        body = list(self.body) if isinstance(self.body, list) else self.body
+        return Section(self.name, body, self.priority, self.kind, self.header, self.footer, self.drop_from_start)
+
+    def render(self) -> str:
+        body = "".join(self.body) if isinstance(self.body, list) else (self.body or "")
+        if not body:
+            return ""
+        return f"{self.header}{body}{self.footer}"
+
+    def shrink_to(self, max_tokens: int) -> None:
+        overhead = estimate_tokens(self.header + self.footer)
+        room = max(0, max_tokens - overhead)
+        if self.kind == "list":
+            while self.body and estimate_tokens(self.render()) > max_tokens:
+                self.body.pop(0 if self.drop_from_start else -1)
+        elif self.kind == "plan":
+            self.body = summarise_plan(self.body, room) if room else ""
+        else:
+            self.body = truncate_text(self.body, room) if room else ""
+
+
+def fit_sections(sections: List[Section], budget: int) -> Dict[str, Any]:
+    """Shrink `sections` in place until their total fits `budget`; returns a token report."""
+    tokens = {s.name: estimate_tokens(s.render()) for s in sections}
+    total = sum(tokens.values())
+    trimmed = []
+    for s in sorted((s for s in sections if s.priority > 0), key=lambda s: -s.priority):
+        if total <= budget:
+            break
+        before = tokens[s.name]
+        s.shrink_to(max(0, before - (total - budget)))
+        tokens[s.name] = estimate_tokens(s.render())
+        total += tokens[s.name] - before
+        trimmed.append(s.name)
+    return {"sections": tokens, "total": total, "budget": budget, "trimmed": trimmed}
+
+
+class Prompt(str):
+    """A prompt string that also carries its per-section token `report`.
+
+    `report["model"]` and `report["num_ctx"]` are what it was budgeted for;
+    `sections` holds the (prefix, suffix) sections before trimming.
+    """
+
+    report: Dict[str, Any]
+    sections: Tuple[List[Section], List[Section]]
+
+
+def build_prompt(prefix: List[Section], suffix: List[Section], model: Optional[str] = None) -> Prompt:
+    """Join budgeted prefix and suffix sections into a `Prompt`.
+
+    The prefix gets a fixed share of the budget (everything except
+    `llm.prompt_suffix_reserve_tokens`), so it is trimmed identically for
+    every agent and stays a cacheable shared prefix; the suffix gets what
+    the prefix left over.
+    """
+    model = model or get_setting('llm.model', 'deepseek-r1:latest')
+    sections = ([s.copy() for s in prefix], [s.copy() for s in suffix])
+    budget = prompt_budget(model)
+    suffix_reserve = min(int(get_setting('llm.prompt_suffix_reserve_tokens', 1024)), budget // 2)
+    prefix_report = fit_sections(prefix, budget - suffix_reserve)
+    suffix_report = fit_sections(suffix, budget - prefix_report["total"])
+
+    prompt = Prompt("".join(s.render() for s in prefix + suffix))
+    prompt.report = {
+        "sections": {**prefix_report["sections"], **suffix_report["sections"]},
+        "total": prefix_report["total"] + suffix_report["total"],
+        "budget": budget,
+        "model": model,
+        "num_ctx": context_size(model),
+        "trimmed": prefix_report["trimmed"] + suffix_report["trimmed"],
+    }
+    prompt.sections = sections
+    return prompt
+
+
+def rebudget(prompt: Prompt, model: str) -> Prompt:
+    """`prompt` fitted again, from its untrimmed sections, to the context of `model`."""
+    prefix, suffix = prompt.sections
+    return build_prompt([s.copy() for s in prefix], [s.copy() for s in suffix], model=model)
+
+
+__all__ = ["estimate_tokens", "context_size", "prompt_budget", "summarise_plan", "truncate_text",
+           "Section", "fit_sections", "Prompt", "build_prompt", "rebudget"]
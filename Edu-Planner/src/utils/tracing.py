@@ -0,0 +1,194 @@
+"""Lightweight span tracing with Chrome trace-event output.
+
+A trace covers one CLI run, batch session or HTTP request
+(`trace_session`). Inside it, `span("name")` blocks and `@traced` functions
+record complete ("X") events with their thread, and the trace is written to
+`tracing.dir` (default cache/traces/) as a Chrome trace-event JSON file when
+the session ends. Open it in chrome://tracing, https://ui.perfetto.dev or
+https://www.speedscope.app for a flame graph.
+
+Only a `tracing.sample_rate` fraction of sessions is traced
+(`EDU_TRACE_SAMPLE_RATE` overrides it; 0 disables tracing). Outside a
+sampled session a span is one context-variable lookup. Worker threads see the
+trace when they run in a copy of the caller's context
+(`contextvars.copy_context().run`).
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.config import get_setting
+
+
+class Trace:
+    """Events of one traced session (thread-safe)."""
+
+    def __init__(self, name: str, max_events: int = 100_000):
+        self.name = name
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.path: Optional[Path] = None
+        self.started_wall = time.time()
+        self._t0 = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._threads: set = set()
+        self._lock = threading.Lock()
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self._t0) / 1000
+
+    def add(self, name: str, cat: str, ts_us: float, dur_us: float, args: Dict[str, Any]) -> None:
+        tid = threading.get_ident()
+        event = {"name": name, "cat": cat, "ph": "X", "ts": round(ts_us, 3), "dur": round(dur_us, 3),
+                 "pid": self._pid, "tid": tid}
+        if args:
+            event["args"] = args
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"session": self.name, "started": self.started_wall, "dropped_events": self.dropped},
+        }
+
+    def write(self, directory: Optional[Path] = None) -> Path:
+        from utils import codec  # keeps this module import-light for llm.py
+        directory = Path(directory or _trace_dir())
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_wall))
+        safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', self.name).strip('_') or 'trace'
+        self.path = directory / f"{safe}-{stamp}-{self._pid}-{id(self) & 0xffff:04x}.json"
+        codec.write_json(self.path, self.to_chrome(), pretty=False)
+        return self.path
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+
+
+def _trace_dir() -> Path:
+    configured = Path(str(get_setting('tracing.dir', 'cache/traces')))
+    return configured if configured.is_absolute() else Path(__file__).resolve().parents[2] / configured
+
+
+def sample_rate() -> float:
+    env = os.environ.get('EDU_TRACE_SAMPLE_RATE')
+    if env:
+        try:
+            return float(env)
+        except ValueError:
+            pass
+    return float(get_setting('tracing.sample_rate', 0.0) or 0.0)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace_session(name: str, rate: Optional[float] = None) -> Iterator[Optional[Trace]]:
+    """Trace the block if it is sampled; yields the Trace (None when not sampled).
+
+    Inside an already traced block this is just a span of the outer trace, so
+    e.g. a batch session run within a traced request shares its file.
+    """
+    outer = _current_trace.get()
+    if outer is not None:
+        with span(name, cat="session"):
+            yield outer
+        return
+    rate = sample_rate() if rate is None else rate
+    if rate <= 0 or random.random() >= rate:
+        yield None
+        return
+    trace = Trace(name, max_events=int(get_setting('tracing.max_events', 100_000)))
+    token = _current_trace.set(trace)
+    try:
+        with span(name, cat="session"):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        try:
+            trace.write()
+        except OSError as e:
+            print(f"Warning: could not write trace for {name}: {e}")
+
+
+class _Span:
+    __slots__ = ("trace", "name", "cat", "args", "start")
+
+    def __init__(self, trace: Trace, name: str, cat: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> Dict[str, Any]:
+        self.start = self.trace.now_us()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.trace.add(self.name, self.cat, self.start, self.trace.now_us() - self.start, self.args)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> Dict[str, Any]:
+        # callers may add attributes to the span; they are discarded
+        return {}
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, cat: str = "app", **args: Any):
+    """Context manager timing the block; yields a dict for extra span args."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, cat, args)
+
+
+def traced(name: Optional[str] = None, cat: str = "app") -> Callable[[Callable], Callable]:
+    """Decorator recording each call of the function as a span."""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            trace = _current_trace.get()
+            if trace is None:
+                return fn(*a, **kw)
+            with _Span(trace, span_name, cat, {}):
+                return fn(*a, **kw)
+        return wrapper
+    return decorator
+
+
+__all__ = ["Trace", "trace_session", "span", "traced", "current_trace", "sample_rate"]
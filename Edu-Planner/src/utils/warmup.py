@@ -0,0 +1,122 @@
+"""Model warm-up and keep-warm management.
+
+Loading deepseek-r1 into memory takes tens of seconds (`load_duration` in
+Ollama's response). `ModelWarmer` pays that once at process start-up: it
+loads every configured model on every routed endpoint with an empty prompt,
+then pings them on a schedule so they never hit their `keep_alive` expiry,
+and reports which models are currently resident (for a readiness probe).
+
+Configuration lives under `llm.warmup` in config/settings.yaml.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from llm import get_router, model_keep_alive, response_field
+from utils.config import get_setting
+from utils.tokens import context_size
+
+
+def configured_models() -> List[str]:
+    """Model names listed under llm.warmup.models (falls back to llm.model),
+    plus the cascade's small model while any profile uses it."""
+    names = []
+    for entry in get_setting('llm.warmup.models', None) or []:
+        name = entry.get('name') if isinstance(entry, dict) else entry
+        if name:
+            names.append(str(name))
+    if not names:
+        names.append(str(get_setting('llm.model', 'deepseek-r1:latest')))
+    small = get_setting('llm.cascade.small_model', '')
+    if small and get_setting('llm.cascade.profiles', None) and str(small) not in names:
+        # otherwise its first cascaded call pays the model load, and /api/ready would not wait for it
+        names.append(str(small))
+    return names
+
+
+class ModelWarmer:
+    """Pre-load models and keep them resident in Ollama."""
+
+    def __init__(self, models: Optional[List[str]] = None, ping_interval_s: Optional[float] = None):
+        self.models = models or configured_models()
+        self.ping_interval_s = float(ping_interval_s or get_setting('llm.warmup.ping_interval_s', 240))
+        self._state: Dict[str, Dict[str, Any]] = {m: {"warm": False} for m in self.models}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def warm(self, model: str) -> bool:
+        """Load (or refresh) one model on every endpoint. An empty prompt loads it without generating."""
+        router = get_router()
+        # load with the same num_ctx call_llm sends, or the first real call reloads the model
+        kwargs = {"options": {"num_ctx": context_size(model)}}
+        keep_alive = model_keep_alive(model)
+        if keep_alive:
+            kwargs['keep_alive'] = keep_alive
+
+        hosts = {}
+        for ep in router.endpoints:
+            started = time.perf_counter()
+            try:
+                response = ep.client.generate(model=model, prompt="", **kwargs)
+                load_ns = response_field(response, 'load_duration') or 0
+                hosts[ep.host] = {
+                    "warm": True,
+                    "ping_s": round(time.perf_counter() - started, 3),
+                    "load_duration_s": round(load_ns / 1e9, 3),
+                }
+            except Exception as e:
+                hosts[ep.host] = {"warm": False, "error": str(e)}
+        update = {
+            "warm": any(h["warm"] for h in hosts.values()),
+            "last_ping": time.time(),
+            "hosts": hosts,
+        }
+        with self._lock:
+            self._state.setdefault(model, {}).update(update)
+        return update["warm"]
+
+    def warm_all(self) -> bool:
+        return all([self.warm(m) for m in self.models])
+
+    def _run(self) -> None:
+        self.warm_all()
+        while not self._stop.wait(self.ping_interval_s):
+            self.warm_all()
+
+    def start(self) -> None:
+        """Warm in a background thread and keep pinging until `stop()`."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        """Per-model readiness: resident on at least one endpoint, plus last warm-up result."""
+        router = get_router()
+        router.check_all()
+        endpoints = router.status()
+        with self._lock:
+            state = {m: dict(s) for m, s in self._state.items()}
+        models = {}
+        for m in self.models:
+            info = state.get(m, {})
+            info["resident_on"] = [ep["host"] for ep in endpoints if ep["healthy"] and m in ep["resident"]]
+            info["resident"] = bool(info["resident_on"])
+            models[m] = info
+        return {
+            "ready": bool(models) and all(v["resident"] for v in models.values()),
+            "models": models,
+            "endpoints": endpoints,
+        }
+
+
+__all__ = ["ModelWarmer", "configured_models"]
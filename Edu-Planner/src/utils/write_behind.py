@@ -0,0 +1,278 @@
+"""Write-behind buffer for the per-user data files written by utils.io.
+
+`save_user_iteration`, `update_user_best_plan_if_higher` and the version
+counter used to read, modify and rewrite their JSON file inline, so every CLI
+iteration and every backend request waited for the disk. They now go through
+`WriteBehindStore`:
+
+- `write()` puts the new contents of a file into an in-memory buffer, keyed
+  by path. A later write to the same file replaces the buffered one, so a
+  burst of updates costs one disk write.
+- `read()` returns the buffered contents while a write is pending and reads
+  the file otherwise (read-your-writes within the process).
+- A daemon thread flushes the buffer every `storage.write_behind.flush_interval_ms`
+  (sooner once `max_pending` files are waiting). Each batch writes every file
+  to a temporary sibling and fsyncs it, then, once all of them are written,
+  renames each over the original with `os.replace` (a reader sees the old
+  file or the new one, never half of it) and fsyncs each directory once for
+  the whole batch. A batch that fails to write replaces nothing.
+- `defer()` runs a callback on the flusher after the next batch (the cohort
+  analytics update, which rewrites cache/analytics.npz).
+- `close()` flushes and stops the thread. It runs at interpreter exit, in the
+  backend's shutdown and after each batch session.
+
+Buffered objects are shared with readers and must not be changed in place:
+writers build a new object (see `update()`). A crash loses at most the last
+flush interval of writes; the files on disk are always complete. With
+`storage.write_behind.enabled: false` every write goes straight to disk the
+same atomic way.
+
+The buffer is per process. Several processes writing the same files (the
+backend with more than one worker, `batch.py --processes`) each keep their
+own, so every file they share (the user's history and best plan, the version
+counters) is written with a `merge` function that combines the buffered
+contents with what is on disk at flush time. The merge, the write and the
+rename of such a file happen under its cross-process lock
+(`utils.file_lock`), so the last process to flush does not drop what the
+others wrote. This holds with write-behind disabled as well.
+"""
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import codec
+from utils.config import get_setting
+from utils.file_lock import file_lock
+
+Merge = Callable[[Any, Any], Any]
+
+
+def _fsync_dir(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # not supported on this platform (Windows)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteBehindStore:
+    """In-memory buffer of pending file contents with a batching flusher (see module docstring)."""
+
+    def __init__(self, enabled: bool = True, flush_interval: float = 0.2, max_pending: int = 64,
+                 fsync: bool = True):
+        self.enabled = enabled
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.max_pending = max(1, int(max_pending))
+        self.fsync = fsync
+        self._pending: Dict[Path, Tuple[Any, Optional[Merge]]] = {}
+        self._deferred: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._path_locks: Dict[Path, threading.RLock] = {}
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"writes": 0, "coalesced": 0, "files_written": 0, "batches": 0, "errors": 0,
+                       "flush_s": 0.0, "last_error": None}
+
+    def path_lock(self, path: Path) -> threading.RLock:
+        """Lock serialising read-modify-write cycles on one file."""
+        with self._lock:
+            return self._path_locks.setdefault(Path(path), threading.RLock())
+
+    def read(self, path: Path, default: Any = None) -> Any:
+        """Pending contents of `path`, else its decoded file, else `default`."""
+        path = Path(path)
+        with self._lock:
+            if path in self._pending:
+                return self._pending[path][0]
+        return codec.read_json(path, default)
+
+    def write(self, path: Path, obj: Any, merge: Optional[Merge] = None) -> None:
+        """Replace the contents of `path` with `obj` (buffered when enabled).
+
+        `merge(on_disk, obj)` is applied at flush time, for files other
+        processes may have changed since `obj` was read.
+        """
+        path = Path(path)
+        if not self.enabled:
+            self._commit([(path, obj, merge)])
+            return
+        with self._lock:
+            self._stats["writes"] += 1
+            if path in self._pending:
+                self._stats["coalesced"] += 1
+            self._pending[path] = (obj, merge)
+            full = len(self._pending) >= self.max_pending
+        self._start()
+        if full:
+            self._wake.set()
+
+    def update(self, path: Path, fn: Callable[[Any], Any], default: Any = None,
+               merge: Optional[Merge] = None) -> Any:
+        """Read-modify-write: `fn(current)` returns the new contents, or None to leave the file alone."""
+        with self.path_lock(path):
+            new = fn(self.read(path, default))
+            if new is not None:
+                self.write(path, new, merge)
+            return new
+
+    def defer(self, fn: Callable[[], None]) -> None:
+        """Run `fn` on the flusher after the next batch (right away when disabled)."""
+        if not self.enabled:
+            fn()
+            return
+        with self._lock:
+            self._deferred.append(fn)
+        self._start()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    @staticmethod
+    def _encode(path: Path, obj: Any, merge: Optional[Merge]) -> bytes:
+        if merge is not None:
+            obj = merge(codec.read_json(path), obj)
+        return codec.dumps_bytes(obj)
+
+    def _commit(self, items: List[Tuple[Path, Any, Optional[Merge]]]) -> None:
+        # merged files stay locked from reading the disk copy until the rename;
+        # sorted so two processes flushing overlapping batches cannot deadlock
+        with ExitStack() as locks:
+            for path in sorted({path for path, _, merge in items if merge is not None}):
+                locks.enter_context(file_lock(path))
+            self._write_files([(path, self._encode(path, obj, merge)) for path, obj, merge in items])
+
+    def _write_files(self, files: List[Tuple[Path, bytes]]) -> None:
+        # temp files first (each fsynced), then the renames, then one fsync per directory.
+        # All or nothing: if any temp file fails, the ones already written are removed
+        # and no file is replaced (the batch stays pending and is retried whole).
+        renames = []
+        try:
+            for path, data in files:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # per process: shared files (user_versions.json) are flushed by several
+                tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+                renames.append((tmp, path))
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+        except BaseException:
+            for tmp, _ in renames:
+                try:
+                    tmp.unlink()
+                except OSError:
+                    pass
+            raise
+        for tmp, path in renames:
+            os.replace(tmp, path)
+        if self.fsync:
+            for directory in {path.parent for path, _ in files}:
+                _fsync_dir(directory)
+
+    def flush(self) -> int:
+        """Write every pending file now and run the deferred tasks; returns how many files were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._pending)
+                deferred, self._deferred = self._deferred, []
+            started = time.perf_counter()
+            written = []
+            if batch:
+                try:
+                    self._commit([(path, obj, merge) for path, (obj, merge) in batch.items()])
+                    written = list(batch)
+                except Exception as e:
+                    # keep everything pending and retry with the next batch
+                    with self._lock:
+                        self._stats["errors"] += 1
+                        self._stats["last_error"] = f"{type(e).__name__}: {e}"
+                    print(f"Warning: write-behind flush failed, will retry: {e}")
+            with self._lock:
+                for path in written:
+                    # unless it was written again while this batch was on its way
+                    if self._pending.get(path, (None,))[0] is batch[path][0]:
+                        del self._pending[path]
+                if written:
+                    self._stats["files_written"] += len(written)
+                    self._stats["batches"] += 1
+                    self._stats["flush_s"] += time.perf_counter() - started
+            # still under the flush lock: a flush() returns only once a batch
+            # already under way (and its deferred tasks) has finished too
+            for fn in deferred:
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Warning: deferred write-behind task failed: {e}")
+            return len(written)
+
+    def close(self) -> None:
+        """Flush what is pending and stop the flusher (writes after this go to disk directly)."""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
+        self.enabled = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats, pending=len(self._pending), deferred=len(self._deferred))
+        out["flush_s"] = round(out["flush_s"], 4)
+        out.update(enabled=self.enabled, flush_interval_ms=int(self.flush_interval * 1000), fsync=self.fsync)
+        return out
+
+
+_store: Optional[WriteBehindStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> WriteBehindStore:
+    """Process-wide store from the `storage.write_behind` settings."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = WriteBehindStore(
+                enabled=bool(get_setting('storage.write_behind.enabled', True)),
+                flush_interval=float(get_setting('storage.write_behind.flush_interval_ms', 200)) / 1000,
+                max_pending=int(get_setting('storage.write_behind.max_pending', 64)),
+                fsync=bool(get_setting('storage.write_behind.fsync', True)),
+            )
+            atexit.register(_store.close)
+        return _store
+
+
+def flush_pending_writes() -> int:
+    """Write everything buffered so far (no-op if nothing was ever written)."""
+    return _store.flush() if _store is not None else 0
+
+
+__all__ = ["WriteBehindStore", "get_store", "flush_pending_writes"]